@@ -0,0 +1,77 @@
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+class QueueFull(Exception):
+    """Raised when a request can't be admitted, carries a retry hint in seconds"""
+    
+    def __init__(self, retry_after):
+        super().__init__(f"Server busy, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+class AdmissionGate:
+    """Bounded admission for LLM calls: a few run, a few wait, the rest get QueueFull"""
+    
+    def __init__(self, max_concurrent=2, max_queued=8, queue_timeout=60):
+        self.max_concurrent = max_concurrent
+        self.max_queued = max_queued
+        self.queue_timeout = queue_timeout
+        self.slots = threading.BoundedSemaphore(max_concurrent)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.waiting = 0
+        self.rejected = 0
+        self.avg_duration = 5.0     # Running average of how long a slot is held (seconds)
+    
+    def retry_after(self):
+        """Estimate when a slot frees up from the queue depth and average call time"""
+        rounds = (self.waiting + 1) / self.max_concurrent
+        return max(1, math.ceil(rounds * self.avg_duration))
+    
+    def acquire(self):
+        """Wait for an LLM slot, raises QueueFull if the queue is full or the wait times out"""
+        with self.lock:
+            if self.active + self.waiting >= self.max_concurrent + self.max_queued:
+                self.rejected += 1
+                raise QueueFull(self.retry_after())
+            self.waiting += 1
+        
+        acquired = self.slots.acquire(timeout=self.queue_timeout)
+        
+        with self.lock:
+            self.waiting -= 1
+            if not acquired:
+                self.rejected += 1
+                raise QueueFull(self.retry_after())
+            self.active += 1
+        
+        return time.perf_counter()
+    
+    def release(self, started=None):
+        """Give the slot back, updating the average hold time"""
+        with self.lock:
+            self.active -= 1
+            if started is not None:
+                self.avg_duration = 0.8 * self.avg_duration + 0.2 * (time.perf_counter() - started)
+        self.slots.release()
+    
+    @contextmanager
+    def admit(self):
+        """Hold an LLM slot for the duration of the block"""
+        started = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(started)
+    
+    def stats(self):
+        """Current queue state"""
+        with self.lock:
+            return {
+                "active": self.active,
+                "waiting": self.waiting,
+                "rejected": self.rejected,
+                "max_concurrent": self.max_concurrent,
+                "max_queued": self.max_queued
+            }
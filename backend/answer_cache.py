@@ -0,0 +1,123 @@
+import re
+import time
+import threading
+from collections import OrderedDict
+import numpy as np
+
+def normalize_question(question):
+    """Lowercase, collapse whitespace and drop trailing punctuation"""
+    question = re.sub(r"\s+", " ", question.strip().lower())
+    return question.rstrip("?!. ")
+
+class AnswerCache:
+    """LRU/TTL cache of answers, with optional reuse for near-identical query embeddings"""
+    
+    def __init__(self, max_entries=256, ttl=3600, semantic_distance=None, version_fn=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.semantic_distance = semantic_distance
+        self.version_fn = version_fn
+        self.version = version_fn() if version_fn else None
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+    
+    def _check_version(self):
+        """Drop everything if the collection changed since the answers were cached"""
+        if self.version_fn is None:
+            return
+        
+        version = self.version_fn()
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+    
+    def _expire(self):
+        """Remove entries older than the TTL"""
+        cutoff = time.time() - self.ttl
+        for key in [k for k, e in self.entries.items() if e['created'] < cutoff]:
+            del self.entries[key]
+    
+    def _nearest(self, embedding):
+        """Closest cached entry by cosine distance, if within semantic_distance"""
+        candidates = [(k, e) for k, e in self.entries.items() if e['embedding'] is not None]
+        if not candidates:
+            return None
+        
+        matrix = np.stack([e['embedding'] for _, e in candidates])
+        distances = 1 - matrix @ embedding
+        best = int(np.argmin(distances))
+        
+        if distances[best] <= self.semantic_distance:
+            return candidates[best][0]
+        return None
+    
+    @staticmethod
+    def _unit(embedding):
+        """Normalize an embedding to unit length"""
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+    
+    def lookup(self, question, embedding=None):
+        """Return the cached entry for a question, or None"""
+        key = normalize_question(question)
+        
+        with self.lock:
+            self._check_version()
+            self._expire()
+            
+            if key not in self.entries and embedding is not None and self.semantic_distance is not None:
+                semantic_key = self._nearest(self._unit(embedding))
+                if semantic_key is not None:
+                    self.semantic_hits += 1
+                    self.entries.move_to_end(semantic_key)
+                    entry = self.entries[semantic_key]
+                    self.latency_saved += entry['latency']
+                    return entry
+            
+            if key in self.entries:
+                self.exact_hits += 1
+                self.entries.move_to_end(key)
+                entry = self.entries[key]
+                self.latency_saved += entry['latency']
+                return entry
+            
+            self.misses += 1
+            return None
+    
+    def store(self, question, answer, sources, latency, embedding=None):
+        """Cache an answer with the time it took to produce"""
+        key = normalize_question(question)
+        
+        with self.lock:
+            self._check_version()
+            
+            self.entries.pop(key, None)
+            self.entries[key] = {
+                'answer': answer,
+                'sources': sources,
+                'latency': latency,
+                'created': time.time(),
+                'embedding': self._unit(embedding) if embedding is not None else None
+            }
+            
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+    
+    def stats(self):
+        """Hit rate and latency saved"""
+        with self.lock:
+            hits = self.exact_hits + self.semantic_hits
+            total = hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+                "hit_rate": round(hits / total, 3) if total else 0.0,
+                "latency_saved_s": round(self.latency_saved, 2)
+            }
@@ -8,6 +8,31 @@ CHUNK_SIZE = 500
 OVERLAP = 100
 BATCH_SIZE = 50
 
+DEDUP_CHUNKS = True         # Store near-duplicate chunks (e.g. from revisions of the same manual) once, with every file/page as a reference
+DEDUP_THRESHOLD = 0.85      # Estimated Jaccard similarity of word 5-gram shingles at which two chunks count as near-duplicates
+
+# Tenants: extra collections, each kept in DB_DIR/tenants/<name> and built from DOCS_DIR/<name>.
+# A tenant can override docs_dir, db_dir, collection_name, embedding_model, chunk_size and overlap, e.g.
+# TENANTS = {"hr": {}, "engineering": {"embedding_model": "nomic-embed-text", "chunk_size": 800, "overlap": 150}}
+TENANTS = {}
+MAX_OPEN_TENANTS = 4            # Tenant collections kept open at once (least recently used is closed first)
+TENANT_MEMORY_LIMIT_MB = None   # Also close idle tenant collections while the server uses more memory than this (None = no limit)
+
+# Ingestion
+
+INGEST_PIPELINED = True     # Parse files in a process pool and embed batches while parsing continues
+INGEST_PARSE_WORKERS = 4    # Processes loading/splitting PDF and DOCX files
+INGEST_EMBED_WORKERS = 2    # Threads embedding and adding batches to the database
+
+# Budget for one db_setup.py run, None = no limit. Once it's spent no new batches are started;
+# progress is journaled and the next run continues where this one stopped
+INGEST_TIME_BUDGET = None       # Seconds
+INGEST_EMBEDDING_BUDGET = None  # Chunks embedded
+
+# Snapshots (snapshot.py export/import): copy a built collection to other nodes without re-embedding
+SNAPSHOT_PAGE_SIZE = 5000           # Chunks per block, read and written one block at a time
+SNAPSHOT_COMPRESSION_LEVEL = 6      # zstd level (1 = fastest, 19 = smallest)
+
 # AI
 
 #MODEL_NAME = "llama3.1"
@@ -17,9 +42,70 @@ EMBEDDING_MODEL = "all-minilm"
 #EMBEDDING_MODEL = "nomic-embed-text"
 #EMBEDDING_MODEL = "mxbai-embed-large"
 
+OLLAMA_KEEP_ALIVE = 1800    # Seconds Ollama keeps the models loaded after the last request (OllamaEmbeddings only takes seconds)
+
+# Ollama backends shared by the LLM and embedding calls, e.g.
+# OLLAMA_BACKENDS = [{"url": "http://gpu1:11434", "max_concurrency": 4}, {"url": "http://gpu2:11434", "max_concurrency": 2}]
+# Each call goes to the healthy backend with the fewest requests in flight; empty = Ollama's default endpoint
+OLLAMA_BACKENDS = []
+OLLAMA_TIMEOUT = 120        # Longest a call waits for a free backend, and for an embedding batch
+OLLAMA_CONNECT_TIMEOUT = 5  # Seconds to connect to a backend (or answer a health probe) before it counts as down
+OLLAMA_GENERATION_TIMEOUT = 600 # Seconds a generation may go without output (prompt processing on a slow backend takes minutes)
+OLLAMA_RETRIES = 2          # Other backends a failed call is retried on
+OLLAMA_HEALTH_INTERVAL = 10 # Seconds before a failed backend is probed again
+
+EMBEDDING_CACHE = True      # Reuse chunk embeddings stored in DB_DIR/embedding_cache instead of re-embedding
+
 SIMILARITY_THRESHOLD = 0.3
 MAX_CHUNKS = 5  
 
+# Adaptive retrieval: instead of the fixed threshold, keep up to MAX_CHUNKS chunks that score close to the best match
+ADAPTIVE_RETRIEVAL = False
+ADAPTIVE_RELATIVE_CUTOFF = 0.85 # Keep chunks scoring at least this fraction of the best match's similarity
+ADAPTIVE_MAX_GAP = 0.08         # Stop at the first drop in similarity bigger than this between consecutive chunks
+RELEVANCE_FLOOR = 0.2           # Best match below this similarity: skip the LLM and answer NO_CONTEXT_ANSWER (identifier keyword matches still count)
+NO_CONTEXT_ANSWER = "I couldn't find anything about that in the documents."
+
+RETRIEVAL_MODE = "vector"   # "vector" or "hybrid" (BM25 keyword index + vector search, reciprocal rank fusion)
+HYBRID_FETCH_K = 20         # Candidates taken from each ranking before fusing
+RRF_K = 60                  # Reciprocal rank fusion constant (higher = flatter weighting of ranks)
+FILTER_EXACT_MAX = 50       # Filtered searches with at most this many candidate chunks are scored exactly instead of via HNSW (faster up to ~40 at 2.5k chunks, ~150 at 10k)
+
+# Re-ranking: over-fetch RERANK_FETCH_K candidates, keep the RERANK_TOP_N best by a local cross-encoder
+RERANKER = False
+RERANKER_MODEL = "cross-encoder/ms-marco-MiniLM-L6-v2"   # Hugging Face repo, or a local dir with tokenizer.json + the ONNX file
+RERANKER_ONNX_FILE = "onnx/model_quint8_avx2.onnx"       # int8-quantized weights, "onnx/model.onnx" for float32
+RERANK_FETCH_K = 20
+RERANK_TOP_N = 3
+RERANK_BATCH_SIZE = 16
+RERANK_MAX_LENGTH = 512     # Tokens per (question, chunk) pair
+
+# Server
+WARMUP_ON_START = True      # Open the store and load the models in the background at startup (the port opens right away)
+
+SERVER_HOST = "127.0.0.1"
+SERVER_PORT = 5000
+SERVER_THREADS = 16         # Request threads in production mode (python server.py --production)
+LLM_MAX_CONCURRENCY = 2     # LLM generations running at once, retrieval is not limited
+LLM_QUEUE_SIZE = 8          # Requests allowed to wait for an LLM slot before getting a 429
+LLM_QUEUE_TIMEOUT = 60      # Seconds a queued request waits for a slot before getting a 429
+RESPONSE_TIMINGS = False    # Always include a per-stage timing breakdown in /api/search responses (or send "timings": true)
+BATCH_MAX_QUESTIONS = 100   # Most questions accepted by one /api/search/batch request
+BATCH_LLM_CONCURRENCY = 2   # LLM calls a batch runs at once (each still takes an llm_gate slot)
+
+# Answer cache (/api/search)
+
+ANSWER_CACHE = True
+ANSWER_CACHE_SIZE = 256                 # Max cached answers (least recently used are evicted)
+ANSWER_CACHE_TTL = 3600                 # Seconds before a cached answer expires
+ANSWER_CACHE_SEMANTIC_DISTANCE = None   # e.g. 0.05 to reuse answers for queries within this cosine distance (costs one query embedding)
+
+# Generation cache: LLM answers stored in DB_DIR/generation_cache.sqlite3 keyed on the full prompt, MODEL_NAME and LLM_CONFIG.
+# Survives restarts and is shared by the CLI and the server. Only used when LLM_CONFIG is
+# deterministic ("temperature": 0, or a fixed "seed"), sampled answers are never cached.
+GENERATION_CACHE = True
+GENERATION_CACHE_MAX_MB = 64            # Least recently used answers are dropped beyond this
+
 
 # LLM
 
@@ -57,6 +143,13 @@ LLM_CONFIG = LLM_FAST_CONFIG
 # LLM_CONFIG = LLM_BALANCED_CONFIG
 # LLM_CONFIG = LLM_HEAVY_CONFIG
 
+# Context packing: fit retrieved chunks into LLM_CONFIG["num_ctx"] instead of letting Ollama truncate
+
+CONTEXT_PACKING = True
+CHARS_PER_TOKEN = 4             # Rough token estimate for English text
+CONTEXT_RESERVE_TOKENS = 128    # Context window kept free for the answer
+NEAR_DUPLICATE_THRESHOLD = 0.8  # Word-shingle overlap above which a chunk counts as a duplicate
+
 
 PROMPT_TEMPLATE = """Analyze the provided context from multiple sources to answer the question. Provide a complete, well-structured answer in 2-3 paragraphs maximum. Be concise but thorough, and ensure you finish your complete thought.
 
@@ -86,4 +179,16 @@ HNSW_BALANCED_CONFIG = {
 }
 
 # HNSW_CONFIG = HNSW_FAST_CONFIG
-HNSW_CONFIG = HNSW_BALANCED_CONFIG
\ No newline at end of file
+HNSW_CONFIG = HNSW_BALANCED_CONFIG
+
+# Vector backend: "chroma" (HNSW, approximate) or "numpy" (exact search over a memory-mapped
+# matrix, no index build; fine up to a few hundred thousand 384-dim chunks). Switching
+# backends rebuilds the database on the next db_setup.py run
+VECTOR_BACKEND = "chroma"
+
+# Compressed vectors for the numpy backend: None, "int8" (~4x smaller) or "pq" (product
+# quantization, 32x smaller with 8-dim sub-vectors). Codes are scanned in RAM and the
+# best RERANK_CANDIDATES * k rows re-scored with float32 before the similarity threshold
+VECTOR_QUANTIZATION = None
+RERANK_CANDIDATES = 10
+PQ_SUBVECTOR_DIM = 8            # Must divide the embedding size (384 for all-minilm, 1024 for mxbai-embed-large)
\ No newline at end of file
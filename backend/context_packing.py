@@ -0,0 +1,165 @@
+import math
+import re
+import threading
+from langchain_core.documents import Document
+from langchain_core.prompts import PromptTemplate, format_document
+from config import LLM_CONFIG, PROMPT_TEMPLATE, CHARS_PER_TOKEN, CONTEXT_RESERVE_TOKENS, NEAR_DUPLICATE_THRESHOLD
+
+# How the stuff chain wraps and joins chunks unless told otherwise
+DOCUMENT_PROMPT = PromptTemplate.from_template("{page_content}")
+DOCUMENT_SEPARATOR = "\n\n"
+
+def count_tokens(text):
+    """Approximate token count (Ollama doesn't expose its tokenizer)"""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+def context_budget(question, llm_config=LLM_CONFIG, template=PROMPT_TEMPLATE):
+    """Tokens left for context after the prompt template, question and answer reserve"""
+    fixed = count_tokens(template) + count_tokens(question) + CONTEXT_RESERVE_TOKENS
+    return max(0, llm_config["num_ctx"] - fixed)
+
+def chunk_overhead(doc, document_prompt=DOCUMENT_PROMPT):
+    """Tokens the document prompt adds around a chunk's text"""
+    return count_tokens(format_document(Document(page_content="", metadata=doc.metadata), document_prompt))
+
+def shingles(text, size=3):
+    """Set of word n-grams used for near-duplicate detection"""
+    words = re.findall(r"\w+", text.lower())
+    if len(words) < size:
+        return {" ".join(words)}
+    return {" ".join(words[i:i + size]) for i in range(len(words) - size + 1)}
+
+def overlap_length(first, second, min_overlap=20):
+    """Length of the longest suffix of first that is a prefix of second"""
+    for size in range(min(len(first), len(second)) - 1, min_overlap - 1, -1):
+        if first.endswith(second[:size]):
+            return size
+    return 0
+
+class PackingStats:
+    """Running totals of tokens retrieved vs tokens sent to the LLM"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.queries = 0
+        self.tokens_retrieved = 0
+        self.tokens_used = 0
+        self.duplicates_dropped = 0
+        self.chunks_merged = 0
+        self.chunks_dropped = 0
+        self.last = None
+    
+    def record(self, result):
+        """Add one query's packing result"""
+        with self.lock:
+            self.queries += 1
+            self.tokens_retrieved += result['tokens_retrieved']
+            self.tokens_used += result['tokens_used']
+            self.duplicates_dropped += result['duplicates_dropped']
+            self.chunks_merged += result['chunks_merged']
+            self.chunks_dropped += result['chunks_dropped']
+            self.last = result
+    
+    def summary(self):
+        """Totals for /api/status"""
+        with self.lock:
+            return {
+                "queries": self.queries,
+                "tokens_retrieved": self.tokens_retrieved,
+                "tokens_used": self.tokens_used,
+                "tokens_saved": self.tokens_retrieved - self.tokens_used,
+                "duplicates_dropped": self.duplicates_dropped,
+                "chunks_merged": self.chunks_merged,
+                "chunks_dropped": self.chunks_dropped,
+                "last_query": self.last
+            }
+
+packing_stats = PackingStats()
+
+def drop_near_duplicates(docs, threshold=NEAR_DUPLICATE_THRESHOLD):
+    """Keep the first of any chunks whose word shingles overlap above threshold (Jaccard)"""
+    kept, kept_shingles = [], []
+    
+    for doc in docs:
+        doc_shingles = shingles(doc.page_content)
+        if any(len(doc_shingles & s) / len(doc_shingles | s) >= threshold for s in kept_shingles):
+            continue
+        kept.append(doc)
+        kept_shingles.append(doc_shingles)
+    
+    return kept
+
+def merge_adjacent(docs):
+    """Merge chunks from the same file/page whose text overlaps (splitter overlap)
+    
+    The merged chunk takes the place of the higher-ranked one, so the overlap
+    is only sent once.
+    """
+    merged = []
+    
+    for doc in docs:
+        for i, kept in enumerate(merged):
+            if (kept.metadata.get('source_file') != doc.metadata.get('source_file') or
+                    kept.metadata.get('page') != doc.metadata.get('page')):
+                continue
+            
+            before = overlap_length(kept.page_content, doc.page_content)
+            after = overlap_length(doc.page_content, kept.page_content)
+            
+            if before:
+                text = kept.page_content + doc.page_content[before:]
+            elif after:
+                text = doc.page_content + kept.page_content[after:]
+            else:
+                continue
+            
+            merged[i] = Document(page_content=text, metadata=kept.metadata, id=kept.id)
+            break
+        else:
+            merged.append(doc)
+    
+    return merged
+
+def pack_documents(docs, budget, document_prompt=DOCUMENT_PROMPT, separator=DOCUMENT_SEPARATOR):
+    """Fit relevance-ordered docs into a token budget
+    
+    Drops near-duplicates, merges overlapping neighbours, then adds chunks in
+    order while they fit. Each chunk costs its text as the stuff chain
+    formats it (document_prompt) plus, after the first, the separator between
+    chunks. The best chunk is truncated rather than dropped so the context is
+    never empty.
+    """
+    separator_tokens = count_tokens(separator)
+    tokens_retrieved = (sum(count_tokens(doc.page_content) + chunk_overhead(doc, document_prompt) for doc in docs)
+                        + separator_tokens * max(len(docs) - 1, 0))
+    
+    unique = drop_near_duplicates(docs)
+    merged = merge_adjacent(unique)
+    
+    packed, used, dropped = [], 0, 0
+    for doc in merged:
+        overhead = chunk_overhead(doc, document_prompt) + (separator_tokens if packed else 0)
+        tokens = count_tokens(doc.page_content) + overhead
+        
+        if used + tokens <= budget:
+            packed.append(doc)
+            used += tokens
+        elif not packed and budget > overhead:
+            text = doc.page_content[:(budget - overhead) * CHARS_PER_TOKEN]
+            packed.append(Document(page_content=text, metadata=doc.metadata, id=doc.id))
+            used += count_tokens(text) + overhead
+        else:
+            dropped += 1
+    
+    result = {
+        "budget": budget,
+        "tokens_retrieved": tokens_retrieved,
+        "tokens_used": used,
+        "tokens_saved": tokens_retrieved - used,
+        "duplicates_dropped": len(docs) - len(unique),
+        "chunks_merged": len(unique) - len(merged),
+        "chunks_dropped": dropped
+    }
+    packing_stats.record(result)
+    
+    return packed, result
@@ -1,33 +1,162 @@
 import os
+import uuid
+import numpy as np
 from langchain_ollama import OllamaEmbeddings
 from langchain_chroma import Chroma
+from langchain_core.documents import Document
 from file_processing import get_processed_files
-from config import DB_DIR, COLLECTION_NAME, EMBEDDING_MODEL, HNSW_CONFIG
+from manifest import load_manifest, indexed_files
+from embedding_cache import EmbeddingCache, CachedEmbeddings
+from numpy_store import NumpyVectorStore
+from metrics import InstrumentedEmbeddings
+from ollama_pool import get_pool, PooledEmbeddings
+from config import (DB_DIR, COLLECTION_NAME, EMBEDDING_MODEL, OLLAMA_KEEP_ALIVE, HNSW_CONFIG, EMBEDDING_CACHE, VECTOR_BACKEND,
+                    VECTOR_QUANTIZATION, RERANK_CANDIDATES, PQ_SUBVECTOR_DIM, FILTER_EXACT_MAX)
 
 # Uncomment the line below to debug embeddings
 #from debug_embeddings import DebugOllamaEmbeddings as OllamaEmbeddings
 
 
-def create_vectorstore():
-    """Create new Chroma vectorstore"""
-    embeddings = OllamaEmbeddings(model=EMBEDDING_MODEL)
+def create_embedder(embedding_model=EMBEDDING_MODEL):
+    """Ollama embedding client (without the chunk cache), can be shared by several collections"""
+    pool = get_pool()
+    if pool is not None:
+        return InstrumentedEmbeddings(PooledEmbeddings(embedding_model, pool))
+    return InstrumentedEmbeddings(OllamaEmbeddings(model=embedding_model, keep_alive=OLLAMA_KEEP_ALIVE))
+
+def create_vectorstore(db_dir=DB_DIR, collection_name=COLLECTION_NAME, embedding_model=EMBEDDING_MODEL, embedder=None):
+    """Create new vectorstore (Chroma, or the exact NumPy store when VECTOR_BACKEND = "numpy")"""
+    embeddings = embedder or create_embedder(embedding_model)
+    
+    if EMBEDDING_CACHE:
+        cache = EmbeddingCache(os.path.join(db_dir, "embedding_cache"), embedding_model)
+        embeddings = CachedEmbeddings(embeddings, cache)
+    
+    if VECTOR_BACKEND == "numpy":
+        return NumpyVectorStore(
+            collection_name=collection_name,
+            embedding_function=embeddings,
+            persist_directory=db_dir,
+            quantization=VECTOR_QUANTIZATION,
+            rerank_candidates=RERANK_CANDIDATES,
+            pq_sub_dim=PQ_SUBVECTOR_DIM
+        )
     
     vectorstore = Chroma(
-        collection_name=COLLECTION_NAME,
+        collection_name=collection_name,
         embedding_function=embeddings,
-        persist_directory=DB_DIR,
+        persist_directory=db_dir,
         collection_metadata=HNSW_CONFIG
     )
     
     return vectorstore
 
-def load_vectorstore():
-    """Load existing Chroma vectorstore"""
-    if not os.path.exists(DB_DIR):
-        raise ValueError(f"Database not found at {DB_DIR}. Run db_setup.py first.")
+def collection_count(vectorstore):
+    """Number of chunks in the collection"""
+    if isinstance(vectorstore, NumpyVectorStore):
+        return vectorstore.count()
+    return vectorstore._collection.count()
+
+def get_collection_version(db_dir=DB_DIR):
+    """Stamp that changes whenever setup_database modifies the collection"""
+    path = os.path.join(db_dir, "collection_version")
+    if not os.path.exists(path):
+        return None
+    
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+def bump_collection_version(db_dir=DB_DIR):
+    """Mark the collection as changed (invalidates cached answers)"""
+    with open(os.path.join(db_dir, "collection_version"), 'w', encoding='utf-8') as f:
+        f.write(uuid.uuid4().hex)
+
+def embed_queries(vectorstore, questions):
+    """Embed many queries in one embed_documents call (bypassing the chunk cache)"""
+    embeddings = vectorstore.embeddings
+    if isinstance(embeddings, CachedEmbeddings):
+        embeddings = embeddings.embeddings
+    
+    embed = getattr(embeddings, 'embed_queries', embeddings.embed_documents)
+    return embed(questions)
 
-    vectorstore = create_vectorstore()
-    count = vectorstore._collection.count()
+def batch_similarity_search(vectorstore, query_embeddings, k):
+    """One multi-query vector lookup, returns a list of (doc, cosine distance) lists"""
+    if isinstance(vectorstore, NumpyVectorStore):
+        return vectorstore.search_by_vectors(query_embeddings, k)
+    
+    results = vectorstore._collection.query(
+        query_embeddings=query_embeddings,
+        n_results=k,
+        include=['documents', 'metadatas', 'distances']
+    )
+    
+    return [
+        [(Document(page_content=text, metadata=metadata or {}, id=chunk_id), distance)
+         for chunk_id, text, metadata, distance in zip(ids, texts, metadatas, distances)]
+        for ids, texts, metadatas, distances in zip(
+            results['ids'], results['documents'], results['metadatas'], results['distances'])
+    ]
+
+def search_within(vectorstore, embedding, ids, k):
+    """Exact (doc, cosine distance) search over just the chunks in ids"""
+    if isinstance(vectorstore, NumpyVectorStore):
+        return vectorstore.search_by_vectors([embedding], k, ids=ids)[0]
+    
+    stored = vectorstore.get(ids=ids, include=['embeddings', 'documents', 'metadatas'])
+    if not stored['ids']:
+        return []
+    
+    matrix = np.asarray(stored['embeddings'], dtype=np.float32)
+    query = np.asarray(embedding, dtype=np.float32)
+    similarities = matrix @ query / (np.linalg.norm(matrix, axis=1) * np.linalg.norm(query) + 1e-12)
+    
+    top = np.argsort(-similarities)[:k]
+    return [(Document(page_content=stored['documents'][i], metadata=stored['metadatas'][i] or {},
+                      id=stored['ids'][i]), float(1 - similarities[i]))
+            for i in top]
+
+def filtered_similarity_search(vectorstore, embedding, k, ids, where, exact_max=FILTER_EXACT_MAX):
+    """(doc, cosine distance) search over pre-filtered chunk ids
+    
+    Small candidate sets (and the numpy backend) are scored exactly; large
+    ones go to Chroma with the equivalent where clause.
+    """
+    if isinstance(vectorstore, NumpyVectorStore) or len(ids) <= exact_max:
+        return search_within(vectorstore, embedding, ids, k)
+    return vectorstore.similarity_search_by_vector_with_relevance_scores(embedding, k=k, filter=where)
+
+def update_chunk_metadata(vectorstore, ids, metadatas):
+    """Replace the metadata of stored chunks without re-embedding them"""
+    if isinstance(vectorstore, NumpyVectorStore):
+        vectorstore.update_metadata(ids, metadatas)
+    else:
+        vectorstore._collection.update(ids=ids, metadatas=metadatas)
+
+def add_embedded_chunks(vectorstore, ids, embeddings, texts, metadatas):
+    """Bulk insert chunks with their stored embeddings, without calling the embedding model"""
+    if isinstance(vectorstore, NumpyVectorStore):
+        vectorstore.add_embeddings(ids, embeddings, texts, metadatas)
+        return
+    
+    # Chroma caps how many records one call can add
+    step = vectorstore._client.get_max_batch_size()
+    for start in range(0, len(ids), step):
+        end = start + step
+        vectorstore._collection.add(ids=ids[start:end], embeddings=embeddings[start:end],
+                                    documents=texts[start:end], metadatas=metadatas[start:end])
+
+def delete_file_chunks(vectorstore, filename):
+    """Delete every chunk that came from a file"""
+    vectorstore.delete(where={"source_file": filename})
+
+def load_vectorstore(db_dir=DB_DIR, collection_name=COLLECTION_NAME, embedding_model=EMBEDDING_MODEL, embedder=None):
+    """Load existing vectorstore"""
+    if not os.path.exists(db_dir):
+        raise ValueError(f"Database not found at {db_dir}. Run db_setup.py first.")
+
+    vectorstore = create_vectorstore(db_dir, collection_name, embedding_model, embedder)
+    count = collection_count(vectorstore)
     
     if count == 0:
         raise ValueError("Database is empty. Run db_setup.py first.")
@@ -36,20 +165,24 @@ def load_vectorstore():
     #print(f"Loaded {count} documents")
     return vectorstore
 
-def check_database():
+def check_database(db_dir=DB_DIR, collection_name=COLLECTION_NAME, embedding_model=EMBEDDING_MODEL):
     """Check database status - returns info without throwing errors"""
-    if not os.path.exists(DB_DIR):
+    if not os.path.exists(db_dir):
         return False, "Database not found"
     
     try:
-        vectorstore = create_vectorstore()
-        count = vectorstore._collection.count()
-        
-        if count == 0:
-            return False, "Database empty"
-        
-        processed_files = get_processed_files(vectorstore)
-        return True, f"{count} documents from {len(processed_files)} files"
-        
+        return describe_database(create_vectorstore(db_dir, collection_name, embedding_model), db_dir)
     except Exception as e:
-        return False, f"Error: {e}"
\ No newline at end of file
+        return False, f"Error: {e}"
+
+def describe_database(vectorstore, db_dir=DB_DIR):
+    """(exists, status) for an open vectorstore"""
+    count = collection_count(vectorstore)
+    
+    if count == 0:
+        return False, "Database empty"
+    
+    # The manifest lists files directly; only fall back to a metadata scan without one
+    manifest = load_manifest(db_dir)
+    num_files = len(indexed_files(manifest)) if manifest is not None else len(get_processed_files(vectorstore))
+    return True, f"{count} documents from {num_files} files"
\ No newline at end of file
@@ -1,63 +1,530 @@
 import os
 import gc
-from database import create_vectorstore, check_database
-from file_processing import get_processed_files, load_and_split_documents, get_document_files
-from config import DOCS_DIR, DB_DIR, CHUNK_SIZE, OVERLAP, BATCH_SIZE
+import time
+import sys
+import argparse
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from database import (create_vectorstore, check_database, collection_count, delete_file_chunks, bump_collection_version,
+                      update_chunk_metadata)
+from manifest import load_manifest, save_manifest, scan_changes, file_entry, file_hash, failed_entry, indexed_files
+from embedding_cache import CachedEmbeddings
+from numpy_store import NumpyVectorStore
+from keyword_index import KeywordIndex
+from metadata_index import MetadataIndex
+from dedup_index import DedupIndex, with_references
+from ingest_journal import IngestJournal, IngestBudget, file_key, chunk_id
+from file_processing import get_processed_files, iter_documents, load_file_chunks, get_document_files
+from tenants import tenant_settings
+from config import (DOCS_DIR, DB_DIR, COLLECTION_NAME, EMBEDDING_MODEL, CHUNK_SIZE, OVERLAP, BATCH_SIZE,
+                    TENANTS, DEDUP_CHUNKS, INGEST_PIPELINED, INGEST_PARSE_WORKERS, INGEST_EMBED_WORKERS,
+                    INGEST_TIME_BUDGET, INGEST_EMBEDDING_BUDGET)
 
-def setup_database():
-    """Main setup function"""
-    os.makedirs(DOCS_DIR, exist_ok=True)
-    os.makedirs(DB_DIR, exist_ok=True)  # Make sure DB directory exists
+class IngestStats:
+    """Per-stage counters and timings for the ingestion pipeline"""
+    
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.files = 0
+        self.failed_files = []
+        self.stopped = False
+        self.chunks = 0
+        self.submitted = 0
+        self.embeddings = 0
+        self.parse_done = None
+        self.embed_start = None
+        self.embed_done = None
+    
+    def report(self):
+        """Print throughput for each stage"""
+        end = time.perf_counter()
+        parse_time = (self.parse_done or end) - self.start
+        embed_time = (self.embed_done or end) - (self.embed_start or end)
+        
+        print(f"Parse:  {self.files} files, {self.chunks} chunks in {parse_time:.1f}s "
+              f"({self.files / max(parse_time, 1e-9):.1f} files/s, {self.chunks / max(parse_time, 1e-9):.1f} chunks/s)")
+        print(f"Embed:  {self.embeddings} embeddings in {embed_time:.1f}s "
+              f"({self.embeddings / max(embed_time, 1e-9):.1f} embeddings/s)")
+        print(f"Total:  {end - self.start:.1f}s")
+
+def peak_rss_mb():
+    """Peak resident memory of this process and of its (finished) worker processes, in MB"""
+    try:
+        import resource
+        # ru_maxrss is in KB on Linux, bytes on macOS
+        scale = 1024 * 1024 if sys.platform == 'darwin' else 1024
+        own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / scale
+        workers = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / scale
+        return own, workers
+    except ImportError:
+        # Windows has no resource module, psutil reports the peak working set
+        import psutil
+        return psutil.Process().memory_info().peak_wset / (1024 * 1024), None
+
+def report_peak_memory(include_workers=False):
+    """Print peak RSS at the end of ingestion"""
+    own, workers = peak_rss_mb()
+    if include_workers and workers:
+        print(f"Peak RSS: {own:.0f} MB (largest parse worker: {workers:.0f} MB)")
+    else:
+        print(f"Peak RSS: {own:.0f} MB")
+
+def iter_batches(chunks, size=BATCH_SIZE):
+    """Group a chunk stream into lists of at most size"""
+    chunks = iter(chunks)
+    while True:
+        batch = list(islice(chunks, size))
+        if not batch:
+            return
+        yield batch
+
+def add_batch(vectorstore, indexes, batch, dedup=None, journal=None):
+    """Add a batch of chunks to the vectorstore and the keyword/metadata indexes, returns how many were stored
+    
+    With a dedup index, near-duplicates of stored chunks are left out and
+    only recorded as references of the chunk they duplicate. The batch is
+    recorded in the journal last, once all of that is in the vectorstore.
+    """
+    committed = {}
+    for doc in batch:
+        committed.setdefault(doc.metadata['source_file'], []).append(doc.id)
+    
+    ids = [doc.id for doc in batch]
+    duplicates = []
+    if dedup is not None:
+        ids, batch, duplicates = dedup.deduplicate(ids, batch)
+        
+        # A filter on the duplicate's file still finds the stored chunk
+        for index in indexes:
+            if isinstance(index, MetadataIndex) and duplicates:
+                index.add([original for original, _ in duplicates], [doc.page_content for _, doc in duplicates],
+                          [doc.metadata for _, doc in duplicates])
+    
+    if batch:
+        vectorstore.add_documents(batch, ids=ids)
+        for index in indexes:
+            index.add(ids, [doc.page_content for doc in batch], [doc.metadata for doc in batch])
+    
+    updated = {original for original, _ in duplicates}
+    if dedup is not None:
+        dedup.commit(ids)
+        apply_references(vectorstore, dedup, updated)
+    if journal is not None:
+        journal.commit(committed, updated)
+    return len(batch)
+
+def remove_file_chunks(vectorstore, indexes, dedup, filename):
+    """Delete a file's chunks and index entries
+    
+    Chunks other files also contain (near-duplicates) are kept: the file is
+    dropped from their references, and if it was their own file the next
+    reference takes over.
+    """
+    changed = dedup.remove_file(filename) if dedup is not None else {}
+    promoted = {'ids': [], 'documents': [], 'metadatas': []}
+    
+    if changed:
+        stored = vectorstore.get(ids=list(changed), include=['documents', 'metadatas'])
+        metadatas = [with_references(metadata or {}, changed[chunk_id])
+                     for chunk_id, metadata in zip(stored['ids'], stored['metadatas'])]
+        update_chunk_metadata(vectorstore, stored['ids'], metadatas)
+        
+        for chunk_id, text, old, new in zip(stored['ids'], stored['documents'], stored['metadatas'], metadatas):
+            if (old or {}).get('source_file') == filename:
+                promoted['ids'].append(chunk_id)
+                promoted['documents'].append(text)
+                promoted['metadatas'].append(new)
+    
+    delete_file_chunks(vectorstore, filename)
+    for index in indexes:
+        index.remove_file(filename)
+        if promoted['ids']:
+            index.add(promoted['ids'], promoted['documents'], promoted['metadatas'])
+
+def apply_references(vectorstore, dedup, ids):
+    """Write the dedup index's references for stored chunks into their metadata"""
+    if not ids:
+        return
+    
+    # One writer at a time, so an older reference list never overwrites a newer one
+    with dedup.write_lock:
+        refs = dedup.references(ids)
+        stored = vectorstore.get(ids=list(refs), include=['metadatas'])
+        update_chunk_metadata(vectorstore, stored['ids'], [with_references(metadata or {}, refs[chunk_id])
+                                                           for chunk_id, metadata in zip(stored['ids'], stored['metadatas'])])
+
+def report_dedup(vectorstore, dedup, stored):
+    """Print how much embedding work and index space near-duplicate removal saved"""
+    stats = dedup.stats()
+    duplicates = stats['duplicates']
+    if not duplicates:
+        return
+    
+    sample = vectorstore.get(limit=1, include=['embeddings'])
+    dim = len(sample['embeddings'][0]) if len(sample['ids']) else 0
+    print(f"Dedup: {duplicates} of {duplicates + stored} chunks were near-duplicates "
+          f"({duplicates / (duplicates + stored):.0%}), saved {duplicates} embeddings, "
+          f"{duplicates * dim * 4 / (1024 * 1024):.2f} MB of vectors and {stats['duplicate_bytes'] / (1024 * 1024):.2f} MB of text")
+
+def uncommitted_chunks(journal, chunks, chunk_size, overlap, processed=()):
+    """Give chunks their deterministic ids and skip the ones the journal has as committed
+    
+    For a chunk stream, processed is the list iter_documents appends fully
+    read files to; their chunk counts are recorded as they show up in it.
+    """
+    counts = {}
+    recorded = 0
+    committed = {}
+    
+    for chunk in chunks:
+        for filename in processed[recorded:]:
+            journal.parsed(filename, counts.get(filename, 0))
+        recorded = len(processed)
+        
+        source_file = chunk.metadata['source_file']
+        if source_file not in committed:
+            committed[source_file] = journal.committed(source_file)
+        
+        index = counts.get(source_file, 0)
+        counts[source_file] = index + 1
+        chunk.id = chunk_id(file_key(source_file, journal.entry(source_file), chunk_size, overlap), index)
+        if chunk.id not in committed[source_file]:
+            yield chunk
+    
+    for filename in processed[recorded:]:
+        journal.parsed(filename, counts.get(filename, 0))
+
+def add_documents_pipelined(vectorstore, indexes, journal, files_to_process, docs_dir=DOCS_DIR, chunk_size=CHUNK_SIZE,
+                            overlap=OVERLAP, parse_workers=INGEST_PARSE_WORKERS, embed_workers=INGEST_EMBED_WORKERS,
+                            dedup=None, budget=None):
+    """Parse files in a process pool and add chunk batches while parsing continues
+    
+    Once the budget is exhausted no new files or batches are started, the
+    chunks left over are picked up by the next run.
+    """
+    stats = IngestStats()
+    files = iter(files_to_process)
+    total_files = len(files_to_process)
+    parse_futures = {}
+    embed_futures = set()
+    buffer = []
+    
+    def submit_file():
+        filename = next(files, None)
+        if filename is not None:
+            future = parse_pool.submit(load_file_chunks, docs_dir, filename, chunk_size, overlap)
+            parse_futures[future] = filename
+    
+    def collect(done):
+        for future in done:
+            embed_futures.discard(future)
+            stats.embeddings += future.result()
+    
+    def exhausted():
+        # Counted at submission, so batches already queued don't overshoot the budget
+        if budget is not None and not stats.stopped and budget.exhausted(stats.submitted):
+            stats.stopped = True
+        return stats.stopped
+    
+    def submit_batch(batch):
+        # Bound the number of batches held in memory waiting for the embedder
+        while len(embed_futures) >= embed_workers * 2:
+            done, _ = wait(embed_futures, return_when=FIRST_COMPLETED)
+            collect(done)
+        
+        if stats.embed_start is None:
+            stats.embed_start = time.perf_counter()
+        stats.submitted += len(batch)
+        embed_futures.add(embed_pool.submit(add_batch, vectorstore, indexes, batch, dedup, journal))
+    
+    with ProcessPoolExecutor(max_workers=parse_workers) as parse_pool, \
+         ThreadPoolExecutor(max_workers=embed_workers) as embed_pool:
+        
+        # Keep a bounded number of files in flight so parsed chunks don't pile up
+        for _ in range(parse_workers * 2):
+            submit_file()
+        
+        while parse_futures and not exhausted():
+            done, _ = wait(parse_futures, return_when=FIRST_COMPLETED)
+            
+            for future in done:
+                filename = parse_futures.pop(future)
+                submit_file()
+                
+                try:
+                    chunks = future.result()
+                except Exception as e:
+                    print(f"** Skipped ** {filename}: {e}")
+                    stats.failed_files.append(filename)
+                    continue
+                
+                stats.files += 1
+                stats.chunks += len(chunks)
+                print(f"Processed {stats.files}/{total_files}: {filename} ({len(chunks)} chunks)")
+                
+                buffer.extend(uncommitted_chunks(journal, chunks, chunk_size, overlap))
+                journal.parsed(filename, len(chunks))
+                while len(buffer) >= BATCH_SIZE and not exhausted():
+                    submit_batch(buffer[:BATCH_SIZE])
+                    buffer = buffer[BATCH_SIZE:]
+        
+        # Files still being parsed are left for the next run
+        for future in parse_futures:
+            future.cancel()
+        stats.parse_done = time.perf_counter()
+        
+        if buffer and not exhausted():
+            submit_batch(buffer)
+        
+        collect(wait(embed_futures).done)
+        stats.embed_done = time.perf_counter()
+    
+    gc.collect()
+    stats.report()
+    return stats
+
+def bootstrap_manifest(vectorstore, all_document_files, docs_dir=DOCS_DIR):
+    """Build a manifest for a database created before manifests existed"""
+    print("No manifest found, building one from database metadata...")
+    processed_files = get_processed_files(vectorstore)
+    
+    # Files still on disk are assumed to be indexed as they are now
+    manifest = {}
+    for filename in processed_files:
+        filepath = os.path.join(docs_dir, filename)
+        manifest[filename] = file_entry(filepath) if filename in all_document_files else {}
+    return manifest
+
+def build_index(vectorstore, index, page_size=1000):
+    """Index every chunk already in the collection (databases created before the index existed)"""
+    print(f"No {os.path.basename(index.path)} found, building it from the database...")
+    offset = 0
+    
+    while True:
+        page = vectorstore.get(include=['documents', 'metadatas'], limit=page_size, offset=offset)
+        if not page['ids']:
+            break
+        index.add(page['ids'], page['documents'], page['metadatas'])
+        offset += len(page['ids'])
+
+def replay_chunks(vectorstore, indexes, ids, updated, page_size=1000):
+    """Add chunks an interrupted run committed after its last checkpoint to indexes loaded from disk
+    
+    Chunks that only gained references are re-read into the metadata and
+    dedup indexes, where adding a chunk again replaces its entry.
+    """
+    refreshed = [index for index in indexes if isinstance(index, (MetadataIndex, DedupIndex))]
+    
+    for chunk_ids, targets in ((ids, indexes), (updated, refreshed)):
+        chunk_ids = list(dict.fromkeys(chunk_ids))
+        for start in range(0, len(chunk_ids), page_size):
+            page = vectorstore.get(ids=chunk_ids[start:start + page_size], include=['documents', 'metadatas'])
+            for index in targets:
+                index.add(page['ids'], page['documents'], page['metadatas'])
+
+def resume_journal(vectorstore, indexes, dedup, journal, manifest, loaded, docs_dir, all_document_files):
+    """Pick up where an interrupted run stopped, returns the files to carry on with
+    
+    Its finished files go into the manifest and its committed chunks into
+    the indexes loaded from disk. Unfinished files that changed or were
+    deleted since are rolled back.
+    """
+    print(f"Resuming interrupted ingestion of {len(journal.files)} files...")
+    replay_chunks(vectorstore, loaded, journal.uncheckpointed, journal.updated)
+    manifest.update(journal.done_files())
+    
+    resumed = []
+    for filename in journal.unfinished_files():
+        filepath = os.path.join(docs_dir, filename)
+        if filename in all_document_files and file_hash(filepath) == journal.entry(filename)['hash']:
+            resumed.append(filename)
+        else:
+            print(f"{filename} changed since the interrupted run, rolling it back")
+            remove_file_chunks(vectorstore, indexes, dedup, filename)
+            journal.rollback(filename)
+    return resumed
+
+def setup_database(pipelined=INGEST_PIPELINED, docs_dir=DOCS_DIR, db_dir=DB_DIR, collection_name=COLLECTION_NAME,
+                   embedding_model=EMBEDDING_MODEL, chunk_size=CHUNK_SIZE, overlap=OVERLAP,
+                   time_budget=INGEST_TIME_BUDGET, embedding_budget=INGEST_EMBEDDING_BUDGET):
+    """Main setup function (the defaults build the main collection, see tenant_settings for tenants)
+    
+    Progress is journaled per batch, so an interrupted run (or one stopped
+    at its time/embedding budget) is continued by the next one without
+    re-embedding what it already committed.
+    """
+    budget = IngestBudget(time_budget, embedding_budget)
+    os.makedirs(docs_dir, exist_ok=True)
+    os.makedirs(db_dir, exist_ok=True)  # Make sure DB directory exists
     
     # Get all document files (PDF and DOCX)
-    all_document_files = get_document_files(DOCS_DIR)
+    all_document_files = get_document_files(docs_dir)
     
     if not all_document_files:
-        print(f"No PDF or DOCX files found in {DOCS_DIR}")
+        print(f"No PDF or DOCX files found in {docs_dir}")
         return False
     
     # Create vectorstore
-    vectorstore = create_vectorstore()
-    current_count = vectorstore._collection.count()
+    vectorstore = create_vectorstore(db_dir, collection_name, embedding_model)
+    current_count = collection_count(vectorstore)
+    indexes = [KeywordIndex(db_dir), MetadataIndex(db_dir)]
+    dedup = DedupIndex(db_dir) if DEDUP_CHUNKS else None
+    saved_indexes = indexes + ([dedup] if dedup is not None else [])
+    journal = IngestJournal(db_dir)
     
     if current_count > 0:
-        # Check for new files
-        processed_files = get_processed_files(vectorstore)
-        new_files = [f for f in all_document_files if f not in processed_files]
-        if not new_files:
-            print(f"Database up to date with {current_count} documents from {len(processed_files)} files")
+        manifest = load_manifest(db_dir)
+        if manifest is None:
+            manifest = bootstrap_manifest(vectorstore, all_document_files, docs_dir)
+            save_manifest(manifest, db_dir)
+        
+        loaded = []
+        for index in saved_indexes:
+            if index.exists():
+                index.load()
+                loaded.append(index)
+            else:
+                build_index(vectorstore, index)
+        
+        journal.load()
+        resumed = resume_journal(vectorstore, indexes, dedup, journal, manifest, loaded, docs_dir,
+                                 all_document_files) if journal.files else []
+        
+        # Check for new, modified and removed files
+        new_files, modified_files, removed_files, hashes = scan_changes(docs_dir, all_document_files, manifest)
+        new_files = [f for f in new_files if f not in resumed]
+        modified_files = [f for f in modified_files if f not in resumed]
+        
+        for filename in modified_files + removed_files:
+            remove_file_chunks(vectorstore, indexes, dedup, filename)
+            del manifest[filename]
+        
+        if removed_files:
+            print(f"Removed chunks for {len(removed_files)} deleted files")
+        
+        files_to_process = resumed + new_files + modified_files
+        if not files_to_process:
+            changed = removed_files or journal.files
+            save_manifest(manifest, db_dir)
+            for index in saved_indexes:
+                index.save()
+            journal.finish()
+            if changed:
+                bump_collection_version(db_dir)
+            count = collection_count(vectorstore)
+            print(f"Database up to date with {count} documents from {len(indexed_files(manifest))} files")
             return True
-        print(f"Found {len(new_files)} new files to add to existing database")
-        files_to_process = new_files
+        print(f"Found {len(new_files)} new and {len(modified_files)} modified files to add to existing database"
+              + (f", resuming {len(resumed)}" if resumed else ""))
     else:
-        print(f"Creating new database with {len(all_document_files)} files")
-        files_to_process = all_document_files
-
-    # Process files
-    documents = load_and_split_documents(DOCS_DIR, files_to_process, CHUNK_SIZE, OVERLAP)
+        # Nothing an earlier run journaled made it into the collection
+        journal.finish()
+        
+        # Files that failed to parse before are still skipped until they change
+        manifest = {filename: entry for filename, entry in (load_manifest(db_dir) or {}).items() if entry.get('failed')}
+        new_files, modified_files, removed_files, hashes = scan_changes(docs_dir, all_document_files, manifest)
+        for filename in modified_files + removed_files:
+            del manifest[filename]
+        files_to_process = new_files + modified_files
+        print(f"Creating new database with {len(files_to_process)} files")
+        
+        # A crash from here on leaves chunks without a manifest, which must
+        # not be mistaken for a pre-manifest database
+        save_manifest(manifest, db_dir)
+    
+    # Record the version of each file being read before any of its chunks go in
+    for filename in files_to_process:
+        if filename not in journal.files:
+            journal.add_file(filename, file_entry(os.path.join(docs_dir, filename), hashes.get(filename)))
     
-    if documents:
-        print(f"Adding {len(documents)} chunks to database...")
+    # Process files, skipping chunks an interrupted run already committed
+    if pipelined:
+        stats = add_documents_pipelined(vectorstore, indexes, journal, files_to_process, docs_dir, chunk_size, overlap,
+                                        dedup=dedup, budget=budget)
+        failed_files = stats.failed_files
+        added = stats.embeddings
+        stopped = stats.stopped
+    else:
+        # Chunks are streamed into batches, so only one batch is held in memory
+        processed_files, failed_files = [], []
+        chunks = iter_documents(docs_dir, files_to_process, chunk_size, overlap,
+                                processed=processed_files, failed=failed_files)
+        added = 0
+        stopped = False
         
-        # Add in batches
-        for i in range(0, len(documents), BATCH_SIZE):
-            batch = documents[i:i + BATCH_SIZE]
-            vectorstore.add_documents(batch)
+        for batch in iter_batches(uncommitted_chunks(journal, chunks, chunk_size, overlap, processed_files)):
+            if budget.exhausted(added):
+                stopped = True
+                break
+            added += add_batch(vectorstore, indexes, batch, dedup, journal)
             gc.collect()
         
-        final_count = vectorstore._collection.count()
-        print(f"** Database updated: {current_count} -> {final_count} documents **")
+        print(f"Added {added} chunks to database")
+    
+    # A file that failed part way may already have chunks in, drop them; the
+    # manifest keeps the failed version so it's only retried once it changes
+    for filename in failed_files:
+        remove_file_chunks(vectorstore, indexes, dedup, filename)
+        manifest[filename] = failed_entry(journal.entry(filename))
+        journal.rollback(filename)
+    
+    if dedup is not None:
+        report_dedup(vectorstore, dedup, added)
+    
+    # Encode new rows for the quantized index (trains PQ codebooks the first time)
+    if isinstance(vectorstore, NumpyVectorStore) and vectorstore.quantization:
+        vectorstore.build_codes()
+        print(f"Vector memory: {vectorstore.memory_footprint()}")
+    
+    # Only record files once all their chunks are in, unfinished ones are
+    # continued next run and failed ones retried
+    manifest.update(journal.done_files())
+    save_manifest(manifest, db_dir)
+    for index in saved_indexes:
+        index.save()
+    bump_collection_version(db_dir)
+    
+    unfinished = journal.unfinished_files()
+    if unfinished:
+        journal.checkpoint()
+    else:
+        journal.finish()
+    
+    final_count = collection_count(vectorstore)
+    print(f"** Database updated: {current_count} -> {final_count} documents **")
+    failed = len(manifest) - len(indexed_files(manifest))
+    if failed:
+        print(f"** {failed} files failed to parse, they are skipped until they change **")
+    if stopped:
+        print(f"** Stopped at the ingestion budget with {len(unfinished)} files left, run db_setup.py again to continue **")
+    
+    if isinstance(vectorstore.embeddings, CachedEmbeddings):
+        vectorstore.embeddings.report()
+    report_peak_memory(include_workers=pipelined)
     
     return True
 
 if __name__ == "__main__":
-    print("PDF Database Setup")
+    parser = argparse.ArgumentParser(description="Build or update the document database")
+    parser.add_argument("--tenant", choices=sorted(TENANTS), help="Build a tenant's collection instead of the main one")
+    parser.add_argument("--budget-minutes", type=float, help="Stop taking new batches after this many minutes")
+    parser.add_argument("--budget-embeddings", type=int, help="Stop taking new batches after embedding this many chunks")
+    args = parser.parse_args()
+    
+    settings = tenant_settings(args.tenant) if args.tenant else {}
+    if args.budget_minutes is not None:
+        settings["time_budget"] = args.budget_minutes * 60
+    if args.budget_embeddings is not None:
+        settings["embedding_budget"] = args.budget_embeddings
+    
+    print(f"PDF Database Setup{f' ({args.tenant})' if args.tenant else ''}")
     print("-" * 20)
     
-    exists, status = check_database()
+    store_settings = {key: settings[key] for key in ("db_dir", "collection_name", "embedding_model") if key in settings}
+    exists, status = check_database(**store_settings)
     print(f"Status: {status}")
     
-    if setup_database():
+    if setup_database(**settings):
         print("Setup complete!")
     else:
         print("Setup failed")
\ No newline at end of file
@@ -0,0 +1,215 @@
+import os
+import re
+import json
+import zlib
+import threading
+import numpy as np
+from config import DB_DIR, DEDUP_THRESHOLD
+
+INDEX_FILE = "dedup_index.npz"
+
+NUM_PERM = 128
+BANDS = 16              # 16 bands of 8 rows: pairs above ~0.7 Jaccard usually share a band
+SHINGLE_WORDS = 5
+MERSENNE_PRIME = (1 << 61) - 1
+
+# Fixed seed, signatures are stored and compared across runs
+_rng = np.random.default_rng(20240501)
+PERM_A = _rng.integers(1, 1 << 32, NUM_PERM, dtype=np.uint64)
+PERM_B = _rng.integers(0, 1 << 32, NUM_PERM, dtype=np.uint64)
+
+def minhash(text):
+    """MinHash signature of a text's word 5-gram shingles"""
+    words = re.findall(r"\w+", text.lower())
+    shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))}
+    hashes = np.array([zlib.crc32(s.encode('utf-8')) for s in shingles], dtype=np.uint64)
+    
+    # (a * x + b) mod p for every permutation and shingle, minimum per permutation
+    return ((np.outer(hashes, PERM_A) + PERM_B) % MERSENNE_PRIME).min(axis=0)
+
+def chunk_references(metadata):
+    """[(source_file, page), ...] for a stored chunk, including the files it was deduplicated from"""
+    return [(source_file, page) for source_file, page, _ in stored_references(metadata)]
+
+def reference(metadata):
+    """[source_file, page, file_type] entry for a chunk's metadata"""
+    return [metadata.get('source_file'), metadata.get('page'), metadata.get('file_type')]
+
+def stored_references(metadata):
+    """Every [source_file, page, file_type] entry of a stored chunk, own file first"""
+    if metadata.get('references'):
+        return json.loads(metadata['references'])
+    return [reference(metadata)]
+
+def with_references(metadata, refs):
+    """Chunk metadata for a reference list, the first reference is the chunk's own file and page"""
+    metadata = dict(metadata)
+    metadata['source_file'], metadata['page'], metadata['file_type'] = refs[0]
+    
+    # Chroma metadata values are scalars, so the list is stored as JSON; a
+    # Chroma update merges keys, so a single reference clears it instead
+    metadata['references'] = json.dumps(refs) if len(refs) > 1 else ""
+    return metadata
+
+class DedupIndex:
+    """MinHash/LSH index of the stored chunks, for dropping near-duplicates at ingest
+    
+    A new chunk whose estimated Jaccard similarity to a stored chunk is at
+    least threshold isn't embedded or stored; its file and page are added to
+    the stored chunk's references instead.
+    
+    Chunks only count as stored once commit() is called after their batch
+    is in the vectorstore, so a duplicate is never folded into a chunk that
+    another worker hasn't added yet (or that a crash lost).
+    """
+    
+    def __init__(self, db_dir=DB_DIR, threshold=DEDUP_THRESHOLD):
+        self.path = os.path.join(db_dir, INDEX_FILE)
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.signatures = {}    # chunk id -> MinHash signature
+        self.refs = {}          # chunk id -> [[source_file, page, file_type], ...], own file first
+        self.buckets = {}       # (band, band hash) -> set of chunk ids
+        self.staged = set()     # chunk ids deduplicate() kept whose batch isn't committed yet
+        self.write_lock = threading.Lock()  # held while writing references to the vectorstore
+        self.duplicates = 0
+        self.duplicate_bytes = 0
+    
+    def exists(self):
+        """Whether the index has been saved to disk"""
+        return os.path.exists(self.path)
+    
+    def load(self):
+        """Load the index from disk (no-op if it doesn't exist)"""
+        if not self.exists():
+            return self
+        
+        with np.load(self.path) as data:
+            ids = data['ids'].tolist()
+            signatures = data['signatures']
+            refs = json.loads(str(data['refs']))
+        
+        with self.lock:
+            for chunk_id, signature, chunk_refs in zip(ids, signatures, refs):
+                self._insert(chunk_id, signature, chunk_refs)
+        return self
+    
+    def save(self):
+        """Write the index atomically"""
+        with self.lock:
+            ids = list(self.signatures)
+            signatures = np.stack([self.signatures[i] for i in ids]) if ids else np.empty((0, NUM_PERM), dtype=np.uint64)
+            refs = json.dumps([self.refs[i] for i in ids])
+        
+        tmp_path = self.path + ".tmp.npz"
+        np.savez(tmp_path, ids=np.array(ids, dtype=str), signatures=signatures, refs=np.array(refs))
+        os.replace(tmp_path, self.path)
+    
+    @staticmethod
+    def _band_keys(signature):
+        """One bucket key per LSH band"""
+        return [(band, hash(band_values.tobytes())) for band, band_values in enumerate(np.split(signature, BANDS))]
+    
+    def _insert(self, chunk_id, signature, refs):
+        """Add a chunk (call with the lock held)"""
+        self.signatures[chunk_id] = signature
+        self.refs[chunk_id] = refs
+        for key in self._band_keys(signature):
+            self.buckets.setdefault(key, set()).add(chunk_id)
+    
+    def _drop(self, chunk_id):
+        """Remove a chunk (call with the lock held)"""
+        signature = self.signatures.pop(chunk_id)
+        del self.refs[chunk_id]
+        self.staged.discard(chunk_id)
+        for key in self._band_keys(signature):
+            bucket = self.buckets.get(key)
+            if bucket is not None:
+                bucket.discard(chunk_id)
+                if not bucket:
+                    del self.buckets[key]
+    
+    def _near_duplicate(self, signature, batch):
+        """Id of the most similar committed (or same batch) chunk at or above threshold, or None (call with the lock held)"""
+        candidates = set()
+        for key in self._band_keys(signature):
+            candidates.update(self.buckets.get(key, ()))
+        candidates = {chunk_id for chunk_id in candidates if chunk_id not in self.staged or chunk_id in batch}
+        
+        best, best_similarity = None, self.threshold
+        for chunk_id in candidates:
+            similarity = float(np.mean(self.signatures[chunk_id] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = chunk_id, similarity
+        return best
+    
+    def add(self, ids, texts, metadatas):
+        """Index stored chunks as they are (same call as KeywordIndex.add)"""
+        signatures = [minhash(text) for text in texts]
+        with self.lock:
+            for chunk_id, signature, metadata in zip(ids, signatures, metadatas):
+                self._insert(chunk_id, signature, stored_references(metadata or {}))
+    
+    def deduplicate(self, ids, chunks):
+        """Split a batch into chunks to store and near-duplicates of committed (or earlier) chunks
+        
+        Returns (ids, chunks) to add and [(stored chunk id, duplicate chunk)].
+        Kept chunks are staged until commit(ids), and compared against by
+        later chunks in the same batch right away.
+        """
+        signatures = [minhash(chunk.page_content) for chunk in chunks]
+        keep_ids, keep_chunks, duplicates = [], [], []
+        
+        with self.lock:
+            for chunk_id, chunk, signature in zip(ids, chunks, signatures):
+                original = self._near_duplicate(signature, keep_ids)
+                if original is None:
+                    self._insert(chunk_id, signature, [reference(chunk.metadata)])
+                    self.staged.add(chunk_id)
+                    keep_ids.append(chunk_id)
+                    keep_chunks.append(chunk)
+                    continue
+                
+                ref = reference(chunk.metadata)
+                if ref not in self.refs[original]:
+                    self.refs[original].append(ref)
+                duplicates.append((original, chunk))
+                self.duplicates += 1
+                self.duplicate_bytes += len(chunk.page_content.encode('utf-8'))
+        
+        return keep_ids, keep_chunks, duplicates
+    
+    def commit(self, ids):
+        """Mark kept chunks as stored once their batch is in the vectorstore"""
+        with self.lock:
+            self.staged.difference_update(ids)
+    
+    def references(self, ids):
+        """{chunk id: references} for stored chunks"""
+        with self.lock:
+            return {chunk_id: list(self.refs[chunk_id]) for chunk_id in ids if chunk_id in self.refs}
+    
+    def remove_file(self, source_file):
+        """Drop a file's references
+        
+        Returns {chunk id: remaining references} for stored chunks that other
+        files still reference; when the file was a chunk's own file, the first
+        remaining reference becomes the chunk's file. Chunks no other file
+        references are dropped from the index (the caller deletes them).
+        """
+        changed = {}
+        with self.lock:
+            for chunk_id, refs in list(self.refs.items()):
+                remaining = [ref for ref in refs if ref[0] != source_file]
+                if len(remaining) == len(refs):
+                    continue
+                if remaining:
+                    self.refs[chunk_id] = remaining
+                    changed[chunk_id] = remaining
+                else:
+                    self._drop(chunk_id)
+        return changed
+    
+    def stats(self):
+        """Duplicates dropped since the index was created in this process"""
+        return {"chunks": len(self.signatures), "duplicates": self.duplicates, "duplicate_bytes": self.duplicate_bytes}
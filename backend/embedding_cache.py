@@ -0,0 +1,153 @@
+import os
+import json
+import hashlib
+import threading
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+class EmbeddingCache:
+    """On-disk embedding cache: float32 vectors in a memory-mapped file plus a key index
+    
+    keys.txt holds one hex key per line and line N is row N of vectors.f32.
+    Vectors are appended before their keys, so a crash can only leave
+    unindexed or partial rows (or half a key line) at the end; both files
+    are truncated back to their complete rows on load.
+    """
+    
+    def __init__(self, cache_dir, model):
+        self.model = model
+        self.cache_dir = os.path.join(cache_dir, hashlib.sha1(model.encode()).hexdigest()[:12])
+        self.keys_path = os.path.join(self.cache_dir, "keys.txt")
+        self.vectors_path = os.path.join(self.cache_dir, "vectors.f32")
+        self.meta_path = os.path.join(self.cache_dir, "meta.json")
+        self.lock = threading.Lock()
+        self.rows = {}
+        self.dim = None
+        self._mmap = None
+        
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._load()
+    
+    def _load(self):
+        """Read the key index and cut both files back to the rows they agree on"""
+        if not os.path.exists(self.meta_path):
+            return
+        
+        with open(self.meta_path, 'r', encoding='utf-8') as f:
+            self.dim = json.load(f)['dim']
+        
+        row_bytes = self.dim * 4
+        stored_rows = os.path.getsize(self.vectors_path) // row_bytes if os.path.exists(self.vectors_path) else 0
+        
+        # Only complete key lines that have a complete vector count
+        keys_size = 0
+        if os.path.exists(self.keys_path):
+            with open(self.keys_path, 'rb') as f:
+                for row, line in enumerate(f):
+                    if row >= stored_rows or not line.endswith(b"\n"):
+                        break
+                    self.rows[line.decode('ascii').strip()] = row
+                    keys_size += len(line)
+        
+        # An interrupted append can leave a partial vector, rows without a
+        # key or half a key line; later appends would be misaligned with them
+        if os.path.exists(self.keys_path) and os.path.getsize(self.keys_path) != keys_size:
+            with open(self.keys_path, 'r+b') as f:
+                f.truncate(keys_size)
+        if os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path) != len(self.rows) * row_bytes:
+            with open(self.vectors_path, 'r+b') as f:
+                f.truncate(len(self.rows) * row_bytes)
+    
+    def key(self, text):
+        """Cache key for a chunk under this model"""
+        return hashlib.sha256(f"{self.model}\0{text}".encode('utf-8')).hexdigest()
+    
+    def _vectors(self):
+        """Memory-map the vector file, remapping after it has grown"""
+        if self._mmap is None or len(self._mmap) < len(self.rows):
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode='r',
+                                   shape=(len(self.rows), self.dim))
+        return self._mmap
+    
+    def get(self, keys):
+        """Look up keys, returns a list with a vector or None for each"""
+        with self.lock:
+            if not self.rows:
+                return [None] * len(keys)
+            
+            vectors = self._vectors()
+            return [vectors[self.rows[k]].tolist() if k in self.rows else None for k in keys]
+    
+    def put(self, keys, vectors):
+        """Append new vectors to the cache"""
+        with self.lock:
+            new = [(k, v) for k, v in zip(keys, vectors) if k not in self.rows]
+            if not new:
+                return
+            
+            if self.dim is None:
+                self.dim = len(new[0][1])
+                tmp_path = self.meta_path + ".tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump({'model': self.model, 'dim': self.dim}, f)
+                os.replace(tmp_path, self.meta_path)
+            
+            # Release the mapping before growing the file (required on Windows)
+            self._mmap = None
+            
+            block = np.asarray([v for _, v in new], dtype=np.float32)
+            with open(self.vectors_path, 'ab') as f:
+                f.write(block.tobytes())
+            
+            with open(self.keys_path, 'a', encoding='ascii') as f:
+                f.write("".join(f"{k}\n" for k, _ in new))
+            
+            for k, _ in new:
+                self.rows[k] = len(self.rows)
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper that only sends uncached chunks to the underlying model"""
+    
+    def __init__(self, embeddings, cache):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+    
+    def embed_documents(self, texts):
+        """Embed chunks, serving repeated text from the cache"""
+        keys = [self.cache.key(text) for text in texts]
+        vectors = self.cache.get(keys)
+        
+        # Identical chunks within a batch are only embedded once
+        missing = {}
+        for i, (key, vector) in enumerate(zip(keys, vectors)):
+            if vector is None:
+                missing.setdefault(key, []).append(i)
+        
+        with self.lock:
+            self.hits += len(texts) - sum(len(rows) for rows in missing.values())
+            self.misses += len(missing)
+        
+        if missing:
+            miss_keys = list(missing)
+            miss_texts = [texts[missing[k][0]] for k in miss_keys]
+            new_vectors = self.embeddings.embed_documents(miss_texts)
+            self.cache.put(miss_keys, new_vectors)
+            
+            for key, vector in zip(miss_keys, new_vectors):
+                for i in missing[key]:
+                    vectors[i] = vector
+        
+        return vectors
+    
+    def embed_query(self, text):
+        """Queries are not cached"""
+        return self.embeddings.embed_query(text)
+    
+    def report(self):
+        """Print cache hit/miss stats"""
+        total = self.hits + self.misses
+        rate = self.hits / total * 100 if total else 0
+        print(f"Embedding cache: {self.hits} hits, {self.misses} misses ({rate:.1f}% hit rate)")
@@ -1,4 +1,5 @@
 import os
+import time
 from langchain_community.document_loaders import PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain.schema import Document
@@ -13,66 +14,83 @@ def get_processed_files(vectorstore):
     except:
         return set()
 
-def load_and_split_documents(docs_dir, files_to_process, chunk_size=800, overlap=100):
-    """Load and split PDF/DOCX files"""
-    if not files_to_process:
-        return []
+def iter_file_chunks(docs_dir, filename, splitter):
+    """Yield the chunks of a single PDF/DOCX file page by page, raises ValueError if it is skipped"""
+    filepath = os.path.join(docs_dir, filename)
+    ext = os.path.splitext(filename)[1].lower()
+    ingested_at = int(time.time())
     
+    if ext == '.pdf':
+        # lazy_load parses one page at a time instead of the whole PDF
+        loader = PyPDFLoader(filepath)
+        for page in loader.lazy_load():
+            for doc in splitter.split_documents([page]):
+                doc.metadata = {
+                    'source_file': filename,
+                    'page': page.metadata.get('page', 0),
+                    'file_type': 'pdf',
+                    'ingested_at': ingested_at
+                }
+                yield doc
+        
+    elif ext == '.docx':
+        content = docx2txt.process(filepath)
+        if not content or not content.strip():
+            raise ValueError("Empty file")
+        
+        for j, text in enumerate(splitter.split_text(content.strip())):
+            yield Document(
+                page_content=text,
+                metadata={
+                    'source_file': filename,
+                    'page': j + 1,
+                    'file_type': 'docx',
+                    'ingested_at': ingested_at
+                }
+            )
+    
+    else:
+        raise ValueError("File type not supported")
+
+def split_file(docs_dir, filename, splitter):
+    """Load and split a single PDF/DOCX file, raises ValueError if it is skipped"""
+    return list(iter_file_chunks(docs_dir, filename, splitter))
+
+def load_file_chunks(docs_dir, filename, chunk_size=800, overlap=100):
+    """Load and split one file (picklable entry point for worker processes)"""
+    splitter = RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=overlap
+    )
+    return split_file(docs_dir, filename, splitter)
+
+def iter_documents(docs_dir, files_to_process, chunk_size=800, overlap=100, processed=None, failed=None):
+    """Yield chunks of PDF/DOCX files file by file, page by page
+    
+    Only the current page is held in memory. Filenames that were fully read are
+    appended to processed, ones that failed part way (and may already have
+    yielded chunks) to failed.
+    """
     splitter = RecursiveCharacterTextSplitter(
         chunk_size=chunk_size,
         chunk_overlap=overlap
     )
     
-    documents = []
-    processed = 0
+    processed = processed if processed is not None else []
+    failed = failed if failed is not None else []
     total_files = len(files_to_process)
     
     for i, filename in enumerate(files_to_process):
-        filepath = os.path.join(docs_dir, filename)
-        ext = os.path.splitext(filename)[1].lower()
-        
         print(f"Processing {i+1}/{total_files}: {filename}")
         
         try:
-            if ext == '.pdf':
-                loader = PyPDFLoader(filepath)
-                docs = loader.load()
-                splits = splitter.split_documents(docs)
-                
-                for doc in splits:
-                    doc.metadata = {
-                        'source_file': filename,
-                        'page': doc.metadata.get('page', 0),
-                        'file_type': 'pdf'
-                    }
-                documents.extend(splits)
-                processed += 1
-                
-            elif ext == '.docx':
-                content = docx2txt.process(filepath)
-                if content and content.strip():
-                    doc = Document(page_content=content.strip())
-                    splits = splitter.split_documents([doc])
-                    
-                    for j, split in enumerate(splits):
-                        split.metadata = {
-                            'source_file': filename,
-                            'page': j + 1,
-                            'file_type': 'docx'
-                        }
-                    documents.extend(splits)
-                    processed += 1
-                else:
-                    print(f"** Skipped ** {filename}: Empty file")
-                    
-            else:
-                print(f"** Skipped ** {filename}: File type not supported")
-                
+            yield from iter_file_chunks(docs_dir, filename, splitter)
+            processed.append(filename)
         except Exception as e:
             print(f"** Skipped ** {filename}: {e}")
+            failed.append(filename)
     
-    print(f"\nProcessed {processed}/{total_files} files")
-    return documents
+    print(f"\nProcessed {len(processed)}/{total_files} files")
 
 def get_document_files(docs_dir):
     """Get all files from directory (filtering happens during processing)"""
@@ -0,0 +1,131 @@
+import os
+import re
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from langchain_core.caches import BaseCache
+from langchain_core.outputs import Generation
+from metrics import GENERATION_CACHE_LOOKUPS
+from config import DB_DIR, LLM_CONFIG, GENERATION_CACHE_MAX_MB
+
+CACHE_FILE = "generation_cache.sqlite3"
+
+def llm_settings(llm):
+    """Model name plus the LLM_CONFIG options the LLM was created with"""
+    settings = {name: getattr(llm, name, None) for name in LLM_CONFIG}
+    settings["model"] = getattr(llm, "model", type(llm).__name__)
+    return json.dumps(settings, sort_keys=True, default=str)
+
+def deterministic(llm):
+    """Whether the LLM gives the same answer for the same prompt (temperature 0 or a fixed seed)"""
+    return getattr(llm, "temperature", None) == 0 or getattr(llm, "seed", None) is not None
+
+def replay_tokens(text):
+    """Split a cached answer back into token-sized pieces for streaming"""
+    return re.findall(r"\s*\S+|\s+$", text)
+
+class GenerationCache(BaseCache):
+    """Persistent LLM generation cache keyed on (prompt, model, LLM config)
+    
+    Prompts include the retrieved chunks, so two questions that retrieve the
+    same chunks with the same wording share an entry, and a changed collection
+    never serves a stale answer. Entries live in one SQLite file shared by
+    the CLI and the server, and the least recently used are dropped once the
+    file holds more than max_mb of answers.
+    
+    Set as llm.cache, LangChain checks it on every invoke; stream_answer
+    checks it explicitly since LangChain doesn't cache streams.
+    """
+    
+    def __init__(self, settings, db_dir=DB_DIR, max_mb=GENERATION_CACHE_MAX_MB):
+        self.settings = settings
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        
+        os.makedirs(db_dir, exist_ok=True)
+        self.path = os.path.join(db_dir, CACHE_FILE)
+        self.conn = sqlite3.connect(self.path, timeout=10, check_same_thread=False)
+        with self.lock, self.conn:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS generations ("
+                              "key TEXT PRIMARY KEY, text TEXT NOT NULL, size INTEGER NOT NULL, "
+                              "created REAL NOT NULL, last_used REAL NOT NULL)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS generations_last_used ON generations (last_used)")
+    
+    def key(self, prompt):
+        """Hash of the LLM settings and the prompt"""
+        return hashlib.sha256(f"{self.settings}\0{prompt}".encode('utf-8')).hexdigest()
+    
+    def get(self, prompt):
+        """Cached answer text for a prompt, or None"""
+        key = self.key(prompt)
+        with self.lock, self.conn:
+            row = self.conn.execute("SELECT text FROM generations WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.conn.execute("UPDATE generations SET last_used = ? WHERE key = ?", (time.time(), key))
+        
+        GENERATION_CACHE_LOOKUPS.inc(result="miss" if row is None else "hit")
+        return row[0] if row is not None else None
+    
+    def put(self, prompt, text):
+        """Store an answer, then trim the cache back under max_mb"""
+        now = time.time()
+        size = len(text.encode('utf-8'))
+        with self.lock, self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO generations VALUES (?, ?, ?, ?, ?)",
+                              (self.key(prompt), text, size, now, now))
+            self._trim()
+    
+    def _trim(self):
+        """Delete least recently used entries beyond max_bytes (call with the lock held)"""
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+        excess = total - self.max_bytes
+        if excess <= 0:
+            return
+        
+        expired = []
+        for key, size in self.conn.execute("SELECT key, size FROM generations ORDER BY last_used"):
+            expired.append((key,))
+            excess -= size
+            if excess <= 0:
+                break
+        self.conn.executemany("DELETE FROM generations WHERE key = ?", expired)
+    
+    # LangChain's llm_string is ignored: OllamaLLM leaves the model and its
+    # options out of it, which is what settings covers
+    
+    def lookup(self, prompt, llm_string):
+        """LangChain cache interface"""
+        text = self.get(prompt)
+        return [Generation(text=text)] if text is not None else None
+    
+    def update(self, prompt, llm_string, return_val):
+        """LangChain cache interface"""
+        if return_val:
+            self.put(prompt, return_val[0].text)
+    
+    def clear(self, **kwargs):
+        """Drop every cached generation"""
+        with self.lock, self.conn:
+            self.conn.execute("DELETE FROM generations")
+    
+    def stats(self):
+        """Hit rate and size"""
+        with self.lock:
+            entries, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM generations").fetchone()
+        total = self.hits + self.misses
+        return {
+            "entries": entries,
+            "answers_mb": round(size / (1024 * 1024), 2),
+            "max_mb": round(self.max_bytes / (1024 * 1024), 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else None
+        }
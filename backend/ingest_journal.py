@@ -0,0 +1,165 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from config import DB_DIR
+
+JOURNAL_FILE = "ingest_journal.jsonl"
+
+def file_key(filename, entry, chunk_size, overlap):
+    """Identifies one version of a file and how it was chunked"""
+    return f"{filename}\0{entry['hash']}\0{chunk_size}\0{overlap}"
+
+def chunk_id(key, index):
+    """Deterministic vectorstore id for the index-th chunk of a file version"""
+    return hashlib.sha256(f"{key}\0{index}".encode('utf-8')).hexdigest()[:32]
+
+class IngestBudget:
+    """Time and embedding limits for one db_setup.py run (None = no limit)"""
+    
+    def __init__(self, seconds=None, embeddings=None):
+        self.start = time.perf_counter()
+        self.seconds = seconds
+        self.embeddings = embeddings
+    
+    def exhausted(self, embedded):
+        """Whether a run that has embedded this many chunks should stop taking new batches"""
+        if self.seconds is not None and time.perf_counter() - self.start >= self.seconds:
+            return True
+        return self.embeddings is not None and embedded >= self.embeddings
+
+class IngestJournal:
+    """Append-only record of an ingestion run's progress
+    
+    Each line is written and fsynced after the step it records, so after a
+    crash the journal never claims more than the vectorstore holds:
+      
+      {"event": "file", "file": ..., "entry": ...}    file queued, with the manifest entry of the version read
+      {"event": "batch", "files": {file: [ids]},      chunks committed (stored, or folded into a duplicate)
+       "updated": [ids]}                             stored chunks that gained references
+      {"event": "parsed", "file": ..., "chunks": n}   every chunk of the file has been produced
+      {"event": "rollback", "file": ...}              file's chunks removed, it's retried next run
+      {"event": "checkpoint"}                         indexes and manifest saved
+    
+    A file is done once it's parsed and all its chunks are committed. The
+    journal is deleted when a run finishes, so one on disk means the last
+    run was interrupted or stopped at its budget.
+    """
+    
+    def __init__(self, db_dir=DB_DIR):
+        self.path = os.path.join(db_dir, JOURNAL_FILE)
+        self.lock = threading.Lock()
+        self.files = {}             # file -> {"entry", "committed": set of chunk ids, "chunks": count once parsed}
+        self.uncheckpointed = []    # chunk ids committed since the last checkpoint
+        self.updated = []           # stored chunk ids whose references changed since the last checkpoint
+        self.handle = None
+    
+    def exists(self):
+        """Whether an earlier run left a journal"""
+        return os.path.exists(self.path)
+    
+    def load(self):
+        """Replay the journal from disk (no-op if it doesn't exist)"""
+        if not self.exists():
+            return self
+        
+        offset = 0
+        with open(self.path, 'rb') as f:
+            for line in f:
+                # A crash can leave the last line half written
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    self._apply(json.loads(line))
+                except ValueError:
+                    break
+                offset += len(line)
+        
+        with open(self.path, 'r+b') as f:
+            f.truncate(offset)
+        return self
+    
+    def _apply(self, record):
+        """Update the in-memory state for one record (call with the lock held, or while loading)"""
+        event = record["event"]
+        if event == "file":
+            self.files[record["file"]] = {"entry": record["entry"], "committed": set(), "chunks": None}
+        elif event == "batch":
+            for filename, ids in record["files"].items():
+                if filename in self.files:
+                    self.files[filename]["committed"].update(ids)
+                self.uncheckpointed.extend(ids)
+            self.updated.extend(record.get("updated", []))
+        elif event == "parsed" and record["file"] in self.files:
+            self.files[record["file"]]["chunks"] = record["chunks"]
+        elif event == "rollback":
+            self.files.pop(record["file"], None)
+        elif event == "checkpoint":
+            self.uncheckpointed = []
+            self.updated = []
+    
+    def _write(self, record):
+        """Append a record and flush it to disk before applying it"""
+        with self.lock:
+            if self.handle is None:
+                self.handle = open(self.path, 'a', encoding='utf-8')
+            self.handle.write(json.dumps(record) + "\n")
+            self.handle.flush()
+            os.fsync(self.handle.fileno())
+            self._apply(record)
+    
+    def add_file(self, filename, entry):
+        """Queue a file with the manifest entry of the version being ingested"""
+        self._write({"event": "file", "file": filename, "entry": entry})
+    
+    def commit(self, files, updated=()):
+        """Record a committed batch, {file: [chunk ids]}, and the stored chunks it added references to"""
+        self._write({"event": "batch", "files": files, "updated": list(updated)})
+    
+    def parsed(self, filename, chunks):
+        """Record that a file produced this many chunks in total"""
+        self._write({"event": "parsed", "file": filename, "chunks": chunks})
+    
+    def rollback(self, filename):
+        """Forget a file whose chunks were removed"""
+        self._write({"event": "rollback", "file": filename})
+    
+    def checkpoint(self):
+        """Record that the indexes and manifest were saved"""
+        self._write({"event": "checkpoint"})
+    
+    def entry(self, filename):
+        """Manifest entry of the file version being ingested"""
+        return self.files[filename]["entry"]
+    
+    def committed(self, filename):
+        """Ids of a file's committed chunks"""
+        with self.lock:
+            return set(self.files[filename]["committed"]) if filename in self.files else set()
+    
+    def is_done(self, filename):
+        """Whether every chunk of the file has been committed"""
+        with self.lock:
+            state = self.files.get(filename)
+            return state is not None and state["chunks"] is not None and len(state["committed"]) >= state["chunks"]
+    
+    def done_files(self):
+        """{file: manifest entry} for finished files"""
+        return {filename: self.entry(filename) for filename in list(self.files) if self.is_done(filename)}
+    
+    def unfinished_files(self):
+        """Files queued but not finished"""
+        return [filename for filename in list(self.files) if not self.is_done(filename)]
+    
+    def finish(self):
+        """Delete the journal once the run's results are saved"""
+        with self.lock:
+            if self.handle is not None:
+                self.handle.close()
+                self.handle = None
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.files = {}
+            self.uncheckpointed = []
+            self.updated = []
@@ -0,0 +1,174 @@
+import os
+import re
+import json
+import math
+import threading
+from collections import Counter
+from config import DB_DIR
+
+INDEX_FILE = "keyword_index.json"
+
+# Keeps identifiers like "AB-1234" or "v2.1" together as one token
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-_./][a-z0-9]+)*")
+SEPARATOR_RE = re.compile(r"[-_./]")
+
+# Words that occur in nearly every chunk, ignored in queries so they don't score
+STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being between both but by can
+could did do does doing down during each few for from further had has have having he her here hers him his how i if
+in into is it its itself just me more most my no nor not now of off on once only or other our out over own same she
+should so some such than that the their them then there these they this those through to too under until up very
+was we were what when where which while who whom why will with would you your
+""".split())
+
+def tokenize(text):
+    """Lowercase tokens, with compound identifiers also split into their parts"""
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        tokens.append(token)
+        parts = SEPARATOR_RE.split(token)
+        if len(parts) > 1:
+            tokens.extend(parts)
+    return tokens
+
+def query_terms(query):
+    """Distinct query tokens that can score (stopwords dropped)"""
+    return {token for token in tokenize(query) if token not in STOPWORDS}
+
+def identifiers(query):
+    """Identifier-like query tokens (part numbers, versions, file or code names) an embedding is likely to miss"""
+    found = set()
+    for token in TOKEN_RE.findall(query.lower()):
+        parts = SEPARATOR_RE.split(token)
+        # "e.g" and "i.e" are joined like identifiers but aren't ones
+        if any(ch.isdigit() for ch in token) or (len(parts) > 1 and max(len(part) for part in parts) > 1):
+            found.add(token)
+    return found
+
+class KeywordIndex:
+    """In-process BM25 inverted index over the chunks in the collection"""
+    
+    def __init__(self, db_dir=DB_DIR, k1=1.5, b=0.75):
+        self.path = os.path.join(db_dir, INDEX_FILE)
+        self.k1 = k1
+        self.b = b
+        self.lock = threading.Lock()
+        self.postings = {}      # term -> {chunk id: term frequency}
+        self.doc_len = {}       # chunk id -> number of tokens
+        self.doc_file = {}      # chunk id -> source_file (for removing files)
+        self.total_len = 0
+        self.mtime = None
+    
+    def exists(self):
+        """Whether the index has been saved to disk"""
+        return os.path.exists(self.path)
+    
+    def load(self):
+        """Load the index from disk (no-op if it doesn't exist)"""
+        if not self.exists():
+            return self
+        
+        with self.lock:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            
+            self.postings = data['postings']
+            self.doc_len = data['doc_len']
+            self.doc_file = data['doc_file']
+            self.total_len = sum(self.doc_len.values())
+            self.mtime = mtime
+        return self
+    
+    def refresh(self):
+        """Reload if another process (db_setup.py) saved a newer index"""
+        if self.exists() and os.path.getmtime(self.path) != self.mtime:
+            self.load()
+    
+    def save(self):
+        """Write the index atomically"""
+        with self.lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'postings': self.postings,
+                    'doc_len': self.doc_len,
+                    'doc_file': self.doc_file
+                }, f)
+            os.replace(tmp_path, self.path)
+            self.mtime = os.path.getmtime(self.path)
+    
+    def add(self, ids, texts, metadatas):
+        """Index chunks under their vectorstore ids, replacing chunks already indexed under the same id"""
+        with self.lock:
+            # Re-added ids (resumed ingestion replays its last batches) would otherwise count twice in total_len
+            existing = {chunk_id for chunk_id in ids if chunk_id in self.doc_len}
+            if existing:
+                self._remove(existing)
+            
+            for chunk_id, text, metadata in zip(ids, texts, metadatas):
+                counts = Counter(tokenize(text))
+                for term, tf in counts.items():
+                    self.postings.setdefault(term, {})[chunk_id] = tf
+                
+                length = sum(counts.values())
+                self.doc_len[chunk_id] = length
+                self.doc_file[chunk_id] = (metadata or {}).get('source_file')
+                self.total_len += length
+    
+    def _remove(self, removed):
+        """Drop chunks by id (call with the lock held)"""
+        for term in list(self.postings):
+            docs = self.postings[term]
+            for cid in removed.intersection(docs):
+                del docs[cid]
+            if not docs:
+                del self.postings[term]
+        
+        for cid in removed:
+            self.total_len -= self.doc_len.pop(cid)
+            del self.doc_file[cid]
+    
+    def remove_file(self, source_file):
+        """Drop every chunk that came from a file"""
+        with self.lock:
+            removed = {cid for cid, f in self.doc_file.items() if f == source_file}
+            if removed:
+                self._remove(removed)
+    
+    def search(self, query, k=20, allowed=None):
+        """Top-k (chunk id, BM25 score) for a query, only over the ids in allowed if given"""
+        with self.lock:
+            n = len(self.doc_len)
+            if n == 0:
+                return []
+            
+            avg_len = self.total_len / n
+            scores = Counter()
+            
+            for term in query_terms(query):
+                docs = self.postings.get(term)
+                if not docs:
+                    continue
+                
+                idf = math.log(1 + (n - len(docs) + 0.5) / (len(docs) + 0.5))
+                for cid, tf in docs.items():
+                    if allowed is not None and cid not in allowed:
+                        continue
+                    norm = self.k1 * (1 - self.b + self.b * self.doc_len[cid] / avg_len)
+                    scores[cid] += idf * tf * (self.k1 + 1) / (tf + norm)
+            
+            return scores.most_common(k)
+    
+    def containing(self, terms):
+        """Ids of the chunks containing any of the terms"""
+        with self.lock:
+            return {cid for term in terms for cid in self.postings.get(term, ())}
+
+def reciprocal_rank_fusion(rankings, k=60):
+    """Fuse ranked id lists: score = sum of 1 / (k + rank) over the lists"""
+    scores = Counter()
+    for ranking in rankings:
+        for rank, item_id in enumerate(ranking, 1):
+            scores[item_id] += 1 / (k + rank)
+    return [item_id for item_id, _ in scores.most_common()]
@@ -0,0 +1,85 @@
+import os
+import json
+import hashlib
+from config import DB_DIR
+
+MANIFEST_FILE = "manifest.json"
+
+def file_hash(filepath, block_size=1 << 20):
+    """SHA-256 of a file's contents, read in blocks"""
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def file_entry(filepath, content_hash=None):
+    """Manifest entry (hash, mtime, size) for a file"""
+    stat = os.stat(filepath)
+    return {
+        'hash': content_hash or file_hash(filepath),
+        'mtime': stat.st_mtime,
+        'size': stat.st_size
+    }
+
+def failed_entry(entry):
+    """Manifest entry for a file version that couldn't be parsed, skipped until its contents change"""
+    return {**entry, 'failed': True}
+
+def indexed_files(manifest):
+    """Files in the manifest whose chunks are in the database"""
+    return [filename for filename, entry in manifest.items() if not entry.get('failed')]
+
+def load_manifest(db_dir=DB_DIR):
+    """Load the file manifest, returns None if there isn't one yet"""
+    path = os.path.join(db_dir, MANIFEST_FILE)
+    if not os.path.exists(path):
+        return None
+    
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def save_manifest(manifest, db_dir=DB_DIR):
+    """Write the manifest atomically so a crash never leaves half a file"""
+    path = os.path.join(db_dir, MANIFEST_FILE)
+    tmp_path = path + ".tmp"
+    
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def scan_changes(docs_dir, files, manifest):
+    """Compare files on disk with the manifest
+    
+    Returns (new, modified, removed, hashes), hashes has the content hash of
+    every new and modified file so they aren't read twice. Files whose size
+    and mtime match are skipped without being opened; files that were only
+    touched get their manifest mtime refreshed in place. Files that failed
+    to parse are skipped the same way, and retried (as modified) once their
+    hash changes.
+    """
+    new_files, modified_files = [], []
+    hashes = {}
+    
+    for filename in files:
+        filepath = os.path.join(docs_dir, filename)
+        entry = manifest.get(filename)
+        stat = os.stat(filepath)
+        
+        if entry and entry['size'] == stat.st_size and entry['mtime'] == stat.st_mtime:
+            continue
+        
+        content_hash = file_hash(filepath)
+        if entry is None:
+            new_files.append(filename)
+            hashes[filename] = content_hash
+        elif entry['hash'] != content_hash:
+            modified_files.append(filename)
+            hashes[filename] = content_hash
+        else:
+            manifest[filename] = {**entry, **file_entry(filepath, content_hash)}
+    
+    on_disk = set(files)
+    removed_files = [f for f in manifest if f not in on_disk]
+    
+    return new_files, modified_files, removed_files, hashes
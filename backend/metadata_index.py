@@ -0,0 +1,166 @@
+import os
+import json
+import threading
+from datetime import datetime
+from dedup_index import stored_references
+from config import DB_DIR
+
+INDEX_FILE = "metadata_index.json"
+
+FILTER_KEYS = {"source_file", "file_type", "page_min", "page_max", "ingested_after", "ingested_before"}
+
+def parse_date(value):
+    """Epoch seconds from a number or an ISO date/datetime string"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    return datetime.fromisoformat(str(value)).timestamp()
+
+def as_set(value):
+    """One value or a list of values as a set"""
+    return set(value) if isinstance(value, (list, tuple, set)) else {value}
+
+def parse_filters(raw):
+    """Validate request filters, raises ValueError
+    
+    {"source_file": "a.pdf" or [...], "file_type": "pdf" or [...],
+     "page_min": 3, "page_max": 10,
+     "ingested_after": "2025-01-31", "ingested_before": 1738300000}
+    """
+    if not raw:
+        return None
+    if not isinstance(raw, dict):
+        raise ValueError("filters must be an object")
+    
+    unknown = set(raw) - FILTER_KEYS
+    if unknown:
+        raise ValueError(f"Unknown filters: {', '.join(sorted(unknown))}")
+    
+    filters = {}
+    try:
+        for key in ("source_file", "file_type"):
+            if raw.get(key) is not None:
+                filters[key] = as_set(raw[key])
+        for key in ("page_min", "page_max"):
+            if raw.get(key) is not None:
+                filters[key] = int(raw[key])
+        for key in ("ingested_after", "ingested_before"):
+            if raw.get(key) is not None:
+                filters[key] = parse_date(raw[key])
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"Invalid filter value: {e}")
+    
+    return filters or None
+
+def filters_to_where(filters):
+    """The same filters as a Chroma where clause"""
+    clauses = []
+    if "source_file" in filters:
+        clauses.append({"source_file": {"$in": sorted(filters["source_file"])}})
+    if "file_type" in filters:
+        clauses.append({"file_type": {"$in": sorted(filters["file_type"])}})
+    if "page_min" in filters:
+        clauses.append({"page": {"$gte": filters["page_min"]}})
+    if "page_max" in filters:
+        clauses.append({"page": {"$lte": filters["page_max"]}})
+    if "ingested_after" in filters:
+        clauses.append({"ingested_at": {"$gte": filters["ingested_after"]}})
+    if "ingested_before" in filters:
+        clauses.append({"ingested_at": {"$lte": filters["ingested_before"]}})
+    
+    if not clauses:
+        return None
+    return clauses[0] if len(clauses) == 1 else {"$and": clauses}
+
+class MetadataIndex:
+    """Chunk ids grouped by file, with file type, ingestion time and page
+    
+    Used to narrow a filtered search down to its candidate chunks before the
+    vector search. File-level filters skip whole files, so a filter on one
+    manual only ever touches that manual's chunks.
+    """
+    
+    def __init__(self, db_dir=DB_DIR):
+        self.path = os.path.join(db_dir, INDEX_FILE)
+        self.lock = threading.Lock()
+        self.files = {}     # source_file -> {"file_type", "ingested_at", "chunks": {chunk id: page}}
+        self.mtime = None
+    
+    def exists(self):
+        """Whether the index has been saved to disk"""
+        return os.path.exists(self.path)
+    
+    def load(self):
+        """Load the index from disk (no-op if it doesn't exist)"""
+        if not self.exists():
+            return self
+        
+        with self.lock:
+            mtime = os.path.getmtime(self.path)
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.files = json.load(f)['files']
+            self.mtime = mtime
+        return self
+    
+    def refresh(self):
+        """Reload if another process (db_setup.py) saved a newer index"""
+        if self.exists() and os.path.getmtime(self.path) != self.mtime:
+            self.load()
+    
+    def save(self):
+        """Write the index atomically"""
+        with self.lock:
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({'files': self.files}, f)
+            os.replace(tmp_path, self.path)
+            self.mtime = os.path.getmtime(self.path)
+    
+    def add(self, ids, texts, metadatas):
+        """Index chunks under their vectorstore ids (texts are unused, same call as KeywordIndex.add)"""
+        with self.lock:
+            for chunk_id, metadata in zip(ids, metadatas):
+                metadata = metadata or {}
+                
+                # A deduplicated chunk is listed under every file it came from
+                for source_file, page, file_type in stored_references(metadata):
+                    entry = self.files.setdefault(source_file, {
+                        "file_type": file_type,
+                        "ingested_at": metadata.get('ingested_at'),
+                        "chunks": {}
+                    })
+                    entry["chunks"][chunk_id] = page
+    
+    def remove_file(self, source_file):
+        """Drop every chunk that came from a file"""
+        with self.lock:
+            self.files.pop(source_file, None)
+    
+    def candidates(self, filters):
+        """Ids of the chunks that match the filters"""
+        with self.lock:
+            if "source_file" in filters:
+                entries = [self.files[f] for f in filters["source_file"] if f in self.files]
+            else:
+                entries = list(self.files.values())
+            
+            ids = []
+            for entry in entries:
+                if "file_type" in filters and entry["file_type"] not in filters["file_type"]:
+                    continue
+                
+                # Chunks indexed before ingestion dates were recorded never match a date filter
+                ingested_at = entry["ingested_at"]
+                if "ingested_after" in filters and (ingested_at is None or ingested_at < filters["ingested_after"]):
+                    continue
+                if "ingested_before" in filters and (ingested_at is None or ingested_at > filters["ingested_before"]):
+                    continue
+                
+                if "page_min" in filters or "page_max" in filters:
+                    low, high = filters.get("page_min", float("-inf")), filters.get("page_max", float("inf"))
+                    ids.extend(cid for cid, page in entry["chunks"].items()
+                               if page is not None and low <= page <= high)
+                else:
+                    ids.extend(entry["chunks"])
+            
+            # A deduplicated chunk can match under several files
+            return list(dict.fromkeys(ids))
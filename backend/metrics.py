@@ -0,0 +1,174 @@
+import time
+import threading
+import contextvars
+from contextlib import contextmanager
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.embeddings import Embeddings
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+# Per-request stage timings, set by start_timings() in the request's thread
+current_timings = contextvars.ContextVar("current_timings", default=None)
+
+def format_labels(labels):
+    """Prometheus label set, e.g. {stage="llm"}"""
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+class Counter:
+    """Monotonic counter with optional labels"""
+    
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self.lock = threading.Lock()
+        self.values = {}
+    
+    def inc(self, amount=1, **labels):
+        """Add amount to the series for these labels"""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+    
+    def render(self):
+        """Prometheus text lines"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self.lock:
+            for key, value in sorted(self.values.items()):
+                lines.append(f"{self.name}{format_labels(key)} {value}")
+        return lines
+
+class Histogram:
+    """Cumulative-bucket histogram with optional labels"""
+    
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.series = {}    # labels -> [bucket counts, sum, count]
+    
+    def observe(self, value, **labels):
+        """Record one value for these labels"""
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            counts, total, count = self.series.get(key) or ([0] * len(self.buckets), 0.0, 0)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self.series[key] = [counts, total + value, count + 1]
+    
+    def render(self):
+        """Prometheus text lines"""
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            for key, (counts, total, count) in sorted(self.series.items()):
+                for bound, bucket_count in zip(self.buckets, counts):
+                    lines.append(f"{self.name}_bucket{format_labels(key + (('le', bound),))} {bucket_count}")
+                lines.append(f"{self.name}_bucket{format_labels(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{self.name}_sum{format_labels(key)} {total}")
+                lines.append(f"{self.name}_count{format_labels(key)} {count}")
+        return lines
+
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Time spent per pipeline stage")
+REQUESTS = Counter("rag_requests_total", "Requests by endpoint")
+EMBEDDED_TEXTS = Counter("rag_embedded_texts_total", "Texts sent to the embedding model")
+CHUNKS_RETRIEVED = Counter("rag_chunks_retrieved_total", "Chunks returned by the retriever")
+RETRIEVAL_FALLBACKS = Counter("rag_retrieval_fallback_total", "Queries where no chunk passed the threshold (fell back to top 3)")
+NO_CONTEXT_ANSWERS = Counter("rag_no_context_answers_total", "Queries answered without the LLM because no chunk was relevant")
+RERANK_CANDIDATE_TOKENS = Counter("rag_rerank_candidate_tokens_total", "Approximate tokens in the chunks sent to the re-ranker")
+RERANK_KEPT_TOKENS = Counter("rag_rerank_kept_tokens_total", "Approximate tokens in the chunks the re-ranker kept")
+GENERATION_CACHE_LOOKUPS = Counter("rag_generation_cache_lookups_total", "LLM generation cache lookups by result")
+LLM_PROMPT_TOKENS = Counter("rag_llm_prompt_tokens_total", "Prompt tokens evaluated by the LLM")
+LLM_OUTPUT_TOKENS = Counter("rag_llm_output_tokens_total", "Tokens generated by the LLM")
+
+METRICS = [STAGE_SECONDS, REQUESTS, EMBEDDED_TEXTS, CHUNKS_RETRIEVED, RETRIEVAL_FALLBACKS, NO_CONTEXT_ANSWERS,
+           RERANK_CANDIDATE_TOKENS, RERANK_KEPT_TOKENS, GENERATION_CACHE_LOOKUPS, LLM_PROMPT_TOKENS, LLM_OUTPUT_TOKENS]
+
+def render_metrics():
+    """All metrics in Prometheus text format"""
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+def start_timings():
+    """Start collecting a stage breakdown for the current request"""
+    timings = {}
+    current_timings.set(timings)
+    return timings
+
+def record_stage(stage, seconds):
+    """Observe a stage duration, adding it to the request breakdown if one is active"""
+    STAGE_SECONDS.observe(seconds, stage=stage)
+    
+    timings = current_timings.get()
+    if timings is not None:
+        timings[stage] = round(timings.get(stage, 0.0) + seconds, 4)
+
+@contextmanager
+def timed(stage):
+    """Time a block as a pipeline stage"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+class InstrumentedEmbeddings(Embeddings):
+    """Times and counts calls to the embedding model"""
+    
+    def __init__(self, embeddings):
+        self.embeddings = embeddings
+    
+    def embed_documents(self, texts):
+        """Embed chunks (stage: document_embedding)"""
+        EMBEDDED_TEXTS.inc(len(texts), kind="document")
+        with timed("document_embedding"):
+            return self.embeddings.embed_documents(texts)
+    
+    def embed_query(self, text):
+        """Embed a query (stage: query_embedding)"""
+        EMBEDDED_TEXTS.inc(kind="query")
+        with timed("query_embedding"):
+            return self.embeddings.embed_query(text)
+    
+    def embed_queries(self, texts):
+        """Embed many queries in one model call (stage: query_embedding)"""
+        EMBEDDED_TEXTS.inc(len(texts), kind="query")
+        with timed("query_embedding"):
+            return self.embeddings.embed_documents(texts)
+
+class LLMMetricsHandler(BaseCallbackHandler):
+    """Records LLM wall time, plus Ollama's prompt-eval/generation split and token counts"""
+    
+    def __init__(self):
+        self.starts = {}
+    
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        """Remember when the call started"""
+        self.starts[run_id] = time.perf_counter()
+    
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        """Record wall time and whatever timing/token info Ollama returned"""
+        start = self.starts.pop(run_id, None)
+        if start is not None:
+            record_stage("llm", time.perf_counter() - start)
+        
+        # Ollama reports durations in nanoseconds on the final chunk
+        for generations in response.generations:
+            for generation in generations:
+                info = generation.generation_info or {}
+                if "prompt_eval_duration" in info:
+                    record_stage("llm_prompt_eval", info["prompt_eval_duration"] / 1e9)
+                if "eval_duration" in info:
+                    record_stage("llm_generation", info["eval_duration"] / 1e9)
+                LLM_PROMPT_TOKENS.inc(info.get("prompt_eval_count", 0))
+                LLM_OUTPUT_TOKENS.inc(info.get("eval_count", 0))
+    
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        """Forget the start time of a failed call"""
+        self.starts.pop(run_id, None)
+
+llm_metrics_handler = LLMMetricsHandler()
@@ -0,0 +1,506 @@
+import os
+import json
+import uuid
+import threading
+import numpy as np
+from typing import Any, Iterable, List, Optional
+from langchain_core.documents import Document
+from langchain_core.vectorstores import VectorStore
+from quantization import create_quantizer
+
+# Rows scored per matrix product, bounds the score matrix for large collections
+BLOCK_ROWS = 65536
+QUANTIZED_BLOCK_ROWS = 16384
+
+class NumpyVectorStore(VectorStore):
+    """Exact cosine search over a memory-mapped matrix of normalized float32 vectors
+    
+    vectors.f32 holds one unit-length row per chunk and line N of rows.jsonl
+    ({id, document, metadata}) describes row N. Vectors are appended before
+    their rows, so an interrupted append only leaves unindexed or partial
+    vectors (or half a row line) at the end, which are dropped on load. Deleted rows are listed in deleted.json and
+    skipped until enough of them pile up to rewrite the files.
+    
+    With quantization ("int8" or "pq") compact codes are kept in RAM and
+    scanned first; the best rerank_candidates * k rows are then re-scored
+    against the float32 vectors, which stay on disk behind the memory map.
+    Rows added after the codes were built (build_codes) are always re-scored.
+    
+    Search results use the same (doc, cosine distance) convention as Chroma.
+    """
+    
+    def __init__(self, collection_name, embedding_function, persist_directory, quantization=None,
+                 rerank_candidates=10, pq_sub_dim=8):
+        self.collection_name = collection_name
+        self.embedding_function = embedding_function
+        self.store_dir = os.path.join(persist_directory, "numpy_store", collection_name)
+        self.vectors_path = os.path.join(self.store_dir, "vectors.f32")
+        self.rows_path = os.path.join(self.store_dir, "rows.jsonl")
+        self.deleted_path = os.path.join(self.store_dir, "deleted.json")
+        self.meta_path = os.path.join(self.store_dir, "meta.json")
+        self.quantization = quantization
+        self.rerank_candidates = rerank_candidates
+        self.pq_sub_dim = pq_sub_dim
+        self.codes_path = os.path.join(self.store_dir, f"codes.{quantization}")
+        self.quantizer_path = os.path.join(self.store_dir, f"quantizer.{quantization}.npz")
+        self.lock = threading.RLock()
+        
+        os.makedirs(self.store_dir, exist_ok=True)
+        self._load()
+    
+    @property
+    def embeddings(self):
+        return self.embedding_function
+    
+    # Loading
+    
+    def _stamp(self):
+        """Changes whenever another process adds or deletes rows"""
+        return tuple(
+            (os.path.getsize(p), os.path.getmtime(p)) if os.path.exists(p) else None
+            for p in (self.rows_path, self.deleted_path, self.codes_path)
+        )
+    
+    def _load(self):
+        """Read the row index and deleted list, and check them against the vector file"""
+        with self.lock:
+            self.ids = []
+            self.offsets = []
+            self.source_files = []
+            self.row_of = {}
+            self.alive = np.zeros(0, dtype=bool)
+            self.dim = None
+            self._mmap = None
+            self.quantizer = None
+            self.codes = None
+            self.stamp = self._stamp()
+            
+            if not os.path.exists(self.meta_path):
+                return
+            
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.dim = json.load(f)['dim']
+            
+            stored_rows = os.path.getsize(self.vectors_path) // (self.dim * 4) if os.path.exists(self.vectors_path) else 0
+            
+            if os.path.exists(self.rows_path):
+                with open(self.rows_path, 'rb') as f:
+                    offset = 0
+                    for line in f:
+                        if len(self.ids) >= stored_rows or not line.endswith(b"\n"):
+                            break
+                        row = json.loads(line)
+                        self.row_of[row['id']] = len(self.ids)
+                        self.ids.append(row['id'])
+                        self.offsets.append(offset)
+                        self.source_files.append((row.get('metadata') or {}).get('source_file'))
+                        offset += len(line)
+                
+                # Drop a partly written last line
+                if offset < os.path.getsize(self.rows_path):
+                    with open(self.rows_path, 'r+b') as f:
+                        f.truncate(offset)
+            
+            # Drop vectors written without a row, or half a vector (interrupted append);
+            # later appends would be misaligned with them
+            if os.path.exists(self.vectors_path) and os.path.getsize(self.vectors_path) != len(self.ids) * self.dim * 4:
+                with open(self.vectors_path, 'r+b') as f:
+                    f.truncate(len(self.ids) * self.dim * 4)
+            
+            self.alive = np.ones(len(self.ids), dtype=bool)
+            if os.path.exists(self.deleted_path):
+                with open(self.deleted_path, 'r', encoding='utf-8') as f:
+                    deleted = [row for row in json.load(f) if row < len(self.ids)]
+                self.alive[deleted] = False
+                for row in deleted:
+                    # A replaced row's id lives on in a later row
+                    if self.row_of.get(self.ids[row]) == row:
+                        del self.row_of[self.ids[row]]
+            
+            self._load_codes()
+            self.stamp = self._stamp()
+    
+    def _load_codes(self):
+        """Load the quantizer and read its codes into memory"""
+        if not self.quantization or self.dim is None:
+            return
+        
+        self.quantizer = create_quantizer(self.quantization, self.dim, self.pq_sub_dim)
+        if os.path.exists(self.quantizer_path):
+            self.quantizer.load_state(dict(np.load(self.quantizer_path)))
+        
+        if self.quantizer.trained and os.path.exists(self.codes_path):
+            codes = np.fromfile(self.codes_path, dtype=np.uint8)
+            coded = min(len(codes) // self.quantizer.code_size, len(self.ids))
+            self.codes = codes[:coded * self.quantizer.code_size].reshape(coded, self.quantizer.code_size)
+        else:
+            self.codes = np.zeros((0, self.quantizer.code_size), dtype=np.uint8)
+    
+    def _write_codes(self, codes):
+        """Replace the codes file and quantizer state"""
+        with open(self.quantizer_path + ".tmp", 'wb') as f:
+            np.savez(f, **self.quantizer.state())
+        os.replace(self.quantizer_path + ".tmp", self.quantizer_path)
+        
+        with open(self.codes_path + ".tmp", 'wb') as f:
+            f.write(codes.tobytes())
+        os.replace(self.codes_path + ".tmp", self.codes_path)
+        self.codes = codes
+    
+    def build_codes(self, retrain_growth=2.0):
+        """Encode rows added since the last build, (re)training PQ when the store has grown a lot"""
+        if not self.quantization:
+            return
+        
+        with self.lock:
+            self.refresh()
+            if not self.ids:
+                return
+            
+            vectors = self._vectors()
+            quantizer = self.quantizer
+            retrain = (not quantizer.trained or
+                       (quantizer.kind == "pq" and len(vectors) > quantizer.trained_on * retrain_growth))
+            
+            if retrain:
+                quantizer.train(np.asarray(vectors))
+                if not quantizer.trained:
+                    return
+                start, codes = 0, []
+            else:
+                start, codes = len(self.codes), [self.codes]
+            
+            for block_start in range(start, len(vectors), BLOCK_ROWS):
+                codes.append(quantizer.encode(np.asarray(vectors[block_start:block_start + BLOCK_ROWS])))
+            
+            self._write_codes(np.concatenate(codes) if codes else self.codes)
+            self.stamp = self._stamp()
+    
+    def memory_footprint(self):
+        """Bytes of the float32 matrix vs the in-memory codes"""
+        with self.lock:
+            self.refresh()
+            float_bytes = len(self.ids) * (self.dim or 0) * 4
+            code_bytes = self.codes.nbytes if self.codes is not None else 0
+            return {
+                "rows": len(self.ids),
+                "quantization": self.quantization,
+                "float32_mb": round(float_bytes / 2**20, 2),
+                "codes_mb": round(code_bytes / 2**20, 2) if self.quantization else None,
+                "compression": round(float_bytes / code_bytes, 1) if code_bytes else None
+            }
+    
+    def refresh(self):
+        """Reload if another process (db_setup.py) changed the store"""
+        if self._stamp() != self.stamp:
+            self._load()
+    
+    def _vectors(self):
+        """Memory-map the vector file, remapping after it has grown"""
+        if self._mmap is None or len(self._mmap) < len(self.ids):
+            self._mmap = np.memmap(self.vectors_path, dtype=np.float32, mode='r',
+                                   shape=(len(self.ids), self.dim))
+        return self._mmap
+    
+    def _snapshot(self):
+        """Matrix and alive mask for searching outside the lock"""
+        with self.lock:
+            self.refresh()
+            if not self.ids:
+                return None, None
+            return self._vectors(), self.alive
+    
+    def _read_rows(self, rows):
+        """Read the stored id/document/metadata of rows"""
+        with self.lock:
+            offsets = [self.offsets[row] for row in rows]
+        
+        records = []
+        with open(self.rows_path, 'rb') as f:
+            for offset in offsets:
+                f.seek(offset)
+                records.append(json.loads(f.readline()))
+        return records
+    
+    # Writing
+    
+    @staticmethod
+    def _normalize(vectors):
+        """Unit-length float32 rows (zero vectors stay zero)"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+        return vectors / np.where(norms == 0, 1, norms)
+    
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        """Embed and append texts, replacing any rows with the same ids"""
+        texts = list(texts)
+        if not texts:
+            return []
+        
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(uuid.uuid4()) for _ in texts]
+        block = self._normalize(self.embedding_function.embed_documents(texts))
+        self._append(ids, texts, metadatas, block)
+        return ids
+    
+    def add_embeddings(self, ids, embeddings, texts, metadatas):
+        """Append rows for vectors that were embedded elsewhere (snapshot import)"""
+        self._append(ids, texts, metadatas, self._normalize(embeddings))
+    
+    def update_metadata(self, ids, metadatas):
+        """Replace the metadata of stored chunks (their rows are re-appended, nothing is re-embedded)"""
+        with self.lock:
+            self.refresh()
+            rows = [self.row_of[chunk_id] for chunk_id in ids]
+            block = np.array(self._vectors()[rows])
+            texts = [record['document'] for record in self._read_rows(rows)]
+            self._append(ids, texts, metadatas, block)
+    
+    def _append(self, ids, texts, metadatas, block):
+        """Append rows for normalized vectors, replacing any rows with the same ids"""
+        with self.lock:
+            self.refresh()
+            
+            existing = [chunk_id for chunk_id in ids if chunk_id in self.row_of]
+            if existing:
+                self.delete(ids=existing)
+            
+            if self.dim is None:
+                self.dim = block.shape[1]
+                with open(self.meta_path + ".tmp", 'w', encoding='utf-8') as f:
+                    json.dump({'dim': self.dim}, f)
+                os.replace(self.meta_path + ".tmp", self.meta_path)
+            
+            # Release the mapping before growing the file (required on Windows)
+            self._mmap = None
+            
+            with open(self.vectors_path, 'ab') as f:
+                f.write(block.tobytes())
+            
+            offset = os.path.getsize(self.rows_path) if os.path.exists(self.rows_path) else 0
+            lines = [
+                (json.dumps({'id': chunk_id, 'document': text, 'metadata': metadata or {}}) + "\n").encode('utf-8')
+                for chunk_id, text, metadata in zip(ids, texts, metadatas)
+            ]
+            with open(self.rows_path, 'ab') as f:
+                f.write(b"".join(lines))
+            
+            for chunk_id, line, metadata in zip(ids, lines, metadatas):
+                self.row_of[chunk_id] = len(self.ids)
+                self.ids.append(chunk_id)
+                self.offsets.append(offset)
+                self.source_files.append((metadata or {}).get('source_file'))
+                offset += len(line)
+            
+            # New array rather than in-place, searches may still hold the old one
+            self.alive = np.concatenate([self.alive, np.ones(len(ids), dtype=bool)])
+            
+            if self.quantization and self.quantizer is None:
+                self._load_codes()
+            
+            # Encode right away when the codes cover every earlier row (PQ needs training first)
+            if self.quantizer is not None and self.quantizer.trained and len(self.codes) == len(self.ids) - len(ids):
+                new_codes = self.quantizer.encode(block)
+                with open(self.codes_path, 'ab') as f:
+                    f.write(new_codes.tobytes())
+                self.codes = np.concatenate([self.codes, new_codes])
+            
+            self.stamp = self._stamp()
+    
+    def _matching_rows(self, ids=None, where=None):
+        """Live rows selected by ids and/or {metadata key: value} equality"""
+        if ids is not None:
+            rows = [self.row_of[chunk_id] for chunk_id in ids if chunk_id in self.row_of]
+        else:
+            rows = np.flatnonzero(self.alive).tolist()
+        
+        if where:
+            if set(where) == {'source_file'}:
+                rows = [row for row in rows if self.source_files[row] == where['source_file']]
+            else:
+                records = self._read_rows(rows)
+                rows = [row for row, record in zip(rows, records)
+                        if all(record['metadata'].get(key) == value for key, value in where.items())]
+        return rows
+    
+    def delete(self, ids: Optional[List[str]] = None, where: Optional[dict] = None, **kwargs: Any) -> None:
+        """Delete rows by id or metadata match"""
+        with self.lock:
+            self.refresh()
+            rows = self._matching_rows(ids, where)
+            if not rows:
+                return
+            
+            alive = self.alive.copy()
+            alive[rows] = False
+            self.alive = alive
+            for row in rows:
+                self.row_of.pop(self.ids[row], None)
+            
+            # Rewrite the files once half the rows are dead, otherwise just record them
+            if np.count_nonzero(~alive) * 2 > len(alive):
+                self.compact()
+            else:
+                tmp_path = self.deleted_path + ".tmp"
+                with open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(np.flatnonzero(~alive).tolist(), f)
+                os.replace(tmp_path, self.deleted_path)
+                self.stamp = self._stamp()
+    
+    def compact(self):
+        """Rewrite the vector and row files without deleted rows"""
+        with self.lock:
+            keep = np.flatnonzero(self.alive)
+            vectors = np.array(self._vectors()[keep]) if len(keep) else np.zeros((0, self.dim), dtype=np.float32)
+            records = self._read_rows(keep.tolist())
+            
+            # Kept rows that had codes are a prefix of keep
+            if self.codes is not None and len(self.codes):
+                self._write_codes(self.codes[keep[keep < len(self.codes)]])
+            
+            self._mmap = None
+            for path, data in (
+                (self.vectors_path, vectors.tobytes()),
+                (self.rows_path, b"".join((json.dumps(r) + "\n").encode('utf-8') for r in records))
+            ):
+                with open(path + ".tmp", 'wb') as f:
+                    f.write(data)
+                os.replace(path + ".tmp", path)
+            
+            if os.path.exists(self.deleted_path):
+                os.remove(self.deleted_path)
+            self._load()
+    
+    # Reading
+    
+    def count(self):
+        """Number of live rows"""
+        with self.lock:
+            self.refresh()
+            return int(np.count_nonzero(self.alive))
+    
+    def get(self, ids=None, where=None, limit=None, offset=None, include=None):
+        """Chroma-style get: {'ids', 'documents', 'metadatas'[, 'embeddings']}"""
+        include = include if include is not None else ['documents', 'metadatas']
+        
+        with self.lock:
+            self.refresh()
+            rows = self._matching_rows(ids, where)
+            rows = rows[offset or 0:]
+            if limit is not None:
+                rows = rows[:limit]
+            
+            result = {'ids': [self.ids[row] for row in rows]}
+            if 'documents' in include or 'metadatas' in include:
+                records = self._read_rows(rows)
+                if 'documents' in include:
+                    result['documents'] = [r['document'] for r in records]
+                if 'metadatas' in include:
+                    result['metadatas'] = [r['metadata'] for r in records]
+            if 'embeddings' in include:
+                result['embeddings'] = np.array(self._vectors()[rows]) if rows else np.zeros((0, self.dim or 0))
+        
+        return result
+    
+    @staticmethod
+    def _blocked_top_k(score_block, n, k, alive, block_rows=BLOCK_ROWS):
+        """Running top k over rows [0, n), scoring block_rows at a time with score_block(start, end)"""
+        best_rows, best_scores = None, None
+        
+        for start in range(0, n, block_rows):
+            end = min(start + block_rows, n)
+            scores = score_block(start, end)
+            scores[:, ~alive[start:end]] = -np.inf
+            rows = np.broadcast_to(np.arange(start, end), scores.shape)
+            
+            # Merge this block's scores with the best so far
+            if best_rows is not None:
+                rows = np.concatenate([best_rows, rows], axis=1)
+                scores = np.concatenate([best_scores, scores], axis=1)
+            if scores.shape[1] > k:
+                top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+                rows = np.take_along_axis(rows, top, axis=1)
+                scores = np.take_along_axis(scores, top, axis=1)
+            best_rows, best_scores = rows, scores
+        
+        return best_rows, best_scores
+    
+    def _top_k(self, queries, k, ids=None):
+        """Row indices and cosine similarities of the k best live rows per query (only rows of ids if given)"""
+        with self.lock:
+            vectors, alive = self._snapshot()
+            codes = self.codes
+            subset = None if ids is None else np.array(
+                [self.row_of[chunk_id] for chunk_id in ids if chunk_id in self.row_of], dtype=np.int64)
+        if vectors is None:
+            return [[] for _ in queries], [[] for _ in queries]
+        
+        k = min(k, int(np.count_nonzero(alive)) if subset is None else len(subset))
+        if k == 0:
+            return [[] for _ in queries], [[] for _ in queries]
+        
+        if subset is not None:
+            # Pre-filtered: score just the candidate rows, exactly
+            scores = queries @ np.asarray(vectors[np.sort(subset)]).T
+            rows = np.broadcast_to(np.sort(subset), scores.shape)
+        elif codes is not None and len(codes):
+            rows, scores = self._rerank_quantized(queries, k, vectors, alive, codes)
+        else:
+            rows, scores = self._blocked_top_k(lambda start, end: queries @ vectors[start:end].T,
+                                               len(vectors), k, alive)
+        
+        order = np.argsort(-scores, axis=1)[:, :k]
+        return np.take_along_axis(rows, order, axis=1), np.take_along_axis(scores, order, axis=1)
+    
+    def _rerank_quantized(self, queries, k, vectors, alive, codes):
+        """Shortlist rows by their codes, then re-score the shortlist with float32 vectors"""
+        shortlist = min(k * self.rerank_candidates, len(codes))
+        rows, _ = self._blocked_top_k(lambda start, end: self.quantizer.scores(queries, codes[start:end]),
+                                      len(codes), shortlist, alive, QUANTIZED_BLOCK_ROWS)
+        
+        # Rows added since the codes were built are always candidates
+        tail = np.arange(len(codes), len(vectors))
+        rows = np.concatenate([rows, np.broadcast_to(tail, (len(queries), len(tail)))], axis=1)
+        
+        scores = np.einsum('qcd,qd->qc', np.asarray(vectors[rows]), queries)
+        scores[~alive[rows]] = -np.inf
+        return rows, scores
+    
+    def search_by_vectors(self, embeddings, k=4, ids=None):
+        """Batched exact search, returns a list of (doc, cosine distance) lists (searching only ids if given)"""
+        queries = self._normalize(embeddings)
+        all_rows, all_scores = self._top_k(queries, k, ids)
+        
+        results = []
+        for rows, scores in zip(all_rows, all_scores):
+            records = self._read_rows([int(row) for row in rows])
+            results.append([
+                (Document(page_content=r['document'], metadata=r['metadata'], id=r['id']), float(1 - score))
+                for r, score in zip(records, scores) if np.isfinite(score)
+            ])
+        return results
+    
+    def similarity_search_by_vector_with_relevance_scores(self, embedding, k=4, **kwargs):
+        """(doc, cosine distance) pairs, same convention as Chroma"""
+        return self.search_by_vectors([embedding], k)[0]
+    
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        """(doc, cosine distance) pairs for a query"""
+        return self.similarity_search_by_vector_with_relevance_scores(self.embeddings.embed_query(query), k)
+    
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_by_vector_with_relevance_scores(embedding, k)]
+    
+    def similarity_search(self, query, k=4, **kwargs):
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+    
+    def _select_relevance_score_fn(self):
+        return lambda distance: 1 - distance
+    
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, collection_name="langchain",
+                   persist_directory=".", **kwargs):
+        store = cls(collection_name, embedding, persist_directory)
+        store.add_texts(texts, metadatas, ids)
+        return store
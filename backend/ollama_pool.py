@@ -0,0 +1,324 @@
+import math
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+import httpx
+from pydantic import PrivateAttr
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import BaseLLM
+from ollama import ResponseError
+from langchain_ollama import OllamaLLM, OllamaEmbeddings
+from config import (OLLAMA_BACKENDS, OLLAMA_TIMEOUT, OLLAMA_CONNECT_TIMEOUT, OLLAMA_GENERATION_TIMEOUT,
+                    OLLAMA_RETRIES, OLLAMA_HEALTH_INTERVAL, OLLAMA_KEEP_ALIVE)
+
+CLIENT_FIELDS = {"base_url", "client_kwargs", "async_client_kwargs", "sync_client_kwargs"}
+
+# OllamaLLM's own settings (model, options, keep_alive...), without LangChain's fields and the client setup
+LLM_FIELDS = set(OllamaLLM.model_fields) - set(BaseLLM.model_fields) - CLIENT_FIELDS
+
+MIN_EMBED_PART = 8      # Smallest slice of an embedding batch worth sending to a backend of its own
+
+class NoBackendAvailable(ConnectionError):
+    """Raised when every Ollama backend is down, or busy for longer than the timeout"""
+
+def backend_failure(error):
+    """Whether an error means the backend is broken (unreachable, dropped connection, 5xx)
+    
+    A read timeout is a generation slower than the generation timeout and a
+    4xx is a bad request (unknown model, invalid options): the backend is
+    fine, and running the same call on another one wouldn't help.
+    """
+    if isinstance(error, ResponseError):
+        return not 400 <= error.status_code < 500
+    if isinstance(error, httpx.TimeoutException):
+        return isinstance(error, httpx.ConnectTimeout)
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500
+    return isinstance(error, (ConnectionError, httpx.TransportError))
+
+class Backend:
+    """One Ollama endpoint and its load"""
+    
+    def __init__(self, url, max_concurrency=1):
+        self.url = url.rstrip("/")
+        self.max_concurrency = max_concurrency
+        self.outstanding = 0
+        self.healthy = True
+        self.checked = 0.0      # time of the last failure or health check
+        self.requests = 0
+        self.errors = 0
+        self.busy_seconds = 0.0
+        self.last_error = None
+
+class BackendPool:
+    """Ollama endpoints shared by the LLM and embedding clients
+    
+    Each call goes to the healthy backend with the fewest requests in
+    flight, waiting up to timeout while all of them are at max_concurrency.
+    A call that fails because its backend is broken (see backend_failure)
+    marks it down and is retried on another one, up to retries times; read
+    timeouts and 4xx responses are raised as they are. Down backends are
+    skipped until health_interval has passed, then probed (GET /api/tags)
+    before they get traffic again.
+    """
+    
+    def __init__(self, backends, timeout=OLLAMA_TIMEOUT, connect_timeout=OLLAMA_CONNECT_TIMEOUT,
+                 generation_timeout=OLLAMA_GENERATION_TIMEOUT, retries=OLLAMA_RETRIES,
+                 health_interval=OLLAMA_HEALTH_INTERVAL):
+        self.backends = [Backend(b["url"], b.get("max_concurrency", 1)) for b in backends]
+        self.timeout = timeout
+        self.connect_timeout = connect_timeout
+        self.generation_timeout = generation_timeout
+        self.retries = retries
+        self.health_interval = health_interval
+        self.lock = threading.Condition()
+    
+    def capacity(self):
+        """Calls the healthy backends can take at once"""
+        with self.lock:
+            return sum(b.max_concurrency for b in self.backends if b.healthy) or 1
+    
+    def check(self, backend):
+        """Probe a backend, marking it up or down"""
+        try:
+            httpx.get(f"{backend.url}/api/tags", timeout=self.connect_timeout).raise_for_status()
+            healthy, error = True, None
+        except Exception as e:
+            healthy, error = False, str(e)
+        
+        with self.lock:
+            if healthy and not backend.healthy:
+                print(f"Ollama backend {backend.url} is back up")
+            backend.healthy = healthy
+            backend.checked = time.time()
+            if error:
+                backend.last_error = error
+            self.lock.notify_all()
+        return healthy
+    
+    def check_all(self):
+        """Probe every backend, returns how many are up"""
+        return sum(self.check(backend) for backend in self.backends)
+    
+    def acquire(self, exclude=()):
+        """Reserve a slot on the least busy healthy backend"""
+        deadline = time.monotonic() + self.timeout
+        
+        while True:
+            with self.lock:
+                candidates = [b for b in self.backends if b.url not in exclude]
+                due = [b for b in candidates if not b.healthy and time.time() - b.checked >= self.health_interval]
+                if not due:
+                    up = [b for b in candidates if b.healthy]
+                    if not up:
+                        raise NoBackendAvailable("No Ollama backend is available")
+                    
+                    free = [b for b in up if b.outstanding < b.max_concurrency]
+                    if free:
+                        backend = min(free, key=lambda b: (b.outstanding, b.requests))
+                        backend.outstanding += 1
+                        backend.requests += 1
+                        return backend
+                    
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise NoBackendAvailable(f"All Ollama backends busy for {self.timeout}s")
+                    self.lock.wait(remaining)
+                    continue
+            
+            # Probe outside the lock, other calls keep using the healthy backends meanwhile
+            for backend in due:
+                self.check(backend)
+    
+    def release(self, backend, seconds, error=None):
+        """Free a slot, marking the backend down if the call failed because of it"""
+        with self.lock:
+            backend.outstanding -= 1
+            backend.busy_seconds += seconds
+            if error is not None:
+                backend.errors += 1
+                backend.last_error = str(error)
+            if error is not None and backend_failure(error):
+                if backend.healthy:
+                    print(f"Ollama backend {backend.url} failed, marking it down: {error}")
+                backend.healthy = False
+                backend.checked = time.time()
+            self.lock.notify_all()
+    
+    def call(self, fn):
+        """fn(backend) on the least busy backend, failing over to the others"""
+        tried, error = set(), None
+        
+        for _ in range(self.retries + 1):
+            try:
+                backend = self.acquire(exclude=tried)
+            except NoBackendAvailable:
+                if error is not None:
+                    raise error
+                raise
+            
+            start = time.perf_counter()
+            try:
+                result = fn(backend)
+            except Exception as e:
+                self.release(backend, time.perf_counter() - start, e)
+                if not backend_failure(e):
+                    raise
+                tried.add(backend.url)
+                error = e
+                continue
+            self.release(backend, time.perf_counter() - start)
+            return result
+        
+        raise error
+    
+    def stream(self, fn):
+        """Yield from fn(backend), failing over only until the first chunk arrives"""
+        tried, error = set(), None
+        
+        for _ in range(self.retries + 1):
+            try:
+                backend = self.acquire(exclude=tried)
+            except NoBackendAvailable:
+                if error is not None:
+                    raise error
+                raise
+            
+            start = time.perf_counter()
+            started = False
+            try:
+                for chunk in fn(backend):
+                    started = True
+                    yield chunk
+            except Exception as e:
+                self.release(backend, time.perf_counter() - start, e)
+                if started or not backend_failure(e):
+                    raise
+                tried.add(backend.url)
+                error = e
+                continue
+            except BaseException:
+                # Closed by the consumer (client went away)
+                self.release(backend, time.perf_counter() - start)
+                raise
+            self.release(backend, time.perf_counter() - start)
+            return
+        
+        raise error
+    
+    def call_each(self, fn):
+        """fn(backend) once on every healthy backend, returns {url: error} for the ones that failed"""
+        with self.lock:
+            up = [b for b in self.backends if b.healthy]
+        
+        errors = {}
+        for backend in up:
+            with self.lock:
+                backend.outstanding += 1
+                backend.requests += 1
+            
+            start = time.perf_counter()
+            try:
+                fn(backend)
+            except Exception as e:
+                errors[backend.url] = str(e)
+                self.release(backend, time.perf_counter() - start, e)
+                continue
+            self.release(backend, time.perf_counter() - start)
+        return errors
+    
+    def stats(self):
+        """Load and health per backend"""
+        with self.lock:
+            return [{
+                "url": b.url,
+                "healthy": b.healthy,
+                "outstanding": b.outstanding,
+                "max_concurrency": b.max_concurrency,
+                "requests": b.requests,
+                "errors": b.errors,
+                "busy_seconds": round(b.busy_seconds, 1),
+                "last_error": b.last_error
+            } for b in self.backends]
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    """The process-wide pool for OLLAMA_BACKENDS, or None when using Ollama's default endpoint"""
+    global _pool
+    if not OLLAMA_BACKENDS:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            _pool = BackendPool(OLLAMA_BACKENDS)
+        return _pool
+
+class PooledOllamaLLM(OllamaLLM):
+    """OllamaLLM that runs each generation on a backend from the pool"""
+    
+    _pool: Any = PrivateAttr(default=None)
+    _clients: dict = PrivateAttr(default_factory=dict)
+    _clients_lock: Any = PrivateAttr(default_factory=threading.Lock)
+    
+    def client(self, backend):
+        """OllamaLLM for one backend, with the same settings as this one"""
+        # Concurrent first requests to a backend share one client (and its connection pool)
+        with self._clients_lock:
+            client = self._clients.get(backend.url)
+            if client is None:
+                timeout = httpx.Timeout(self._pool.generation_timeout, connect=self._pool.connect_timeout)
+                client = OllamaLLM(**{name: getattr(self, name) for name in LLM_FIELDS}, base_url=backend.url,
+                                   client_kwargs={"timeout": timeout})
+                self._clients[backend.url] = client
+            return client
+    
+    def _generate(self, prompts, stop=None, run_manager=None, **kwargs):
+        return self._pool.call(lambda backend: self.client(backend)._generate(prompts, stop, run_manager, **kwargs))
+    
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        return self._pool.stream(lambda backend: self.client(backend)._stream(prompt, stop, run_manager, **kwargs))
+    
+    def invoke_each(self, prompt, **kwargs):
+        """Run a prompt on every healthy backend (warm-up), returns {url: error} for failures"""
+        return self._pool.call_each(lambda backend: self.client(backend).invoke(prompt, **kwargs))
+
+class PooledEmbeddings(Embeddings):
+    """Ollama embeddings spread over the pool, large batches are split across backends in parallel"""
+    
+    def __init__(self, model, pool, keep_alive=OLLAMA_KEEP_ALIVE):
+        self.model = model
+        self.pool = pool
+        self.keep_alive = keep_alive
+        self.clients = {}
+        self.clients_lock = threading.Lock()
+        self.executor = ThreadPoolExecutor(max_workers=max(len(pool.backends) * 4, 4), thread_name_prefix="embed")
+    
+    def client(self, backend):
+        """OllamaEmbeddings for one backend"""
+        with self.clients_lock:
+            client = self.clients.get(backend.url)
+            if client is None:
+                timeout = httpx.Timeout(self.pool.timeout, connect=self.pool.connect_timeout)
+                client = OllamaEmbeddings(model=self.model, keep_alive=self.keep_alive, base_url=backend.url,
+                                          client_kwargs={"timeout": timeout})
+                self.clients[backend.url] = client
+            return client
+    
+    def _embed(self, texts):
+        return self.pool.call(lambda backend: self.client(backend).embed_documents(texts))
+    
+    def embed_documents(self, texts):
+        """Embed texts, one slice per free backend slot"""
+        parts = min(self.pool.capacity(), math.ceil(len(texts) / MIN_EMBED_PART))
+        if parts <= 1:
+            return self._embed(texts)
+        
+        size = math.ceil(len(texts) / parts)
+        slices = [texts[start:start + size] for start in range(0, len(texts), size)]
+        return [vector for part in self.executor.map(self._embed, slices) for vector in part]
+    
+    def embed_query(self, text):
+        """Embed one query"""
+        return self.pool.call(lambda backend: self.client(backend).embed_query(text))
@@ -0,0 +1,140 @@
+import numpy as np
+
+# Fewer vectors than this and PQ isn't trained (everything is searched exactly)
+PQ_MIN_TRAIN = 1024
+
+class Int8Quantizer:
+    """Per-row symmetric int8 codes: dim int8 values plus a float32 scale (~4x smaller than float32)"""
+    
+    kind = "int8"
+    trained = True
+    
+    def __init__(self, dim):
+        self.dim = dim
+        self.code_size = dim + 4
+    
+    def train(self, vectors):
+        """Nothing to learn, every row carries its own scale"""
+    
+    def encode(self, vectors):
+        """uint8 rows: int8 values followed by the row's float32 scale"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1
+        values = np.round(vectors / scales[:, None]).astype(np.int8)
+        return np.hstack([values.view(np.uint8), scales.astype(np.float32)[:, None].view(np.uint8)])
+    
+    def scores(self, queries, codes):
+        """Approximate inner products of queries with encoded rows"""
+        values = codes[:, :self.dim].view(np.int8).astype(np.float32)
+        scales = np.ascontiguousarray(codes[:, self.dim:]).view(np.float32)[:, 0]
+        return (queries @ values.T) * scales
+    
+    def state(self):
+        """Arrays to save alongside the codes"""
+        return {}
+    
+    def load_state(self, state):
+        """Restore from state()"""
+
+class ProductQuantizer:
+    """Product quantization: each sub_dim slice of a vector is replaced by one of 256 centroids
+    
+    Codes are one byte per slice (32x smaller than float32 with sub_dim 8).
+    Queries are scored with per-slice lookup tables (asymmetric distance).
+    """
+    
+    kind = "pq"
+    
+    def __init__(self, dim, sub_dim=8, centroids=256):
+        if dim % sub_dim:
+            raise ValueError(f"PQ sub-vector size {sub_dim} must divide the embedding size {dim}")
+        
+        self.dim = dim
+        self.sub_dim = sub_dim
+        self.m = dim // sub_dim
+        self.centroids = centroids
+        self.code_size = self.m
+        self.codebooks = None       # (m, centroids, sub_dim)
+        self.trained_on = 0
+    
+    @property
+    def trained(self):
+        return self.codebooks is not None
+    
+    def train(self, vectors, iterations=15, sample=20000, seed=0):
+        """k-means per sub-space on a sample of the vectors"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) < PQ_MIN_TRAIN:
+            return
+        
+        total = len(vectors)
+        rng = np.random.default_rng(seed)
+        if len(vectors) > sample:
+            vectors = vectors[rng.choice(len(vectors), sample, replace=False)]
+        
+        subspaces = vectors.reshape(len(vectors), self.m, self.sub_dim)
+        codebooks = np.empty((self.m, self.centroids, self.sub_dim), dtype=np.float32)
+        
+        for j in range(self.m):
+            points = subspaces[:, j]
+            centers = points[rng.choice(len(points), self.centroids, replace=False)].copy()
+            
+            for _ in range(iterations):
+                assignment = self._nearest(points, centers)
+                counts = np.bincount(assignment, minlength=self.centroids)
+                sums = np.zeros_like(centers)
+                np.add.at(sums, assignment, points)
+                
+                # Empty clusters restart from a random point
+                empty = counts == 0
+                centers[~empty] = sums[~empty] / counts[~empty, None]
+                centers[empty] = points[rng.choice(len(points), int(empty.sum()))]
+            
+            codebooks[j] = centers
+        
+        self.codebooks = codebooks
+        self.trained_on = total
+    
+    @staticmethod
+    def _nearest(points, centers):
+        """Index of the closest center for each point (squared L2)"""
+        distances = (points ** 2).sum(axis=1)[:, None] - 2 * points @ centers.T + (centers ** 2).sum(axis=1)[None, :]
+        return distances.argmin(axis=1)
+    
+    def encode(self, vectors):
+        """uint8 centroid index per sub-space"""
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(-1, self.m, self.sub_dim)
+        codes = np.empty((len(vectors), self.m), dtype=np.uint8)
+        for j in range(self.m):
+            codes[:, j] = self._nearest(vectors[:, j], self.codebooks[j])
+        return codes
+    
+    def scores(self, queries, codes):
+        """Approximate inner products from per-query lookup tables"""
+        # tables[q, j, c] = query q's slice j . centroid c of sub-space j
+        tables = np.einsum('qjd,jcd->qjc', queries.reshape(len(queries), self.m, self.sub_dim), self.codebooks)
+        slices = np.arange(self.m)
+        return np.stack([table[slices, codes].sum(axis=1) for table in tables])
+    
+    def state(self):
+        """Arrays to save alongside the codes"""
+        return {'codebooks': self.codebooks, 'trained_on': self.trained_on}
+    
+    def load_state(self, state):
+        """Restore from state()"""
+        self.codebooks = state['codebooks']
+        self.trained_on = int(state['trained_on'])
+
+QUANTIZERS = {
+    "int8": Int8Quantizer,
+    "pq": ProductQuantizer
+}
+
+def create_quantizer(kind, dim, pq_sub_dim=8):
+    """Quantizer for VECTOR_QUANTIZATION"""
+    if kind not in QUANTIZERS:
+        raise ValueError(f"Unknown vector quantization: {kind}")
+    if kind == "pq":
+        return ProductQuantizer(dim, sub_dim=pq_sub_dim)
+    return Int8Quantizer(dim)
@@ -0,0 +1,78 @@
+import os
+import threading
+import numpy as np
+from config import RERANKER_MODEL, RERANKER_ONNX_FILE, RERANK_BATCH_SIZE, RERANK_MAX_LENGTH
+
+class CrossEncoderReranker:
+    """Re-scores (question, chunk) pairs with a small ONNX cross-encoder on the CPU
+    
+    The model is a Hugging Face repo id (downloaded once into the HF cache) or a
+    local directory holding tokenizer.json and the ONNX file. It loads on first
+    use, or ahead of time with load().
+    """
+    
+    def __init__(self, model=RERANKER_MODEL, onnx_file=RERANKER_ONNX_FILE,
+                 batch_size=RERANK_BATCH_SIZE, max_length=RERANK_MAX_LENGTH):
+        self.model = model
+        self.onnx_file = onnx_file
+        self.batch_size = batch_size
+        self.max_length = max_length
+        self.lock = threading.Lock()
+        self.tokenizer = None
+        self.session = None
+    
+    def _path(self, filename):
+        """Local path of a model file, downloading it if model is a repo id"""
+        if os.path.isdir(self.model):
+            return os.path.join(self.model, filename)
+        
+        from huggingface_hub import hf_hub_download
+        return hf_hub_download(self.model, filename)
+    
+    def load(self):
+        """Load the tokenizer and ONNX session (no-op once loaded)"""
+        with self.lock:
+            if self.session is not None:
+                return self
+            
+            import onnxruntime
+            from tokenizers import Tokenizer
+            
+            tokenizer = Tokenizer.from_file(self._path("tokenizer.json"))
+            tokenizer.enable_truncation(max_length=self.max_length)
+            tokenizer.enable_padding()
+            
+            options = onnxruntime.SessionOptions()
+            options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+            session = onnxruntime.InferenceSession(self._path(self.onnx_file), options,
+                                                   providers=["CPUExecutionProvider"])
+            
+            self.tokenizer, self.session = tokenizer, session
+        return self
+    
+    def score(self, query, texts):
+        """Relevance logit for each text (higher = more relevant)"""
+        self.load()
+        input_names = {i.name for i in self.session.get_inputs()}
+        scores = []
+        
+        for start in range(0, len(texts), self.batch_size):
+            encodings = self.tokenizer.encode_batch([(query, text) for text in texts[start:start + self.batch_size]])
+            inputs = {
+                "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+                "attention_mask": np.array([e.attention_mask for e in encodings], dtype=np.int64),
+                "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64)
+            }
+            logits = self.session.run(None, {name: value for name, value in inputs.items() if name in input_names})[0]
+            scores.extend(logits.reshape(len(encodings), -1)[:, 0].tolist())
+        
+        return scores
+    
+    def rerank(self, query, docs, top_n):
+        """The top_n docs by cross-encoder score, best first"""
+        if not docs:
+            return docs
+        
+        scores = self.score(query, [doc.page_content for doc in docs])
+        order = sorted(range(len(docs)), key=lambda i: scores[i], reverse=True)
+        return [docs[i] for i in order[:top_n]]
@@ -1,68 +1,504 @@
-from flask import Flask, request, jsonify
+import os
+import sys
+import json
+import time
+import signal
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, Response, request, jsonify, stream_with_context
 from flask_cors import CORS
-from sim_search import run_similarity_search, setup_similarity_qa_chain, SIMILARITY_THRESHOLD
-from database import load_vectorstore, check_database
+from sim_search import (setup_similarity_qa_chain, retrieve_documents, retrieve_documents_batch,
+                        generate_answer, stream_answer, warm_up_llm, SIMILARITY_THRESHOLD)
+from database import load_vectorstore, check_database, describe_database, get_collection_version
 from db_setup import setup_database
+from answer_cache import AnswerCache
+from tenants import TenantRegistry, UnknownTenant, InvalidTenant
+from generation_cache import GenerationCache
+from admission import AdmissionGate, QueueFull
+from context_packing import packing_stats
+from metadata_index import parse_filters
+from ollama_pool import get_pool
+from dedup_index import chunk_references
+from metrics import start_timings, record_stage, render_metrics, REQUESTS
+from config import (ANSWER_CACHE, ANSWER_CACHE_SIZE, ANSWER_CACHE_TTL, ANSWER_CACHE_SEMANTIC_DISTANCE,
+                    SERVER_HOST, SERVER_PORT, SERVER_THREADS, RESPONSE_TIMINGS, WARMUP_ON_START,
+                    RERANKER, LLM_MAX_CONCURRENCY, LLM_QUEUE_SIZE, LLM_QUEUE_TIMEOUT,
+                    BATCH_MAX_QUESTIONS, BATCH_LLM_CONCURRENCY)
 
 
 app = Flask(__name__)
 CORS(app)
 
-# Initialize on startup
-vectorstore = load_vectorstore()
-qa_chain = setup_similarity_qa_chain(vectorstore, SIMILARITY_THRESHOLD)
+answer_cache = AnswerCache(
+    max_entries=ANSWER_CACHE_SIZE,
+    ttl=ANSWER_CACHE_TTL,
+    semantic_distance=ANSWER_CACHE_SEMANTIC_DISTANCE,
+    version_fn=get_collection_version
+) if ANSWER_CACHE else None
+
+# Tenant collections open on first use, the default collection stays in vectorstore/qa_chain
+tenant_registry = TenantRegistry()
+
+llm_gate = AdmissionGate(
+    max_concurrent=LLM_MAX_CONCURRENCY,
+    max_queued=LLM_QUEUE_SIZE,
+    queue_timeout=LLM_QUEUE_TIMEOUT
+)
+
+# The vectorstore and chain are swapped together under state_lock; requests take
+# a snapshot with current_state() so a reload never changes them mid-request
+vectorstore = None
+qa_chain = None
+state_lock = threading.Lock()
+init_lock = threading.Lock()
+state_loaded = False
+warmup_thread = None
+
+# Readiness of each startup stage, reported by /api/health
+WARMUP_STAGES = ("vectorstore", "embedding_model", "vector_index", "reranker", "llm")
+readiness = {stage: {"status": "pending"} for stage in WARMUP_STAGES if stage != "reranker" or RERANKER}
+readiness_lock = threading.Lock()
+
+# /api/status answer, recomputed only when the store or collection version changes
+status_cache = {"key": None, "value": None}
+
+def set_stage(stage, status, **info):
+    """Record the status of a startup stage"""
+    with readiness_lock:
+        readiness[stage] = {"status": status, **info}
+
+def run_stage(stage, fn):
+    """Run a startup stage, recording loading/ready/failed and how long it took"""
+    set_stage(stage, "loading")
+    start_time = time.time()
+    try:
+        result = fn()
+    except Exception as e:
+        set_stage(stage, "failed", error=str(e))
+        raise
+    set_stage(stage, "ready", seconds=round(time.time() - start_time, 3))
+    return result
+
+def open_system():
+    """Load the vectorstore and build the QA chain"""
+    store = load_vectorstore()
+    return store, setup_similarity_qa_chain(store, SIMILARITY_THRESHOLD)
+
+def current_state():
+    """Return (vectorstore, qa_chain), loading them on first use
+    
+    While the background warm-up is still opening the store this returns
+    (None, None) right away, so requests get a 503 instead of blocking.
+    """
+    global vectorstore, qa_chain, state_loaded
+    
+    with state_lock:
+        if not state_loaded and warmup_thread is None:
+            state_loaded = True
+            try:
+                vectorstore, qa_chain = run_stage("vectorstore", open_system)
+            except Exception as e:
+                print(f"System not ready: {e}")
+        return vectorstore, qa_chain
+
+def warm_up():
+    """Open the store, then get Ollama to load both models and Chroma its index"""
+    global vectorstore, qa_chain, state_loaded
+    
+    try:
+        store = chain = None
+        try:
+            store, chain = run_stage("vectorstore", open_system)
+        finally:
+            with state_lock:
+                vectorstore, qa_chain, state_loaded = store, chain, True
+        
+        embedding = run_stage("embedding_model", lambda: store.embeddings.embed_query("warm up"))
+        run_stage("vector_index", lambda: store.similarity_search_by_vector_with_relevance_scores(embedding, k=1))
+        if chain.retriever.reranker is not None:
+            run_stage("reranker", chain.retriever.reranker.load)
+        run_stage("llm", lambda: warm_up_llm(chain))
+        print("Warm-up complete")
+    except Exception as e:
+        print(f"Warm-up stopped: {e}")
+
+def start_warmup():
+    """Run warm_up() in a background thread (once)"""
+    global warmup_thread
+    
+    with state_lock:
+        if warmup_thread is None and not state_loaded:
+            warmup_thread = threading.Thread(target=warm_up, name="warm-up", daemon=True)
+            warmup_thread.start()
 
 def initialize_system():
     """Initialize the RAG system"""
+    global qa_chain, vectorstore, state_loaded
+    
+    # One initialization at a time, searches keep using the old chain meanwhile
+    with init_lock:
+        try:
+            # Check if database exists
+            exists, status = check_database()
+            
+            if not exists:
+                if not setup_database():
+                    return False, "Database setup failed"
+            
+            # Load vectorstore and setup QA chain
+            new_vectorstore = load_vectorstore()
+            new_chain = setup_similarity_qa_chain(new_vectorstore, SIMILARITY_THRESHOLD)
+            
+            with state_lock:
+                vectorstore, qa_chain, state_loaded = new_vectorstore, new_chain, True
+            set_stage("vectorstore", "ready")
+            
+            return True, "System initialized successfully"
+        
+        except Exception as e:
+            return False, f"Initialization failed: {str(e)}"
+
+def shutdown_system():
+    """Drop the loaded chain and vectorstore"""
     global qa_chain, vectorstore
     
+    with state_lock:
+        vectorstore, qa_chain = None, None
+
+def format_sources(docs):
+    """Format source documents as 'file (p.N)' strings, one per file a deduplicated chunk came from"""
+    return [f"{source_file} (p.{'?' if page is None else page})"
+            for doc in docs for source_file, page in chunk_references(doc.metadata)]
+
+def cache_lookup(cache, store, question, filters=None):
+    """Check an answer cache, returns (entry, query embedding)"""
+    # Cached answers were built from the whole collection
+    if cache is None or filters:
+        return None, None
+    
+    # Only embed the query when near-duplicate matching is turned on
+    embedding = None
+    if cache.semantic_distance is not None:
+        embedding = store.embeddings.embed_query(question)
+    
+    return cache.lookup(question, embedding), embedding
+
+def sse_event(event, data):
+    """Format a Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+def wants_timings():
+    """Whether the response should carry the stage breakdown"""
+    return bool(request.json.get('timings', RESPONSE_TIMINGS))
+
+def request_state():
+    """(vectorstore, qa_chain, answer cache) for the request's "tenant" (default collection if none)"""
+    tenant = request.json.get('tenant')
+    if tenant is None:
+        store, chain = current_state()
+        return store, chain, answer_cache
+    
     try:
-        # Check if database exists
-        exists, status = check_database()
-        
-        if not exists:
-            if not setup_database():
-                return False, "Database setup failed"
-        
-        # Load vectorstore and setup QA chain
-        vectorstore = load_vectorstore()
-        qa_chain = setup_similarity_qa_chain(vectorstore, SIMILARITY_THRESHOLD)
-        
-        return True, "System initialized successfully"
-        
-    except Exception as e:
-        return False, f"Initialization failed: {str(e)}"
+        return tenant_registry.get(tenant)
+    except ValueError as e:
+        # Tenant is configured but its database hasn't been built
+        print(f"Tenant {tenant} not ready: {e}")
+        return None, None, None
+
+def read_filters(chain):
+    """Metadata filters from the request body, raises ValueError"""
+    filters = parse_filters(request.json.get('filters'))
+    if filters and chain.retriever.metadata_index is None:
+        raise ValueError("Filtered search needs the metadata index, run db_setup.py to build it")
+    return filters
+
+def generation_cache_stats(chain):
+    """Generation cache stats for a chain's LLM, None if it has no cache"""
+    llm = chain.combine_documents_chain.llm_chain.llm if chain is not None else None
+    return llm.cache.stats() if isinstance(getattr(llm, 'cache', None), GenerationCache) else None
+
+def llm_slot(docs):
+    """Hold an LLM slot for answering, none when there are no docs (the LLM is skipped)"""
+    return llm_gate.admit() if docs else nullcontext()
+
+def not_ready():
+    """Response for requests that arrive before the system is initialized"""
+    if readiness["vectorstore"]["status"] == "loading":
+        response = jsonify({"error": "System is starting up"})
+        response.headers["Retry-After"] = "5"
+        return response, 503
+    return jsonify({"error": "System not initialized"}), 503
+
+def database_status(store):
+    """(exists, status) from the open store, cached until the collection changes"""
+    if store is None:
+        if readiness["vectorstore"]["status"] == "loading":
+            return False, "Loading"
+        return check_database()
+    
+    key = (id(store), get_collection_version())
+    if status_cache["key"] != key:
+        status_cache["value"] = describe_database(store)
+        status_cache["key"] = key
+    return status_cache["value"]
+
+@app.errorhandler(QueueFull)
+def queue_full(e):
+    """Tell clients to back off when the LLM queue is full"""
+    response = jsonify({"error": str(e), "retry_after": e.retry_after})
+    response.status_code = 429
+    response.headers["Retry-After"] = str(e.retry_after)
+    return response
+
+@app.errorhandler(UnknownTenant)
+def unknown_tenant(e):
+    """Requests for a tenant that isn't configured"""
+    return jsonify({"error": str(e)}), 404
+
+@app.errorhandler(InvalidTenant)
+def invalid_tenant(e):
+    """Requests whose tenant isn't a string"""
+    return jsonify({"error": str(e)}), 400
 
 # Search
 @app.route('/api/search', methods=['POST'])
 def search():
     question = request.json['question']
-    result = qa_chain.invoke({"query": question})
-    return jsonify({
-        "answer": result["result"],
-        "sources": [f"{doc.metadata.get('source_file')} (p.{doc.metadata.get('page', '?')})" 
-                   for doc in result["source_documents"]]
-    })
+    store, chain, cache = request_state()
+    if chain is None:
+        return not_ready()
+    
+    try:
+        filters = read_filters(chain)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    REQUESTS.inc(endpoint="search")
+    timings = start_timings()
+    start_time = time.time()
+    
+    cached, embedding = cache_lookup(cache, store, question, filters)
+    if cached:
+        response = {"answer": cached["answer"], "sources": cached["sources"], "cached": True}
+    else:
+        # Retrieval runs concurrently, only the LLM call waits for a slot
+        docs = retrieve_documents(chain, question, filters)
+        
+        queued = time.perf_counter()
+        with llm_slot(docs):
+            record_stage("llm_queue", time.perf_counter() - queued)
+            answer = generate_answer(chain, docs, question)
+        sources = format_sources(docs)
+        
+        if cache is not None and not filters:
+            cache.store(question, answer, sources, time.time() - start_time, embedding)
+        response = {"answer": answer, "sources": sources}
+    
+    record_stage("total", time.time() - start_time)
+    if wants_timings():
+        response["timings"] = timings
+    
+    return jsonify(response)
+
+# Streaming search (Server-Sent Events)
+@app.route('/api/search/stream', methods=['POST'])
+def search_stream():
+    """Send sources as soon as retrieval is done, then stream answer tokens"""
+    question = request.json['question']
+    store, chain, cache = request_state()
+    if chain is None:
+        return not_ready()
+    
+    try:
+        filters = read_filters(chain)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    REQUESTS.inc(endpoint="search_stream")
+    timings = start_timings()
+    send_timings = wants_timings()
+    cached, embedding = cache_lookup(cache, store, question, filters)
+    
+    def replay():
+        yield sse_event("sources", {"sources": cached["sources"]})
+        yield sse_event("token", {"token": cached["answer"]})
+        yield sse_event("done", {"cached": True})
+    
+    if cached:
+        return Response(replay(), mimetype='text/event-stream', headers={"Cache-Control": "no-cache"})
+    
+    start_time = time.time()
+    docs = retrieve_documents(chain, question, filters)
+    sources = format_sources(docs)
+    
+    # Take the LLM slot before responding so a full queue is still a 429
+    # (no slot without docs, the no-context answer skips the LLM)
+    started = None
+    if docs:
+        queued = time.perf_counter()
+        started = llm_gate.acquire()
+        record_stage("llm_queue", time.perf_counter() - queued)
+    
+    def generate():
+        tokens = []
+        events = stream_answer(chain, docs, question)
+        
+        # The WSGI server closes this generator when the client disconnects,
+        # and the finally block passes that on to the LLM stream
+        try:
+            yield sse_event("sources", {"sources": sources})
+            for token in events:
+                tokens.append(token)
+                yield sse_event("token", {"token": token})
+            
+            record_stage("total", time.time() - start_time)
+            yield sse_event("done", {"timings": timings} if send_timings else {})
+            
+            if cache is not None and not filters:
+                cache.store(question, "".join(tokens), sources, time.time() - start_time, embedding)
+        except Exception as e:
+            yield sse_event("error", {"error": str(e)})
+        finally:
+            events.close()
+    
+    response = Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    
+    # Runs when the response is closed, even if the generator never started
+    if docs:
+        response.call_on_close(lambda: llm_gate.release(started))
+    return response
+
+# Batch search (newline-delimited JSON)
+@app.route('/api/search/batch', methods=['POST'])
+def search_batch():
+    """Answer many questions, one NDJSON line per question in completion order
+    
+    All questions are embedded in one call and looked up in one vector query,
+    then the LLM calls run BATCH_LLM_CONCURRENCY at a time. Send
+    "retrieval_only": true to get just the sources, "filters" to search
+    only matching chunks and "tenant" to search a tenant's collection
+    (same for every question).
+    """
+    questions = request.json.get('questions')
+    retrieval_only = bool(request.json.get('retrieval_only', False))
+    
+    if not isinstance(questions, list) or not questions:
+        return jsonify({"error": "questions must be a non-empty list"}), 400
+    if len(questions) > BATCH_MAX_QUESTIONS:
+        return jsonify({"error": f"At most {BATCH_MAX_QUESTIONS} questions per batch"}), 400
+    for index, question in enumerate(questions):
+        if not isinstance(question, str) or not question.strip():
+            return jsonify({"error": f"questions[{index}] must be a non-empty string"}), 400
+    
+    store, chain, cache = request_state()
+    if chain is None:
+        return not_ready()
+    
+    try:
+        filters = read_filters(chain)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    
+    # Filtered answers don't share the cache with whole-collection answers
+    if filters:
+        cache = None
+    
+    REQUESTS.inc(endpoint="search_batch")
+    start_time = time.time()
+    doc_lists = retrieve_documents_batch(chain, questions, filters)
+    record_stage("batch_retrieval", time.time() - start_time)
+    
+    def answer(index):
+        question, docs = questions[index], doc_lists[index]
+        result = {"index": index, "question": question, "sources": format_sources(docs)}
+        
+        cached = cache.lookup(question) if cache is not None else None
+        if cached:
+            result.update(answer=cached["answer"], cached=True)
+            return result
+        
+        # Batch items share the LLM slots with interactive requests, a full
+        # queue fails only this item
+        try:
+            with llm_slot(docs):
+                generation_start = time.time()
+                result["answer"] = generate_answer(chain, docs, question)
+                latency = time.time() - generation_start
+        except QueueFull as e:
+            result.update(error=str(e), retry_after=e.retry_after)
+            return result
+        except Exception as e:
+            result["error"] = str(e)
+            return result
+        
+        # Only this item's generation, not the whole batch's retrieval or its wait for a slot
+        if cache is not None:
+            cache.store(question, result["answer"], result["sources"], latency)
+        return result
+    
+    def generate():
+        if retrieval_only:
+            for index, docs in enumerate(doc_lists):
+                yield json.dumps({"index": index, "question": questions[index], "sources": format_sources(docs)}) + "\n"
+            return
+        
+        pool = ThreadPoolExecutor(max_workers=BATCH_LLM_CONCURRENCY)
+        futures = [pool.submit(answer, index) for index in range(len(questions))]
+        try:
+            for future in as_completed(futures):
+                yield json.dumps(future.result()) + "\n"
+            record_stage("batch_total", time.time() - start_time)
+        finally:
+            # Client went away: drop the questions that haven't started
+            for future in futures:
+                future.cancel()
+            pool.shutdown(wait=False)
+    
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson',
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# Metrics (Prometheus text format)
+@app.route('/api/metrics', methods=['GET'])
+def metrics():
+    """Per-stage latency histograms and pipeline counters"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
 
 # Health
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
+    with readiness_lock:
+        stages = {stage: dict(info) for stage, info in readiness.items()}
+    
     return jsonify({
         "status": "healthy",
-        "system_ready": qa_chain is not None
+        "system_ready": qa_chain is not None,
+        "ready": all(info["status"] == "ready" for info in stages.values()),
+        "stages": stages,
+        "llm_queue": llm_gate.stats()
     })
 
 # Status
 @app.route('/api/status', methods=['GET'])
 def get_status():
     """Get system status"""
-    exists, status = check_database()
+    store, chain = current_state()
+    exists, status = database_status(store)
     return jsonify({
         "database_exists": exists,
         "database_status": status,
-        "system_ready": qa_chain is not None
-    }) 
+        "system_ready": chain is not None,
+        "answer_cache": answer_cache.stats() if answer_cache is not None else None,
+        "generation_cache": generation_cache_stats(chain),
+        "tenants": tenant_registry.stats(),
+        "context_packing": packing_stats.summary(),
+        "ollama_backends": get_pool().stats() if get_pool() is not None else None
+    })
 
 # Initialize
 @app.route('/api/initialize', methods=['POST'])
@@ -79,6 +515,37 @@ def initialize():
         return jsonify({
             "success": False,
             "error": message
-        }), 500  
+        }), 500
 
-app.run(debug=True, port=5000)
\ No newline at end of file
+def run_production():
+    """Serve with waitress: a pool of request threads behind an async socket loop"""
+    from waitress import serve
+    
+    # Turn SIGTERM into the same clean exit as Ctrl+C
+    def handle_sigterm(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, handle_sigterm)
+    
+    if WARMUP_ON_START:
+        start_warmup()
+    else:
+        current_state()
+    print(f"Serving on http://{SERVER_HOST}:{SERVER_PORT} ({SERVER_THREADS} threads)")
+    
+    try:
+        serve(app, host=SERVER_HOST, port=SERVER_PORT, threads=SERVER_THREADS)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutdown_system()
+        print("Server stopped")
+
+if __name__ == "__main__":
+    if "--production" in sys.argv:
+        run_production()
+    else:
+        # The system loads in the reloader's child process (or on the first request),
+        # never in the parent that only watches files
+        if WARMUP_ON_START and os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+            start_warmup()
+        app.run(debug=True, host=SERVER_HOST, port=SERVER_PORT, threaded=True)
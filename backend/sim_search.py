@@ -3,28 +3,82 @@ import numpy as np
 from langchain_ollama import OllamaLLM
 from langchain.chains import RetrievalQA
 from langchain.prompts import PromptTemplate
+from langchain_core.prompts import format_document
 from langchain_core.retrievers import BaseRetriever
 from langchain_core.documents import Document
 from langchain_core.callbacks import CallbackManagerForRetrieverRun
 from typing import List
-from database import load_vectorstore, check_database
+from database import (load_vectorstore, check_database, embed_queries, batch_similarity_search,
+                      filtered_similarity_search)
+from keyword_index import KeywordIndex, reciprocal_rank_fusion, identifiers
+from metadata_index import MetadataIndex, filters_to_where
+from context_packing import pack_documents, context_budget, count_tokens, DOCUMENT_PROMPT, DOCUMENT_SEPARATOR
+from reranker import CrossEncoderReranker
+from ollama_pool import get_pool, PooledOllamaLLM
+from generation_cache import GenerationCache, llm_settings, replay_tokens, deterministic
+from metrics import (timed, llm_metrics_handler, CHUNKS_RETRIEVED, RETRIEVAL_FALLBACKS, NO_CONTEXT_ANSWERS,
+                     RERANK_CANDIDATE_TOKENS, RERANK_KEPT_TOKENS)
 from user_retrieval import run_interactive
-from config import MODEL_NAME, SIMILARITY_THRESHOLD, MAX_CHUNKS, LLM_CONFIG, PROMPT_TEMPLATE
+from config import (MODEL_NAME, OLLAMA_KEEP_ALIVE, SIMILARITY_THRESHOLD, MAX_CHUNKS, LLM_CONFIG, PROMPT_TEMPLATE,
+                    RETRIEVAL_MODE, HYBRID_FETCH_K, RRF_K, CONTEXT_PACKING,
+                    RERANKER, RERANK_FETCH_K, RERANK_TOP_N, GENERATION_CACHE, DB_DIR,
+                    ADAPTIVE_RETRIEVAL, ADAPTIVE_RELATIVE_CUTOFF, ADAPTIVE_MAX_GAP, RELEVANCE_FLOOR,
+                    NO_CONTEXT_ANSWER)
 
 def create_llm():
     """Create LLM with configuration from config.py"""
+    pool = get_pool()
+    if pool is not None:
+        llm = PooledOllamaLLM(model=MODEL_NAME, keep_alive=OLLAMA_KEEP_ALIVE, **LLM_CONFIG)
+        llm._pool = pool
+        return llm
+    
     llm = OllamaLLM(
         model=MODEL_NAME,
+        keep_alive=OLLAMA_KEEP_ALIVE,
         **LLM_CONFIG  # Unpack the config dictionary
     )
     return llm
 
+def adaptive_k(similarities, max_k, relative_cutoff=ADAPTIVE_RELATIVE_CUTOFF, max_gap=ADAPTIVE_MAX_GAP):
+    """How many of the (best first) similarities to keep
+    
+    Stops at max_k, at the first chunk scoring below relative_cutoff times the
+    best, or at the first drop bigger than max_gap from the chunk before it.
+    """
+    if not similarities:
+        return 0
+    
+    best = similarities[0]
+    k = 1
+    while k < min(len(similarities), max_k):
+        if similarities[k] < best * relative_cutoff or similarities[k - 1] - similarities[k] > max_gap:
+            break
+        k += 1
+    return k
+
 class SimilarityRetriever(BaseRetriever):
     """Similarity threshold-based retriever"""
     
     vectorstore: object
     threshold: float = SIMILARITY_THRESHOLD
     max_chunks: int = MAX_CHUNKS
+    mode: str = RETRIEVAL_MODE
+    keyword_index: object = None
+    fetch_k: int = HYBRID_FETCH_K
+    rrf_k: int = RRF_K
+    pack_context: bool = CONTEXT_PACKING
+    llm_config: dict = LLM_CONFIG
+    document_prompt: object = DOCUMENT_PROMPT       # The stuff chain's, so packing counts how it formats chunks
+    document_separator: str = DOCUMENT_SEPARATOR
+    reranker: object = None
+    metadata_index: object = None
+    rerank_fetch_k: int = RERANK_FETCH_K
+    rerank_top_n: int = RERANK_TOP_N
+    adaptive: bool = ADAPTIVE_RETRIEVAL
+    relevance_floor: float = RELEVANCE_FLOOR
+    relative_cutoff: float = ADAPTIVE_RELATIVE_CUTOFF
+    max_gap: float = ADAPTIVE_MAX_GAP
     
     class Config:
         arbitrary_types_allowed = True
@@ -33,15 +87,109 @@ class SimilarityRetriever(BaseRetriever):
         self, 
         query: str, 
         *, 
-        run_manager: CallbackManagerForRetrieverRun
+        run_manager: CallbackManagerForRetrieverRun,
+        filters: dict = None
     ) -> List[Document]:
-        """Get documents above similarity threshold"""
+        """Get documents above similarity threshold (only from chunks matching filters, see metadata_index.parse_filters)"""
+        
+        with timed("retrieval"):
+            if filters:
+                results, allowed = self._filtered_search_with_score(query, filters)
+            else:
+                results, allowed = self._search_with_score(query, k=self.search_k), None
+            docs = self.select_documents(query, results, allowed)
+        
+        return docs
+    
+    @property
+    def candidate_k(self):
+        """Chunks selected before re-ranking (all of them when there is no re-ranker)"""
+        return self.rerank_fetch_k if self.reranker is not None else self.max_chunks
+    
+    @property
+    def search_k(self):
+        """How many vector results to fetch per query"""
+        return max(self.fetch_k, self.candidate_k) if self.hybrid else self.candidate_k
+    
+    @property
+    def hybrid(self):
+        """Whether hybrid retrieval is active (needs a keyword index)"""
+        return self.mode == "hybrid" and self.keyword_index is not None
+    
+    def select_documents(self, query, results, allowed=None):
+        """Turn (doc, cosine distance) vector results for a query into the final documents"""
+        if self.hybrid:
+            docs = self._hybrid_search(query, results, allowed)
+        else:
+            docs = self._vector_search(results)
+        
+        if self.reranker is not None:
+            docs = self._rerank(query, docs)
+        
+        if self.pack_context:
+            with timed("context_packing"):
+                docs, packing = pack_documents(docs, context_budget(query, self.llm_config),
+                                               self.document_prompt, self.document_separator)
+            # Debugging
+            #print(f"Context: {packing['tokens_used']}/{packing['budget']} tokens ({packing['tokens_saved']} saved)")
         
-        # Get more chunks with similarity scores
-        results = self.vectorstore.similarity_search_with_score(
-            query, 
-            k=self.max_chunks
-        )
+        CHUNKS_RETRIEVED.inc(len(docs))
+        return docs
+    
+    def _rerank(self, query, docs):
+        """Keep the rerank_top_n candidates the cross-encoder scores highest"""
+        with timed("rerank"):
+            kept = self.reranker.rerank(query, docs, self.rerank_top_n)
+        
+        RERANK_CANDIDATE_TOKENS.inc(sum(count_tokens(doc.page_content) for doc in docs))
+        RERANK_KEPT_TOKENS.inc(sum(count_tokens(doc.page_content) for doc in kept))
+        return kept
+    
+    def _search_with_score(self, query, k):
+        """(doc, cosine distance) pairs, with query embedding and vector search timed separately"""
+        embedding = self.vectorstore.embeddings.embed_query(query)
+        
+        with timed("vector_search"):
+            return self.vectorstore.similarity_search_by_vector_with_relevance_scores(embedding, k=k)
+    
+    def _filtered_search_with_score(self, query, filters):
+        """Narrow to the chunks matching filters with the metadata index, then vector search only those"""
+        if self.metadata_index is None:
+            raise ValueError("Filtered search needs the metadata index, run db_setup.py to build it")
+        
+        with timed("metadata_filter"):
+            self.metadata_index.refresh()
+            ids = self.metadata_index.candidates(filters)
+        
+        if not ids:
+            return [], set()
+        
+        embedding = self.vectorstore.embeddings.embed_query(query)
+        with timed("vector_search"):
+            results = filtered_similarity_search(self.vectorstore, embedding, self.search_k, ids,
+                                                 filters_to_where(filters))
+        return results, set(ids)
+    
+    def _relevant_vector_ids(self, results):
+        """Ids of the vector results that count as relevant (adaptive cutoff or fixed threshold)"""
+        similarities = [1 - score for _, score in results]
+        
+        if not self.adaptive:
+            return {doc.id for (doc, _), similarity in zip(results, similarities) if similarity >= self.threshold}
+        
+        if not similarities or similarities[0] < self.relevance_floor:
+            return set()
+        k = adaptive_k(similarities, self.candidate_k, self.relative_cutoff, self.max_gap)
+        return {doc.id for doc, _ in results[:k]}
+    
+    def _vector_search(self, results):
+        """Top candidate_k by vector similarity, filtered by threshold"""
+        results = results[:self.candidate_k]
+        
+        # Adaptive: k follows the score distribution, nothing above the floor means no context
+        if self.adaptive:
+            relevant = self._relevant_vector_ids(results)
+            return [doc for doc, _ in results if doc.id in relevant]
         
         # Filter by threshold (Chroma returns cosine distance: lower = more similar)
         filtered_docs = []
@@ -56,15 +204,86 @@ class SimilarityRetriever(BaseRetriever):
         # If no docs meet threshold, return the best 2-3 to avoid empty results
         if not filtered_docs and results:
             filtered_docs = [doc for doc, _ in results[:3]]
+            RETRIEVAL_FALLBACKS.inc()
         
         # Debugging
         #print(f"Found {len(filtered_docs)} relevant chunks (threshold: {self.threshold})")
         
         return filtered_docs
+    
+    def _hybrid_search(self, query, results, allowed=None):
+        """Fuse BM25 keyword ranks with vector ranks (reciprocal rank fusion)"""
+        with timed("keyword_search"):
+            self.keyword_index.refresh()
+            keyword_hits = self.keyword_index.search(query, k=self.fetch_k, allowed=allowed)
+        
+        # Adaptive: only keyword matches scoring close to the best one (BM25 scores have no fixed scale, so no gap rule)
+        if self.adaptive:
+            keyword_hits = keyword_hits[:adaptive_k([score for _, score in keyword_hits], self.fetch_k,
+                                                    self.relative_cutoff, max_gap=float("inf"))]
+        keyword_ids = [chunk_id for chunk_id, _ in keyword_hits]
+        
+        # Chroma returns cosine distance, convert to similarity
+        vector_hits = {doc.id: (doc, 1 - score) for doc, score in results}
+        fused = reciprocal_rank_fusion([list(vector_hits), keyword_ids], k=self.rrf_k)
+        
+        # Chunks containing an identifier from the query (part number, version, code name) are
+        # kept even when the embedding misses them; every other match has to pass the
+        # similarity threshold (or adaptive cutoff), common words alone don't bypass it
+        keyword_set = set(keyword_ids) & self.keyword_index.containing(identifiers(query))
+        relevant = self._relevant_vector_ids(results)
+        
+        # Adaptive: a best match below the relevance floor means no context, unless a chunk has the identifier
+        if self.adaptive and not relevant and not keyword_set:
+            return []
+        selected = [chunk_id for chunk_id in fused
+                    if chunk_id in keyword_set or chunk_id in relevant][:self.candidate_k]
+        
+        # Keyword-only hits weren't returned by the vector search, fetch their text
+        docs_by_id = {chunk_id: doc for chunk_id, (doc, _) in vector_hits.items()}
+        missing = [chunk_id for chunk_id in selected if chunk_id not in docs_by_id]
+        if missing:
+            fetched = self.vectorstore.get(ids=missing, include=['documents', 'metadatas'])
+            for chunk_id, text, metadata in zip(fetched['ids'], fetched['documents'], fetched['metadatas']):
+                docs_by_id[chunk_id] = Document(page_content=text, metadata=metadata or {}, id=chunk_id)
+        
+        filtered_docs = [docs_by_id[chunk_id] for chunk_id in selected if chunk_id in docs_by_id]
+        
+        if not filtered_docs and results and not self.adaptive:
+            filtered_docs = [doc for doc, _ in results[:3]]
+            RETRIEVAL_FALLBACKS.inc()
+        
+        return filtered_docs
+
+def load_keyword_index(db_dir=DB_DIR):
+    """Keyword index for hybrid retrieval, None if it hasn't been built yet"""
+    keyword_index = KeywordIndex(db_dir)
+    if not keyword_index.exists():
+        print("Keyword index not found, using vector-only retrieval. Run db_setup.py to build it.")
+        return None
+    return keyword_index.load()
 
-def setup_similarity_qa_chain(vectorstore, threshold=SIMILARITY_THRESHOLD):
-    """Setup QA chain with similarity threshold-based retrieval"""
-    llm = create_llm()
+def load_metadata_index(db_dir=DB_DIR):
+    """Metadata index for filtered search, None if it hasn't been built yet"""
+    metadata_index = MetadataIndex(db_dir)
+    if not metadata_index.exists():
+        print("Metadata index not found, filtered search is unavailable. Run db_setup.py to build it.")
+        return None
+    return metadata_index.load()
+
+def setup_similarity_qa_chain(vectorstore, threshold=SIMILARITY_THRESHOLD, llm=None, db_dir=DB_DIR):
+    """Setup QA chain with similarity threshold-based retrieval (indexes are read from db_dir)"""
+    llm = llm or create_llm()
+    if llm_metrics_handler not in (llm.callbacks or []):
+        llm.callbacks = (llm.callbacks or []) + [llm_metrics_handler]
+    
+    # Shared by the CLI and the server (cache=False on the LLM turns it off). Sampled
+    # answers aren't cached, a repeated prompt would get the first sample forever
+    if GENERATION_CACHE and llm.cache is None:
+        if deterministic(llm):
+            llm.cache = GenerationCache(llm_settings(llm))
+        else:
+            print("Generation cache off: LLM_CONFIG samples (temperature > 0 without a seed)")
     
     prompt_template = PROMPT_TEMPLATE.format(threshold=threshold)
     
@@ -77,7 +296,11 @@ def setup_similarity_qa_chain(vectorstore, threshold=SIMILARITY_THRESHOLD):
     retriever = SimilarityRetriever(
         vectorstore=vectorstore, 
         threshold=threshold, 
-        max_chunks=MAX_CHUNKS
+        max_chunks=MAX_CHUNKS,
+        mode=RETRIEVAL_MODE,
+        keyword_index=load_keyword_index(db_dir) if RETRIEVAL_MODE == "hybrid" else None,
+        reranker=CrossEncoderReranker() if RERANKER else None,
+        metadata_index=load_metadata_index(db_dir)
     )
     
     qa_chain = RetrievalQA.from_chain_type(
@@ -87,9 +310,109 @@ def setup_similarity_qa_chain(vectorstore, threshold=SIMILARITY_THRESHOLD):
         chain_type_kwargs={"prompt": prompt},
         return_source_documents=True
     )
+    retriever.document_prompt = qa_chain.combine_documents_chain.document_prompt
+    retriever.document_separator = qa_chain.combine_documents_chain.document_separator
     
     return qa_chain
 
+def build_prompt(qa_chain, docs, question):
+    """Render the stuff-chain prompt for the given documents"""
+    combine_chain = qa_chain.combine_documents_chain
+    
+    context = combine_chain.document_separator.join(
+        format_document(doc, combine_chain.document_prompt) for doc in docs
+    )
+    
+    return combine_chain.llm_chain.prompt.format(context=context, question=question)
+
+def retrieve_documents(qa_chain, question, filters=None):
+    """Run only the retrieval step of the chain"""
+    if filters:
+        return qa_chain.retriever.invoke(question, filters=filters)
+    return qa_chain.retriever.invoke(question)
+
+def retrieve_documents_batch(qa_chain, questions, filters=None):
+    """Retrieval for many questions with one embedding call and one vector lookup"""
+    retriever = qa_chain.retriever
+    
+    # Filtered searches each have their own candidate set
+    if filters:
+        return [retrieve_documents(qa_chain, question, filters) for question in questions]
+    
+    with timed("retrieval"):
+        embeddings = embed_queries(retriever.vectorstore, questions)
+        
+        with timed("vector_search"):
+            results = batch_similarity_search(retriever.vectorstore, embeddings, k=retriever.search_k)
+        
+        return [retriever.select_documents(question, question_results)
+                for question, question_results in zip(questions, results)]
+
+def no_context_answer(docs):
+    """NO_CONTEXT_ANSWER when retrieval found nothing relevant (the LLM is skipped), else None"""
+    if docs:
+        return None
+    NO_CONTEXT_ANSWERS.inc()
+    return NO_CONTEXT_ANSWER
+
+def generate_answer(qa_chain, docs, question):
+    """Run only the LLM step of the chain for already retrieved documents"""
+    answer = no_context_answer(docs)
+    if answer is not None:
+        return answer
+    
+    llm = qa_chain.combine_documents_chain.llm_chain.llm
+    return llm.invoke(build_prompt(qa_chain, docs, question))
+
+def stream_answer(qa_chain, docs, question):
+    """Yield answer tokens as the LLM generates them (replayed from the generation cache if it has the prompt)"""
+    answer = no_context_answer(docs)
+    if answer is not None:
+        yield answer
+        return
+    
+    llm = qa_chain.combine_documents_chain.llm_chain.llm
+    prompt = build_prompt(qa_chain, docs, question)
+    cache = llm.cache if isinstance(llm.cache, GenerationCache) else None
+    
+    cached = cache.get(prompt) if cache is not None else None
+    if cached is not None:
+        yield from replay_tokens(cached)
+        return
+    
+    tokens = llm.stream(prompt)
+    answer = []
+    
+    # Closing this generator (client went away) closes the Ollama stream,
+    # which stops generation instead of letting it run to num_predict
+    try:
+        for token in tokens:
+            answer.append(token)
+            yield token
+        
+        # Only complete answers are cached
+        if cache is not None:
+            cache.put(prompt, "".join(answer))
+    finally:
+        tokens.close()
+
+def warm_up_llm(qa_chain):
+    """Have Ollama load the LLM with a one-token generation"""
+    # Bypass the generation cache, the point is to reach Ollama
+    llm = qa_chain.combine_documents_chain.llm_chain.llm.model_copy(update={"cache": False})
+    
+    # Same load-time options as real queries, otherwise Ollama reloads the model for them
+    options = {name: getattr(llm, name, None) for name in ("num_ctx", "num_gpu", "num_thread")}
+    if isinstance(llm, PooledOllamaLLM):
+        # Every backend loads its own copy of the model
+        failed = llm.invoke_each("Hello", options={**options, "num_predict": 1})
+        if len(failed) == len(llm._pool.backends):
+            raise ConnectionError(f"No Ollama backend could load {llm.model}: {failed}")
+        for url, error in failed.items():
+            print(f"Warm-up failed on {url}: {error}")
+        return
+    llm.invoke("Hello", options={**options, "num_predict": 1})
+
 def run_similarity_search(threshold=SIMILARITY_THRESHOLD):
     """Run the similarity-based RAG system"""
     try:
@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import struct
+import hashlib
+import argparse
+import numpy as np
+import zstandard
+from database import (create_vectorstore, collection_count, add_embedded_chunks, bump_collection_version,
+                      get_collection_version)
+from manifest import load_manifest, save_manifest
+from numpy_store import NumpyVectorStore
+from keyword_index import KeywordIndex
+from metadata_index import MetadataIndex
+from dedup_index import DedupIndex
+from tenants import tenant_settings
+from config import (DB_DIR, COLLECTION_NAME, EMBEDDING_MODEL, TENANTS, DEDUP_CHUNKS, SNAPSHOT_PAGE_SIZE,
+                    SNAPSHOT_COMPRESSION_LEVEL)
+
+MAGIC = b"RAGSNAP1"
+TRAILER = struct.Struct("<Q32s8s")  # footer length, footer SHA-256, magic
+SECTIONS = ("ids", "vectors", "texts", "metadata")
+
+def shuffle_bytes(vectors):
+    """Group the float32 bytes by position (all first bytes, then all second...), compresses far better"""
+    return np.ascontiguousarray(vectors.astype('<f4').view(np.uint8).reshape(-1, 4).T).tobytes()
+
+def unshuffle_bytes(data, dim):
+    """Inverse of shuffle_bytes"""
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(4, -1)
+    return np.ascontiguousarray(planes.T).view('<f4').reshape(-1, dim)
+
+def metadata_columns(metadatas):
+    """Row metadata as {key: [value per row]}, rows without the key get None"""
+    keys = sorted({key for metadata in metadatas for key in (metadata or {})})
+    return {key: [(metadata or {}).get(key) for metadata in metadatas] for key in keys}
+
+def metadata_rows(columns, rows):
+    """Inverse of metadata_columns (Chroma metadata can't hold None, so missing keys stay missing)"""
+    return [{key: values[i] for key, values in columns.items() if values[i] is not None} for i in range(rows)]
+
+def export_snapshot(vectorstore, path, db_dir=DB_DIR, embedding_model=EMBEDDING_MODEL,
+                    page_size=SNAPSHOT_PAGE_SIZE, level=SNAPSHOT_COMPRESSION_LEVEL):
+    """Stream a collection into a snapshot file, one page of chunks at a time
+    
+    Layout: MAGIC, then per page a zstd frame for each of ids, vectors
+    (float32, byte-shuffled), texts and columnar metadata, then a JSON
+    footer with every frame's offset, length and SHA-256, and the trailer
+    (footer length and SHA-256). Returns the footer.
+    """
+    start = time.perf_counter()
+    compressor = zstandard.ZstdCompressor(level=level, write_checksum=True)
+    footer = {
+        "format": 1,
+        "embedding_model": embedding_model,
+        "collection_version": get_collection_version(db_dir),
+        "created": time.time(),
+        "dim": None,
+        "count": 0,
+        "raw_bytes": 0,
+        "pages": [],
+        "manifest": load_manifest(db_dir) or {}
+    }
+    
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        
+        offset = 0
+        while True:
+            page = vectorstore.get(include=['documents', 'metadatas', 'embeddings'], limit=page_size, offset=offset)
+            if not len(page['ids']):
+                break
+            
+            vectors = np.asarray(page['embeddings'], dtype=np.float32)
+            footer["dim"] = vectors.shape[1]
+            raw = {
+                "ids": json.dumps(page['ids']).encode('utf-8'),
+                "vectors": shuffle_bytes(vectors),
+                "texts": json.dumps(page['documents']).encode('utf-8'),
+                "metadata": json.dumps(metadata_columns(page['metadatas'])).encode('utf-8')
+            }
+            
+            entry = {"rows": len(page['ids'])}
+            for name in SECTIONS:
+                data = compressor.compress(raw[name])
+                entry[name] = [f.tell(), len(data), hashlib.sha256(data).hexdigest()]
+                f.write(data)
+                footer["raw_bytes"] += len(raw[name])
+            
+            footer["pages"].append(entry)
+            footer["count"] += entry["rows"]
+            offset += entry["rows"]
+        
+        data = json.dumps(footer).encode('utf-8')
+        f.write(data)
+        f.write(TRAILER.pack(len(data), hashlib.sha256(data).digest(), MAGIC))
+    os.replace(tmp_path, path)
+    
+    size = os.path.getsize(path)
+    print(f"Exported {footer['count']} chunks in {len(footer['pages'])} blocks to {path}: "
+          f"{size / (1024 * 1024):.1f} MB ({footer['raw_bytes'] / max(size, 1):.1f}x compressed) "
+          f"in {time.perf_counter() - start:.1f}s")
+    return footer
+
+class SnapshotReader:
+    """Reads a snapshot file page by page, checking each frame's checksum"""
+    
+    def __init__(self, path):
+        self.path = path
+        self.decompressor = zstandard.ZstdDecompressor()
+        
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"{path} is not a snapshot")
+            f.seek(-TRAILER.size, os.SEEK_END)
+            length, digest, magic = TRAILER.unpack(f.read(TRAILER.size))
+            if magic != MAGIC or length > os.path.getsize(path) - len(MAGIC) - TRAILER.size:
+                raise ValueError(f"{path} is truncated (no footer)")
+            f.seek(-TRAILER.size - length, os.SEEK_END)
+            data = f.read(length)
+            if hashlib.sha256(data).digest() != digest:
+                raise ValueError(f"Checksum mismatch in the footer of {path}")
+            self.footer = json.loads(data)
+    
+    def _section(self, f, entry, name):
+        """Read, verify and decompress one frame"""
+        offset, length, digest = entry[name]
+        f.seek(offset)
+        data = f.read(length)
+        if len(data) != length or hashlib.sha256(data).hexdigest() != digest:
+            raise ValueError(f"Checksum mismatch in {name} at offset {offset} of {self.path}")
+        return self.decompressor.decompress(data)
+    
+    def pages(self):
+        """Yield (ids, vectors, texts, metadatas) per page"""
+        dim = self.footer["dim"]
+        with open(self.path, 'rb') as f:
+            for entry in self.footer["pages"]:
+                ids = json.loads(self._section(f, entry, "ids"))
+                vectors = unshuffle_bytes(self._section(f, entry, "vectors"), dim)
+                texts = json.loads(self._section(f, entry, "texts"))
+                metadatas = metadata_rows(json.loads(self._section(f, entry, "metadata")), entry["rows"])
+                yield ids, vectors, texts, metadatas
+    
+    def verify(self):
+        """Check every frame, returns the number of chunks"""
+        count = 0
+        for ids, vectors, texts, metadatas in self.pages():
+            if not (len(ids) == len(vectors) == len(texts) == len(metadatas)):
+                raise ValueError(f"Block with mismatched columns in {self.path}")
+            count += len(ids)
+        if count != self.footer["count"]:
+            raise ValueError(f"{self.path} holds {count} chunks, its footer says {self.footer['count']}")
+        return count
+
+def import_snapshot(path, db_dir=DB_DIR, collection_name=COLLECTION_NAME, embedding_model=EMBEDDING_MODEL):
+    """Load a snapshot into an empty collection with bulk inserts, no embedding calls
+    
+    With VECTOR_BACKEND = "numpy" the vector blocks are appended straight to
+    the memory-mapped vector file. The keyword, metadata and dedup indexes
+    are built from the imported chunks and the manifest is copied, so a node
+    with the same documents can be kept up to date with db_setup.py. Every
+    block is verified before anything is written, so a corrupt snapshot
+    raises ValueError and leaves no partial collection behind.
+    """
+    start = time.perf_counter()
+    reader = SnapshotReader(path)
+    if reader.footer["embedding_model"] != embedding_model:
+        raise ValueError(f"Snapshot was embedded with {reader.footer['embedding_model']}, "
+                         f"this collection uses {embedding_model}")
+    reader.verify()
+    
+    os.makedirs(db_dir, exist_ok=True)
+    vectorstore = create_vectorstore(db_dir, collection_name, embedding_model)
+    if collection_count(vectorstore) > 0:
+        raise ValueError(f"Collection {collection_name} in {db_dir} is not empty, import into a new database")
+    
+    indexes = [KeywordIndex(db_dir), MetadataIndex(db_dir)]
+    if DEDUP_CHUNKS:
+        indexes.append(DedupIndex(db_dir))
+    
+    imported = 0
+    for ids, vectors, texts, metadatas in reader.pages():
+        add_embedded_chunks(vectorstore, ids, vectors, texts, metadatas)
+        for index in indexes:
+            index.add(ids, texts, metadatas)
+        imported += len(ids)
+        print(f"Imported {imported}/{reader.footer['count']} chunks")
+    
+    if isinstance(vectorstore, NumpyVectorStore) and vectorstore.quantization:
+        vectorstore.build_codes()
+    
+    save_manifest(reader.footer["manifest"], db_dir)
+    for index in indexes:
+        index.save()
+    bump_collection_version(db_dir)
+    
+    print(f"Imported {imported} chunks from {path} in {time.perf_counter() - start:.1f}s")
+    return imported
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a collection to a snapshot file, or load one on another node")
+    parser.add_argument("command", choices=["export", "import", "verify"])
+    parser.add_argument("path", help="Snapshot file")
+    parser.add_argument("--tenant", choices=sorted(TENANTS), help="Use a tenant's collection instead of the main one")
+    args = parser.parse_args()
+    
+    settings = tenant_settings(args.tenant) if args.tenant else {}
+    db_dir = settings.get("db_dir", DB_DIR)
+    collection_name = settings.get("collection_name", COLLECTION_NAME)
+    embedding_model = settings.get("embedding_model", EMBEDDING_MODEL)
+    
+    if args.command == "export":
+        store = create_vectorstore(db_dir, collection_name, embedding_model)
+        export_snapshot(store, args.path, db_dir, embedding_model)
+    elif args.command == "import":
+        import_snapshot(args.path, db_dir, collection_name, embedding_model)
+    else:
+        print(f"{args.path}: {SnapshotReader(args.path).verify()} chunks, all checksums match")
@@ -0,0 +1,164 @@
+import os
+import gc
+import time
+import threading
+from collections import OrderedDict
+import psutil
+from database import create_embedder, load_vectorstore, get_collection_version
+from answer_cache import AnswerCache
+from config import (DOCS_DIR, DB_DIR, COLLECTION_NAME, EMBEDDING_MODEL, CHUNK_SIZE, OVERLAP, TENANTS, MAX_OPEN_TENANTS,
+                    TENANT_MEMORY_LIMIT_MB, SIMILARITY_THRESHOLD, ANSWER_CACHE, ANSWER_CACHE_SIZE,
+                    ANSWER_CACHE_TTL, ANSWER_CACHE_SEMANTIC_DISTANCE)
+
+class UnknownTenant(LookupError):
+    """Raised for a tenant that isn't in TENANTS"""
+
+class InvalidTenant(TypeError):
+    """Raised for a tenant value that isn't a name (number, list, object...)"""
+
+def tenant_settings(tenant):
+    """setup_database/load_vectorstore settings for a tenant"""
+    if not isinstance(tenant, str):
+        raise InvalidTenant(f"tenant must be a string, got {type(tenant).__name__}")
+    if tenant not in TENANTS:
+        raise UnknownTenant(f"Unknown tenant: {tenant}")
+    
+    settings = {
+        "docs_dir": os.path.join(DOCS_DIR, tenant),
+        "db_dir": os.path.join(DB_DIR, "tenants", tenant),
+        "collection_name": COLLECTION_NAME,
+        "embedding_model": EMBEDDING_MODEL,
+        "chunk_size": CHUNK_SIZE,
+        "overlap": OVERLAP
+    }
+    settings.update(TENANTS[tenant] or {})
+    return settings
+
+def process_memory_mb():
+    """Resident memory of this process in MB"""
+    return psutil.Process().memory_info().rss / (1024 * 1024)
+
+class TenantRegistry:
+    """Open vectorstore, QA chain and answer cache per tenant
+    
+    A tenant's collection opens on its first request and stays open for the
+    next ones. Tenants using the same embedding model share one embedding
+    client, and all of them share the LLM. When more than max_open are open,
+    or the process is over memory_limit_mb, the least recently used tenants
+    are closed (requests already holding them finish normally).
+    """
+    
+    def __init__(self, max_open=MAX_OPEN_TENANTS, memory_limit_mb=TENANT_MEMORY_LIMIT_MB, llm=None):
+        self.max_open = max_open
+        self.memory_limit_mb = memory_limit_mb
+        self.llm = llm
+        self.lock = threading.Lock()
+        self.open = OrderedDict()   # tenant -> {"vectorstore", "qa_chain", "answer_cache", "opened", "requests"}
+        self.opening = {}           # tenant -> lock held while it's being opened
+        self.embedders = {}         # embedding model -> shared embedding client
+        self.evictions = 0
+    
+    def embedder(self, embedding_model):
+        """Shared embedding client for a model"""
+        with self.lock:
+            if embedding_model not in self.embedders:
+                self.embedders[embedding_model] = create_embedder(embedding_model)
+            return self.embedders[embedding_model]
+    
+    def get(self, tenant):
+        """(vectorstore, qa_chain, answer_cache) for a tenant, opening it if needed"""
+        settings = tenant_settings(tenant)
+        
+        with self.lock:
+            entry = self._use(tenant)
+            if entry is not None:
+                return entry["vectorstore"], entry["qa_chain"], entry["answer_cache"]
+            opening = self.opening.setdefault(tenant, threading.Lock())
+        
+        # Opening one tenant doesn't hold up requests for the others
+        with opening:
+            with self.lock:
+                entry = self._use(tenant)
+            if entry is None:
+                entry = self._open(settings)
+                with self.lock:
+                    self.open[tenant] = entry
+                    entry["requests"] += 1
+                print(f"Opened tenant {tenant}")
+        
+        self.evict(keep=tenant)
+        return entry["vectorstore"], entry["qa_chain"], entry["answer_cache"]
+    
+    def _use(self, tenant):
+        """Mark an open tenant as most recently used (call with the lock held)"""
+        entry = self.open.get(tenant)
+        if entry is not None:
+            self.open.move_to_end(tenant)
+            entry["requests"] += 1
+        return entry
+    
+    def _open(self, settings):
+        """Load a tenant's collection and build its chain"""
+        # Imported here so db_setup.py (and its parse workers) don't load the chain modules
+        from sim_search import setup_similarity_qa_chain, create_llm
+        
+        db_dir = settings["db_dir"]
+        store = load_vectorstore(db_dir, settings["collection_name"], settings["embedding_model"],
+                                 self.embedder(settings["embedding_model"]))
+        
+        with self.lock:
+            if self.llm is None:
+                self.llm = create_llm()
+        
+        chain = setup_similarity_qa_chain(store, SIMILARITY_THRESHOLD, llm=self.llm, db_dir=db_dir)
+        cache = AnswerCache(
+            max_entries=ANSWER_CACHE_SIZE,
+            ttl=ANSWER_CACHE_TTL,
+            semantic_distance=ANSWER_CACHE_SEMANTIC_DISTANCE,
+            version_fn=lambda: get_collection_version(db_dir)
+        ) if ANSWER_CACHE else None
+        
+        return {"vectorstore": store, "qa_chain": chain, "answer_cache": cache, "opened": time.time(), "requests": 0}
+    
+    def over_memory(self):
+        """Whether the process is above memory_limit_mb"""
+        return self.memory_limit_mb is not None and process_memory_mb() > self.memory_limit_mb
+    
+    def evict(self, keep=None):
+        """Close least recently used tenants until under max_open and the memory limit"""
+        evicted = []
+        
+        while True:
+            with self.lock:
+                idle = [tenant for tenant in self.open if tenant != keep]
+                if not idle or (len(self.open) <= self.max_open and not self.over_memory()):
+                    break
+                self.open.pop(idle[0])
+                self.evictions += 1
+            evicted.append(idle[0])
+            
+            # Release the tenant's store before checking memory again
+            gc.collect()
+        
+        if evicted:
+            print(f"Closed tenants: {', '.join(evicted)}")
+        return evicted
+    
+    def close(self, tenant):
+        """Close one tenant (it reopens on its next request)"""
+        with self.lock:
+            closed = self.open.pop(tenant, None) is not None
+        gc.collect()
+        return closed
+    
+    def stats(self):
+        """Open tenants, most recently used last"""
+        with self.lock:
+            return {
+                "configured": sorted(TENANTS),
+                "open": [{"tenant": tenant, "requests": entry["requests"],
+                          "open_seconds": round(time.time() - entry["opened"], 1)}
+                         for tenant, entry in self.open.items()],
+                "evictions": self.evictions,
+                "memory_mb": round(process_memory_mb(), 1)
+            }
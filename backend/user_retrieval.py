@@ -1,15 +1,19 @@
 import time
+from dedup_index import chunk_references
 
 def ask_question(qa_chain, question):
     """Ask a question and get answer"""
     start_time = time.time()
     
+    # Imported here, sim_search imports this module
+    from sim_search import retrieve_documents, generate_answer
+    
     try:
-        result = qa_chain.invoke({"query": question})
+        # Same steps as qa_chain.invoke, but a question with no relevant chunks skips the LLM
+        sources = retrieve_documents(qa_chain, question)
+        answer = generate_answer(qa_chain, sources, question)
         
         query_time = time.time() - start_time
-        answer = result["result"]
-        sources = result["source_documents"]
         
         #print(f"\nAnswer: {answer}")
         print(f"\n{answer}")
@@ -25,6 +29,10 @@ def ask_question(qa_chain, question):
                     print(f"  {i}. {source_file} (p.{page}) [{file_type.upper()}]")
                 else:
                     print(f"  {i}. {source_file} (p.{page})")
+                
+                # Near-duplicate chunks from other files were stored once
+                for other_file, other_page in chunk_references(doc.metadata)[1:]:
+                    print(f"     also {other_file} (p.{other_page})")
         
         return answer, sources
         
@@ -0,0 +1,426 @@
+"""Offline benchmark: ingestion, retrieval and end-to-end /api/search on a synthetic corpus
+
+Uses the deterministic FakeEmbeddings/FakeLLM from fake_ollama.py instead of
+Ollama, so runs are reproducible and comparable across commits:
+
+    python extra/benchmark.py --docs 200 --hnsw balanced --chunk-size 500 --output bench.json
+    python extra/benchmark.py --docs 200 --backend numpy --output bench_numpy.json
+    python extra/benchmark.py --docs 200 --backend numpy --quantization pq --dim 1024 --output bench_pq.json
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+import shutil
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "backend"))
+
+import numpy as np
+from langchain_chroma import Chroma
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from fake_ollama import FakeEmbeddings, FakeLLM
+import config
+from keyword_index import KeywordIndex
+from metadata_index import MetadataIndex, filters_to_where
+from database import filtered_similarity_search, search_within
+from sim_search import SimilarityRetriever
+from numpy_store import NumpyVectorStore
+from context_packing import packing_stats
+
+HNSW_CONFIGS = {
+    "fast": config.HNSW_FAST_CONFIG,
+    "balanced": config.HNSW_BALANCED_CONFIG
+}
+
+LLM_CONFIGS = {
+    "fast": config.LLM_FAST_CONFIG,
+    "balanced": config.LLM_BALANCED_CONFIG,
+    "heavy": config.LLM_HEAVY_CONFIG
+}
+
+def latency_summary(seconds):
+    """p50/p95/p99/mean in milliseconds"""
+    ms = np.asarray(seconds) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "mean_ms": round(float(ms.mean()), 3)
+    }
+
+SYLLABLES = ["ba", "ke", "di", "mo", "lu", "ra", "te", "si", "no", "fu", "ga", "pe", "vi", "zo", "hu", "ja", "we", "ci", "yo", "xu"]
+
+def pseudo_word(n):
+    """Letter-only made-up word for an index (digits would make it look like an identifier to the keyword index)"""
+    return "".join(SYLLABLES[n // 20 ** i % 20] for i in (2, 1, 0))
+
+FILLER = [pseudo_word(i) for i in range(2000)]
+TOPICS = [[pseudo_word(2000 + t * 40 + i) for i in range(40)] for t in range(50)]
+
+# Function words real pages and questions are full of
+COMMON_WORDS = ["the", "is", "of", "and", "to", "in", "what", "for", "with", "on", "how", "this"]
+
+# Off-topic questions use only words the corpus never has: FakeEmbeddings weighs every word the
+# same (no IDF), so a shared "what is the" would put them above the relevance floor on its own
+OFF_TOPIC_WORDS = ["weather", "holiday", "parking", "recipe", "football", "vacation", "salary", "lunch",
+                   "birthday", "traffic", "concert", "garden", "movie", "hotel", "flight", "museum", "pizza",
+                   "coffee", "tennis", "wedding", "lottery", "painting", "camping", "guitar", "fishing",
+                   "election", "bakery", "zoo", "poetry", "karaoke"]
+
+QUESTION_WORDS = 16     # Words per labeled on-topic query, enough to stay clear of the relevance floor
+
+def make_corpus(num_docs, pages_per_doc, seed=0):
+    """Synthetic page-level documents: topic words, common words, filler and part numbers"""
+    rng = random.Random(seed)
+
+    docs = []
+    for d in range(num_docs):
+        topic = TOPICS[d % len(TOPICS)]
+        for page in range(pages_per_doc):
+            words = []
+            for _ in range(300):
+                r = rng.random()
+                words.append(rng.choice(topic) if r < 0.3 else rng.choice(COMMON_WORDS) if r < 0.55 else rng.choice(FILLER))
+            words.append(f"PN-{d:04d}-{page:03d}.")
+            docs.append(Document(
+                page_content=" ".join(words),
+                metadata={'source_file': f"doc_{d:04d}.pdf", 'page': page, 'file_type': 'pdf'}
+            ))
+    return docs
+
+def make_queries(chunks, num_queries, seed=1):
+    """Queries taken as short word windows from random chunks"""
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(num_queries):
+        words = rng.choice(chunks).page_content.split()
+        start = rng.randrange(max(1, len(words) - 8))
+        queries.append(" ".join(words[start:start + 8]))
+    return queries
+
+def off_topic_question(rng):
+    """Question about something the corpus doesn't cover, no word in common with it"""
+    return " ".join(rng.sample(OFF_TOPIC_WORDS, 5))
+
+def make_labeled_queries(chunks, num_queries, off_topic=0.2, seed=4):
+    """(query, (source_file, page)) pairs, plus a share of off-topic questions labeled None"""
+    rng = random.Random(seed)
+    labeled = []
+    for i in range(num_queries):
+        if rng.random() < off_topic:
+            labeled.append((off_topic_question(rng), None))
+            continue
+        chunk = rng.choice(chunks)
+        words = chunk.page_content.split()
+        start = rng.randrange(max(1, len(words) - QUESTION_WORDS))
+        labeled.append((" ".join(words[start:start + QUESTION_WORDS]), (chunk.metadata['source_file'], chunk.metadata['page'])))
+    return labeled
+
+def bench_ingestion(docs, args, embeddings, db_dir):
+    """Split and add the corpus in BATCH_SIZE batches"""
+    start = time.perf_counter()
+    splitter = RecursiveCharacterTextSplitter(chunk_size=args.chunk_size, chunk_overlap=args.overlap)
+    chunks = splitter.split_documents(docs)
+    split_time = time.perf_counter() - start
+
+    if args.backend == "numpy":
+        vectorstore = NumpyVectorStore("benchmark", embeddings, db_dir, quantization=args.quantization,
+                                       rerank_candidates=args.rerank_candidates)
+    else:
+        vectorstore = Chroma(
+            collection_name="benchmark",
+            embedding_function=embeddings,
+            persist_directory=db_dir,
+            collection_metadata=HNSW_CONFIGS[args.hnsw]
+        )
+    keyword_index = KeywordIndex(db_dir)
+    metadata_index = MetadataIndex(db_dir)
+
+    start = time.perf_counter()
+    for i in range(0, len(chunks), config.BATCH_SIZE):
+        batch = chunks[i:i + config.BATCH_SIZE]
+        ids = [f"chunk-{j}" for j in range(i, i + len(batch))]
+        vectorstore.add_documents(batch, ids=ids)
+        keyword_index.add(ids, [c.page_content for c in batch], [c.metadata for c in batch])
+        metadata_index.add(ids, [c.page_content for c in batch], [c.metadata for c in batch])
+    if args.quantization:
+        vectorstore.build_codes()
+    add_time = time.perf_counter() - start
+
+    return vectorstore, keyword_index, metadata_index, chunks, {
+        "documents": len(docs),
+        "chunks": len(chunks),
+        "split_s": round(split_time, 3),
+        "embed_add_s": round(add_time, 3),
+        "chunks_per_s": round(len(chunks) / add_time, 1)
+    }
+
+def exact_top_k(matrix, ids, query_vectors, k):
+    """Brute-force cosine ground truth"""
+    scores = query_vectors @ matrix.T
+    top = np.argsort(-scores, axis=1)[:, :k]
+    return [[ids[i] for i in row] for row in top]
+
+def bench_retrieval(vectorstore, embeddings, queries, k):
+    """Vector search latency, QPS and recall@k against exact search"""
+    stored = vectorstore.get(include=['embeddings'])
+    matrix = np.asarray(stored['embeddings'], dtype=np.float32)
+    query_vectors = np.asarray([embeddings.embed_query(q) for q in queries], dtype=np.float32)
+    truth = exact_top_k(matrix, stored['ids'], query_vectors, k)
+
+    latencies, recalls = [], []
+    start = time.perf_counter()
+    for query, vector, expected in zip(queries, query_vectors, truth):
+        t = time.perf_counter()
+        results = vectorstore.similarity_search_by_vector_with_relevance_scores(vector.tolist(), k=k)
+        latencies.append(time.perf_counter() - t)
+        found = {doc.id for doc, _ in results}
+        recalls.append(len(found & set(expected)) / k)
+    total = time.perf_counter() - start
+
+    return {
+        "queries": len(queries),
+        "k": k,
+        "memory": vectorstore.memory_footprint() if isinstance(vectorstore, NumpyVectorStore) else None,
+        "latency": latency_summary(latencies),
+        "qps": round(len(queries) / total, 1),
+        f"recall@{k}": round(float(np.mean(recalls)), 4)
+    }
+
+FILTER_FILES = (1, 2, 4, 16)   # Files per filtered query, from one file's chunks up to a few hundred candidates
+FILTER_QUERIES = 50
+
+def bench_filtered(vectorstore, embeddings, metadata_index, queries, k):
+    """Filtered search over 1 to 16 files: exact scoring of the candidates vs a where clause
+
+    prefilter is what filtered_similarity_search does (exact up to
+    FILTER_EXACT_MAX candidates), exact and where force one path each, so
+    the candidate count where where overtakes exact is the threshold to use.
+    """
+    stored = vectorstore.get(include=['embeddings', 'metadatas'])
+    matrix = np.asarray(stored['embeddings'], dtype=np.float32)
+    files = sorted(metadata_index.files)
+    rng = random.Random(3)
+    chroma = not isinstance(vectorstore, NumpyVectorStore)
+
+    results = []
+    for num_files in FILTER_FILES:
+        if num_files > len(files):
+            break
+        latencies = {"prefilter": [], "exact": [], "where": []}
+        recalls = {"prefilter": [], "where": []}
+        candidates = []
+
+        for query in queries[:FILTER_QUERIES]:
+            filters = {"source_file": set(rng.sample(files, num_files))}
+            where = filters_to_where(filters)
+            vector = embeddings.embed_query(query)
+
+            t = time.perf_counter()
+            ids = metadata_index.candidates(filters)
+            found = {"prefilter": filtered_similarity_search(vectorstore, vector, k, ids, where)}
+            latencies["prefilter"].append(time.perf_counter() - t)
+            candidates.append(len(ids))
+
+            if chroma:
+                t = time.perf_counter()
+                search_within(vectorstore, vector, ids, k)
+                latencies["exact"].append(time.perf_counter() - t)
+
+                t = time.perf_counter()
+                found["where"] = vectorstore.similarity_search_by_vector_with_relevance_scores(vector, k=k, filter=where)
+                latencies["where"].append(time.perf_counter() - t)
+
+            rows = [i for i, m in enumerate(stored['metadatas']) if m.get('source_file') in filters["source_file"]]
+            expected = exact_top_k(matrix[rows], [stored['ids'][i] for i in rows], np.asarray([vector], dtype=np.float32), k)[0]
+            for name, docs in found.items():
+                recalls[name].append(len({doc.id for doc, _ in docs} & set(expected)) / max(1, len(expected)))
+
+        results.append({
+            "files": num_files,
+            "candidates_per_query": round(float(np.mean(candidates)), 1),
+            "prefilter_latency": latency_summary(latencies["prefilter"]),
+            "exact_latency": latency_summary(latencies["exact"]) if chroma else None,
+            "where_filter_latency": latency_summary(latencies["where"]) if chroma else None,
+            f"prefilter_recall@{k}": round(float(np.mean(recalls["prefilter"])), 4),
+            f"where_recall@{k}": round(float(np.mean(recalls["where"])), 4) if chroma else None
+        })
+    return results
+
+def bench_adaptive(vectorstore, keyword_index, labeled_queries, args):
+    """Fixed threshold vs adaptive k on labeled queries: quality, chunks sent and LLM calls skipped
+
+    adaptive_no_floor is adaptive k without the relevance floor, so comparing
+    it with adaptive shows what the floor costs answerable questions.
+    """
+    results = {}
+    for name, adaptive, floor in (("fixed", False, config.RELEVANCE_FLOOR), ("adaptive", True, config.RELEVANCE_FLOOR),
+                                  ("adaptive_no_floor", True, 0.0)):
+        retriever = SimilarityRetriever(vectorstore=vectorstore, mode=args.mode, pack_context=False,
+                                        keyword_index=keyword_index if args.mode == "hybrid" else None,
+                                        max_chunks=args.k, adaptive=adaptive, relevance_floor=floor)
+        hits, precisions, chunks_sent = [], [], []
+        skipped_off_topic = skipped_answerable = off_topic = 0
+
+        for query, label in labeled_queries:
+            docs = retriever.invoke(query)
+            if label is None:
+                off_topic += 1
+                skipped_off_topic += not docs
+                continue
+            if not docs:
+                skipped_answerable += 1
+            relevant = [(doc.metadata.get('source_file'), doc.metadata.get('page')) == label for doc in docs]
+            hits.append(any(relevant))
+            precisions.append(sum(relevant) / len(docs) if docs else 0.0)
+            chunks_sent.append(len(docs))
+
+        llm_calls = len(labeled_queries) - skipped_off_topic - skipped_answerable
+        results[name] = {
+            "hit_rate": round(float(np.mean(hits)), 4),
+            "precision": round(float(np.mean(precisions)), 4),
+            "chunks_per_answerable_query": round(float(np.mean(chunks_sent)), 2),
+            "llm_calls": llm_calls,
+            "llm_calls_saved": len(labeled_queries) - llm_calls,
+            "off_topic_skipped": f"{skipped_off_topic}/{off_topic}",
+            "answerable_skipped": skipped_answerable
+        }
+    return results
+
+def bench_end_to_end(vectorstore, keyword_index, queries, args):
+    """Concurrent /api/search load through the Flask app with a fake LLM"""
+    import server
+    from sim_search import setup_similarity_qa_chain
+
+    llm_config = LLM_CONFIGS[args.llm]
+    llm = FakeLLM(
+        cache=False,
+        prompt_token_latency=args.prompt_token_ms / 1000,
+        output_token_latency=args.output_token_ms / 1000,
+        output_tokens=min(args.output_tokens, llm_config["num_predict"])
+    )
+    chain = setup_similarity_qa_chain(vectorstore, llm=llm)
+    chain.retriever.mode = args.mode
+    chain.retriever.keyword_index = keyword_index if args.mode == "hybrid" else None
+    chain.retriever.llm_config = llm_config
+    if args.reranker:
+        from reranker import CrossEncoderReranker
+        chain.retriever.reranker = CrossEncoderReranker().load()
+    packing_before = packing_stats.summary()
+
+    # Measure the full pipeline on every request
+    server.answer_cache = None
+    server.vectorstore, server.qa_chain, server.state_loaded = vectorstore, chain, True
+
+    def request(question):
+        client = server.app.test_client()
+        t = time.perf_counter()
+        response = client.post("/api/search", json={"question": question})
+        return time.perf_counter() - t, response.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(request, queries))
+    total = time.perf_counter() - start
+
+    ok = [t for t, status in results if status == 200]
+    packing_after = packing_stats.summary()
+    packed_queries = packing_after["queries"] - packing_before["queries"]
+
+    return {
+        "requests": len(results),
+        "concurrency": args.concurrency,
+        "ok": len(ok),
+        "rejected_429": sum(1 for _, status in results if status == 429),
+        "latency": latency_summary(ok) if ok else None,
+        "throughput_rps": round(len(results) / total, 2),
+        "reranker": args.reranker,
+        "context_tokens_per_query": round((packing_after["tokens_used"] - packing_before["tokens_used"]) / packed_queries, 1)
+                                    if packed_queries else None
+    }
+
+def git_commit():
+    """Current commit, so results can be compared across commits"""
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="RAG benchmark with a local fake Ollama")
+    parser.add_argument("--docs", type=int, default=100)
+    parser.add_argument("--pages", type=int, default=5)
+    parser.add_argument("--chunk-size", type=int, default=config.CHUNK_SIZE)
+    parser.add_argument("--overlap", type=int, default=config.OVERLAP)
+    parser.add_argument("--backend", choices=["chroma", "numpy"], default=config.VECTOR_BACKEND)
+    parser.add_argument("--quantization", choices=["int8", "pq"], default=None, help="Compressed codes (numpy backend)")
+    parser.add_argument("--rerank-candidates", type=int, default=config.RERANK_CANDIDATES)
+    parser.add_argument("--hnsw", choices=HNSW_CONFIGS, default="balanced")
+    parser.add_argument("--llm", choices=LLM_CONFIGS, default="fast")
+    parser.add_argument("--mode", choices=["vector", "hybrid"], default=config.RETRIEVAL_MODE)
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=config.MAX_CHUNKS)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--reranker", action="store_true", help="Re-rank with the configured cross-encoder (downloads it)")
+    parser.add_argument("--e2e-requests", type=int, default=100)
+    parser.add_argument("--embed-ms", type=float, default=0.0, help="Simulated embedding time per text")
+    parser.add_argument("--prompt-token-ms", type=float, default=0.0, help="Simulated prompt-eval time per token")
+    parser.add_argument("--output-token-ms", type=float, default=0.0, help="Simulated generation time per token")
+    parser.add_argument("--output-tokens", type=int, default=50)
+    parser.add_argument("--skip-e2e", action="store_true")
+    parser.add_argument("--output", default="bench_results.json")
+    args = parser.parse_args()
+
+    embeddings = FakeEmbeddings(dim=args.dim, latency=args.embed_ms / 1000)
+    db_dir = tempfile.mkdtemp(prefix="rag_bench_")
+
+    try:
+        docs = make_corpus(args.docs, args.pages)
+        print(f"Ingesting {len(docs)} pages...")
+        vectorstore, keyword_index, metadata_index, chunks, ingestion = bench_ingestion(docs, args, embeddings, db_dir)
+
+        queries = make_queries(chunks, args.queries)
+        print(f"Running {len(queries)} retrieval queries...")
+        retrieval = bench_retrieval(vectorstore, embeddings, queries, args.k)
+
+        print(f"Running filtered queries over {', '.join(map(str, FILTER_FILES))} files...")
+        filtered = bench_filtered(vectorstore, embeddings, metadata_index, queries, args.k)
+
+        print(f"Running {len(queries)} labeled queries with fixed and adaptive cutoffs...")
+        adaptive = bench_adaptive(vectorstore, keyword_index, make_labeled_queries(chunks, args.queries), args)
+
+        end_to_end = None
+        if not args.skip_e2e:
+            print(f"Running {args.e2e_requests} /api/search requests...")
+            end_to_end = bench_end_to_end(vectorstore, keyword_index, make_queries(chunks, args.e2e_requests, seed=2), args)
+
+        results = {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "params": vars(args),
+            "ingestion": ingestion,
+            "retrieval": retrieval,
+            "filtered_retrieval": filtered,
+            "adaptive_retrieval": adaptive,
+            "end_to_end": end_to_end
+        }
+
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+        print(json.dumps(results, indent=2))
+        print(f"\nResults written to {args.output}")
+
+    finally:
+        shutil.rmtree(db_dir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
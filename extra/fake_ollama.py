@@ -0,0 +1,73 @@
+import time
+import hashlib
+import re
+import numpy as np
+from typing import Any, Iterator, List, Optional
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic stand-in for OllamaEmbeddings (hashed bag of words, unit length)"""
+    
+    def __init__(self, dim=384, latency=0.0):
+        self.dim = dim
+        self.latency = latency      # Simulated seconds per embedded text
+        self.calls = 0
+        self._token_vectors = {}
+    
+    def _token_vector(self, token):
+        """Fixed random vector per token, seeded from its hash"""
+        vector = self._token_vectors.get(token)
+        if vector is None:
+            seed = int(hashlib.md5(token.encode()).hexdigest()[:8], 16)
+            vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+            self._token_vectors[token] = vector
+        return vector
+    
+    def _embed(self, text):
+        """Normalized sum of token vectors"""
+        vector = np.zeros(self.dim, dtype=np.float32)
+        for token in re.findall(r"\w+", text.lower()):
+            vector += self._token_vector(token)
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+    
+    def embed_documents(self, texts):
+        """Embed texts, sleeping latency seconds per text"""
+        self.calls += 1
+        if self.latency:
+            time.sleep(self.latency * len(texts))
+        return [self._embed(text) for text in texts]
+    
+    def embed_query(self, text):
+        """Embed one query"""
+        return self.embed_documents([text])[0]
+
+class FakeLLM(LLM):
+    """Deterministic stand-in for OllamaLLM with simulated prompt-eval and generation time"""
+    
+    prompt_token_latency: float = 0.0   # Seconds per prompt token (prompt evaluation)
+    output_token_latency: float = 0.0   # Seconds per generated token
+    output_tokens: int = 50
+    temperature: Optional[float] = None # Sampling settings, only read by the generation cache's deterministic check
+    seed: Optional[int] = None
+    
+    @property
+    def _llm_type(self) -> str:
+        return "fake-ollama"
+    
+    def _tokens(self, prompt):
+        """Answer tokens derived from the prompt, so identical prompts give identical answers"""
+        digest = hashlib.sha1(prompt.encode()).hexdigest()
+        return [f"tok{digest[i % 40]}" for i in range(self.output_tokens)]
+    
+    def _call(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+    
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None,
+                **kwargs: Any) -> Iterator[GenerationChunk]:
+        time.sleep(self.prompt_token_latency * len(prompt) / 4)
+        for token in self._tokens(prompt):
+            time.sleep(self.output_token_latency)
+            yield GenerationChunk(text=token + " ")
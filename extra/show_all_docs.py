@@ -1,4 +1,6 @@
-from database import load_vectorstore
+from database import load_vectorstore, collection_count
+
+PAGE_SIZE = 1000
 
 def show_all_documents():
     """Print all documents from the vectorstore"""
@@ -6,29 +8,30 @@ def show_all_documents():
         print("Loading vectorstore...")
         vectorstore = load_vectorstore()
         
-        print("Getting all documents...")
-        all_docs = vectorstore.get(include=['documents', 'metadatas', 'embeddings'])
-        
         print("\n" + "="*50)
         print("ALL DOCUMENTS IN COLLECTION")
         print("="*50)
         
         # Print basic info
-        num_docs = len(all_docs['documents'])
+        num_docs = collection_count(vectorstore)
         print(f"Total documents: {num_docs}")
         
-        if num_docs > 0:
-            print(f"Embedding dimension: {len(all_docs['embeddings'][0])}")
-        
         print("\n" + "-"*50)
         
-        # Print each document
-        for i in range(num_docs):
-            print(f"\nDocument {i+1}:")
-            #print(f"Content: {all_docs['documents'][i]}")
-            print(f"Metadata: {all_docs['metadatas'][i]}")
-            print(f"Embedding (first 5): {all_docs['embeddings'][i]}")
-            print("-" * 30)
+        # Print each document, a page at a time so large collections don't have to fit in memory
+        offset = 0
+        while offset < num_docs:
+            page = vectorstore.get(include=['documents', 'metadatas', 'embeddings'], limit=PAGE_SIZE, offset=offset)
+            if not len(page['ids']):
+                break
+            
+            for i in range(len(page['ids'])):
+                print(f"\nDocument {offset+i+1}:")
+                #print(f"Content: {page['documents'][i]}")
+                print(f"Metadata: {page['metadatas'][i]}")
+                print(f"Embedding (first 5): {page['embeddings'][i][:5]}")
+                print("-" * 30)
+            offset += len(page['ids'])
         
     except Exception as e:
         print(f"Error: {e}")
@@ -0,0 +1,178 @@
+"""Stub Ollama server for testing OLLAMA_BACKENDS without GPUs
+
+Serves /api/tags, /api/embed and /api/generate with the deterministic
+FakeEmbeddings/FakeLLM answers from fake_ollama.py, plus simulated latency,
+a concurrency limit (503 above it) and random failures. Run a few and point
+the backend pool at them:
+
+    python extra/stub_ollama.py --port 11501 --latency 0.01 &
+    python extra/stub_ollama.py --port 11502 --latency 0.01 --fail-rate 0.2 &
+
+    OLLAMA_BACKENDS = [{"url": "http://localhost:11501", "max_concurrency": 2},
+                       {"url": "http://localhost:11502", "max_concurrency": 2}]
+
+GET /stats returns the requests each stub served, and its peak concurrency.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_ollama import FakeEmbeddings, FakeLLM
+
+class StubState:
+    """Settings and counters shared by the request handlers"""
+    
+    def __init__(self, dim, latency, token_latency, output_tokens, fail_rate, max_concurrency):
+        self.embeddings = FakeEmbeddings(dim=dim, latency=latency)
+        self.llm = FakeLLM(output_tokens=output_tokens)
+        self.token_latency = token_latency
+        self.fail_rate = fail_rate
+        self.max_concurrency = max_concurrency
+        self.lock = threading.Lock()
+        self.active = 0
+        self.peak = 0
+        self.requests = {}
+        self.rejected = 0
+        self.failed = 0
+    
+    def enter(self, path):
+        """Count a request, False if it's over the concurrency limit"""
+        with self.lock:
+            if self.max_concurrency and self.active >= self.max_concurrency:
+                self.rejected += 1
+                return False
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            self.requests[path] = self.requests.get(path, 0) + 1
+            return True
+    
+    def leave(self):
+        """End a request counted by enter"""
+        with self.lock:
+            self.active -= 1
+    
+    def stats(self):
+        """Counters for GET /stats"""
+        with self.lock:
+            return {"requests": dict(self.requests), "active": self.active, "peak": self.peak,
+                    "rejected": self.rejected, "failed": self.failed}
+
+def now():
+    """Ollama-style created_at timestamp"""
+    return datetime.now(timezone.utc).isoformat()
+
+class StubHandler(BaseHTTPRequestHandler):
+    """The subset of Ollama's API that langchain_ollama uses"""
+    
+    protocol_version = "HTTP/1.1"
+    
+    def log_message(self, format, *args):
+        """Quiet, one line per request would drown the benchmark output"""
+        pass
+    
+    def send_json(self, status, body):
+        """Send a JSON response"""
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+    
+    def do_GET(self):
+        if self.path == "/api/tags":
+            self.send_json(200, {"models": []})
+        elif self.path == "/stats":
+            self.send_json(200, self.server.state.stats())
+        else:
+            self.send_json(404, {"error": "not found"})
+    
+    def do_POST(self):
+        state = self.server.state
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        
+        if self.path not in ("/api/embed", "/api/generate"):
+            self.send_json(404, {"error": "not found"})
+            return
+        if not state.enter(self.path):
+            self.send_json(503, {"error": "server busy, maximum pending requests exceeded"})
+            return
+        
+        try:
+            if random.random() < state.fail_rate:
+                with state.lock:
+                    state.failed += 1
+                self.send_json(500, {"error": "simulated failure"})
+            elif self.path == "/api/embed":
+                texts = body.get("input", [])
+                texts = [texts] if isinstance(texts, str) else texts
+                self.send_json(200, {"model": body.get("model"), "embeddings": state.embeddings.embed_documents(texts)})
+            else:
+                self.generate(body)
+        finally:
+            state.leave()
+    
+    def generate(self, body):
+        """Stream NDJSON like Ollama, one line per token and a final done line"""
+        state = self.server.state
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        
+        def write_line(record):
+            data = (json.dumps(record) + "\n").encode('utf-8')
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+        
+        tokens = state.llm._tokens(body.get("prompt", ""))
+        num_predict = (body.get("options") or {}).get("num_predict")
+        if num_predict is not None and num_predict >= 0:
+            tokens = tokens[:num_predict]
+        
+        start = time.perf_counter_ns()
+        for token in tokens:
+            time.sleep(state.token_latency)
+            write_line({"model": body.get("model"), "created_at": now(), "response": token + " ", "done": False})
+        write_line({"model": body.get("model"), "created_at": now(), "response": "", "done": True,
+                    "done_reason": "stop", "total_duration": time.perf_counter_ns() - start,
+                    "prompt_eval_count": len(body.get("prompt", "")) // 4, "eval_count": len(tokens)})
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+def serve(port, host="127.0.0.1", dim=384, latency=0.0, token_latency=0.0, output_tokens=50, fail_rate=0.0,
+          max_concurrency=0):
+    """Start a stub server in a background thread, returns it (server.shutdown() to stop)"""
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.state = StubState(dim, latency, token_latency, output_tokens, fail_rate, max_concurrency)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stub Ollama server with fake embeddings and generations")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--dim", type=int, default=384, help="Embedding dimension")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds per embedded text")
+    parser.add_argument("--token-latency", type=float, default=0.0, help="Seconds per generated token")
+    parser.add_argument("--output-tokens", type=int, default=50)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="Fraction of requests answered with a 500")
+    parser.add_argument("--max-concurrency", type=int, default=0, help="Requests in flight before answering 503 (0 = no limit)")
+    args = parser.parse_args()
+    
+    server = serve(args.port, args.host, args.dim, args.latency, args.token_latency, args.output_tokens,
+                   args.fail_rate, args.max_concurrency)
+    print(f"Stub Ollama listening on http://{args.host}:{args.port}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,42 @@
+import os
+import sys
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "backend"))
+sys.path.insert(0, os.path.join(ROOT, "extra"))
+
+MANUAL_TEXTS = [
+    "Replace part AB-1234 when the pump leaks",
+    "Check the inlet seal of the pump every month",
+    "The warranty covers the pump for two years",
+]
+
+@pytest.fixture
+def served(tmp_path, monkeypatch):
+    """The Flask app on a small NumPy collection with FakeEmbeddings and FakeLLM, returns (test client, server module)"""
+    import server
+    from fake_ollama import FakeEmbeddings, FakeLLM
+    from numpy_store import NumpyVectorStore
+    from metadata_index import MetadataIndex
+    from answer_cache import AnswerCache
+    from admission import AdmissionGate
+    from sim_search import setup_similarity_qa_chain
+    
+    store = NumpyVectorStore("test", FakeEmbeddings(dim=64), str(tmp_path))
+    ids = [f"c{i}" for i in range(len(MANUAL_TEXTS))]
+    metadatas = [{"source_file": "manual.pdf", "page": i, "file_type": "pdf", "ingested_at": 1000 + i}
+                 for i in range(len(MANUAL_TEXTS))]
+    store.add_texts(MANUAL_TEXTS, metadatas, ids=ids)
+    metadata_index = MetadataIndex(str(tmp_path))
+    metadata_index.add(ids, MANUAL_TEXTS, metadatas)
+    metadata_index.save()
+    
+    chain = setup_similarity_qa_chain(store, threshold=0.0, llm=FakeLLM(cache=False, output_tokens=5),
+                                      db_dir=str(tmp_path))
+    monkeypatch.setattr(server, "vectorstore", store)
+    monkeypatch.setattr(server, "qa_chain", chain)
+    monkeypatch.setattr(server, "state_loaded", True)
+    monkeypatch.setattr(server, "answer_cache", AnswerCache(version_fn=lambda: "v1"))
+    monkeypatch.setattr(server, "llm_gate", AdmissionGate())
+    return server.app.test_client(), server
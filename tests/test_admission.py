@@ -0,0 +1,42 @@
+import threading
+import time
+import pytest
+from admission import AdmissionGate, QueueFull
+
+def test_queue_then_reject():
+    gate = AdmissionGate(max_concurrent=1, max_queued=1, queue_timeout=5)
+    started = gate.acquire()
+    
+    admitted = threading.Event()
+    def waiter():
+        with gate.admit():
+            admitted.set()
+    thread = threading.Thread(target=waiter)
+    thread.start()
+    while gate.stats()["waiting"] == 0:
+        time.sleep(0.01)
+    
+    # One running and one waiting: the next request is turned away
+    with pytest.raises(QueueFull) as error:
+        gate.acquire()
+    assert error.value.retry_after >= 1
+    
+    gate.release(started)
+    thread.join(timeout=5)
+    assert admitted.is_set()
+    assert gate.stats() == {"active": 0, "waiting": 0, "rejected": 1, "max_concurrent": 1, "max_queued": 1}
+
+def test_queue_timeout_rejects():
+    gate = AdmissionGate(max_concurrent=1, max_queued=1, queue_timeout=0.1)
+    gate.acquire()
+    with pytest.raises(QueueFull):
+        gate.acquire()
+    assert gate.stats()["waiting"] == 0
+
+def test_admit_releases_on_error():
+    gate = AdmissionGate(max_concurrent=1, max_queued=0)
+    with pytest.raises(RuntimeError):
+        with gate.admit():
+            raise RuntimeError("generation failed")
+    assert gate.stats()["active"] == 0
+    gate.acquire()
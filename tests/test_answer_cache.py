@@ -0,0 +1,64 @@
+import time
+import math
+from answer_cache import AnswerCache
+
+def rotated(distance):
+    """Unit vector at this cosine distance from [1, 0]"""
+    angle = math.acos(1 - distance)
+    return [math.cos(angle), math.sin(angle)]
+
+def test_exact_hit_ignores_case_and_punctuation():
+    cache = AnswerCache()
+    cache.store("How do I replace the seal?", "Like this", ["manual.pdf (p.1)"], 2.0)
+    
+    entry = cache.lookup("  how do I  replace the SEAL ")
+    assert entry["answer"] == "Like this"
+    assert cache.lookup("How do I replace the pump?") is None
+    assert cache.stats() == {"entries": 1, "exact_hits": 1, "semantic_hits": 0, "misses": 1, "hit_rate": 0.5,
+                             "latency_saved_s": 2.0}
+
+def test_entries_expire_after_ttl():
+    cache = AnswerCache(ttl=0.1)
+    cache.store("warranty", "Two years", [], 1.0)
+    assert cache.lookup("warranty") is not None
+    
+    time.sleep(0.15)
+    assert cache.lookup("warranty") is None
+    assert cache.stats()["entries"] == 0
+
+def test_semantic_hit_within_distance():
+    cache = AnswerCache(semantic_distance=0.05)
+    cache.store("how long is the warranty", "Two years", [], 1.5, embedding=[2.0, 0.0])
+    
+    assert cache.lookup("what's the warranty period", embedding=rotated(0.04))["answer"] == "Two years"
+    assert cache.lookup("how do I replace the seal", embedding=rotated(0.06)) is None
+    assert cache.stats()["semantic_hits"] == 1
+
+def test_semantic_matching_off_without_distance():
+    cache = AnswerCache()
+    cache.store("how long is the warranty", "Two years", [], 1.5, embedding=[1.0, 0.0])
+    assert cache.lookup("what's the warranty period", embedding=[1.0, 0.0]) is None
+
+def test_collection_change_drops_answers():
+    version = {"value": "v1"}
+    cache = AnswerCache(version_fn=lambda: version["value"])
+    cache.store("warranty", "Two years", [], 1.0)
+    assert cache.lookup("warranty") is not None
+    
+    # db_setup.py bumped the collection version
+    version["value"] = "v2"
+    assert cache.lookup("warranty") is None
+    assert cache.stats()["entries"] == 0
+    
+    cache.store("warranty", "Three years", [], 1.0)
+    assert cache.lookup("warranty")["answer"] == "Three years"
+
+def test_least_recently_used_is_evicted():
+    cache = AnswerCache(max_entries=2)
+    cache.store("a", "A", [], 1.0)
+    cache.store("b", "B", [], 1.0)
+    cache.lookup("a")
+    cache.store("c", "C", [], 1.0)
+    
+    assert cache.lookup("b") is None
+    assert cache.lookup("a") is not None and cache.lookup("c") is not None
@@ -0,0 +1,17 @@
+import argparse
+import config
+import benchmark
+from fake_ollama import FakeEmbeddings
+
+def test_relevance_floor_skips_only_off_topic_questions(tmp_path):
+    args = argparse.Namespace(chunk_size=config.CHUNK_SIZE, overlap=config.OVERLAP, backend="numpy",
+                              quantization=None, rerank_candidates=0, mode="vector", k=config.MAX_CHUNKS)
+    vectorstore, keyword_index, _, chunks, _ = benchmark.bench_ingestion(benchmark.make_corpus(20, 5), args,
+                                                                         FakeEmbeddings(dim=384), str(tmp_path))
+    results = benchmark.bench_adaptive(vectorstore, keyword_index, benchmark.make_labeled_queries(chunks, 60), args)
+    
+    skipped, off_topic = map(int, results["adaptive"]["off_topic_skipped"].split("/"))
+    assert off_topic and skipped > off_topic // 2
+    assert results["adaptive"]["answerable_skipped"] == 0
+    assert results["adaptive"]["hit_rate"] == results["adaptive_no_floor"]["hit_rate"]
+    assert results["adaptive_no_floor"]["llm_calls_saved"] == 0
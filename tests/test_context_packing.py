@@ -0,0 +1,50 @@
+import pytest
+from langchain_core.documents import Document
+from langchain_core.prompts import PromptTemplate, format_document
+from context_packing import pack_documents, count_tokens, DOCUMENT_SEPARATOR
+
+WORDS = ["pump", "seal", "inlet", "valve", "motor", "filter", "gasket", "impeller", "bearing", "housing"]
+
+def chunks(count, words=8):
+    """Distinct chunks from different files, so none are merged or dropped as duplicates"""
+    return [Document(page_content=" ".join(WORDS[(i + j) % len(WORDS)] + str(i) for j in range(words)),
+                     metadata={"source_file": f"doc{i}.pdf", "page": 0}) for i in range(count)]
+
+def context(docs, document_prompt=PromptTemplate.from_template("{page_content}"), separator=DOCUMENT_SEPARATOR):
+    """The context the stuff chain builds from the packed chunks"""
+    return separator.join(format_document(doc, document_prompt) for doc in docs)
+
+def test_separators_count_against_the_budget():
+    docs = chunks(3)
+    text_tokens = sum(count_tokens(doc.page_content) for doc in docs)
+    
+    packed, result = pack_documents(docs, text_tokens)
+    assert len(packed) == 2
+    assert result["chunks_dropped"] == 1
+    
+    # One token per "\n\n" between chunks
+    packed, result = pack_documents(docs, text_tokens + 2)
+    assert len(packed) == 3
+    assert result["tokens_used"] == result["tokens_retrieved"] == text_tokens + 2
+
+def test_document_prompt_counts_against_the_budget():
+    document_prompt = PromptTemplate.from_template("Source: {source_file}, page {page}\n{page_content}")
+    docs = chunks(3)
+    text_tokens = sum(count_tokens(doc.page_content) for doc in docs)
+    
+    packed, _ = pack_documents(docs, text_tokens + 2, document_prompt)
+    assert len(packed) < 3
+
+@pytest.mark.parametrize("separator", [DOCUMENT_SEPARATOR, "\n----------\n"])
+@pytest.mark.parametrize("budget", [5, 12, 40, 75, 200])
+def test_packed_context_fits_the_budget(budget, separator):
+    document_prompt = PromptTemplate.from_template("[{source_file}] {page_content}")
+    packed, result = pack_documents(chunks(10), budget, document_prompt, separator)
+    assert packed
+    assert count_tokens(context(packed, document_prompt, separator)) <= result["tokens_used"] <= budget
+
+def test_chain_formatting_reaches_the_retriever(served):
+    _, server = served
+    combine_chain = server.qa_chain.combine_documents_chain
+    assert server.qa_chain.retriever.document_prompt is combine_chain.document_prompt
+    assert server.qa_chain.retriever.document_separator == combine_chain.document_separator
@@ -0,0 +1,59 @@
+import os
+import functools
+import pytest
+import docx
+import database
+import db_setup
+from fake_ollama import FakeEmbeddings
+from dedup_index import chunk_references
+from keyword_index import KeywordIndex
+from metadata_index import MetadataIndex
+
+PARAGRAPHS = [f"Section {i}: check the {part} seal every {i + 2} months and replace the filter cartridge "
+              f"when the pressure drops below {i + 10} bar, then run the pump for five minutes before use."
+              for i, part in enumerate(["inlet", "outlet", "bypass", "drain", "relief", "intake"])]
+
+def write_docx(path, paragraphs):
+    document = docx.Document()
+    for paragraph in paragraphs:
+        document.add_paragraph(paragraph)
+    document.save(path)
+
+@pytest.fixture(params=["chroma", "numpy"])
+def setup(request, tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "VECTOR_BACKEND", request.param)
+    monkeypatch.setattr(db_setup, "create_vectorstore",
+                        functools.partial(database.create_vectorstore, embedder=FakeEmbeddings(dim=64)))
+    docs_dir, db_dir = tmp_path / "docs", tmp_path / "db"
+    os.makedirs(docs_dir)
+    
+    def run():
+        assert db_setup.setup_database(False, str(docs_dir), str(db_dir))
+        return db_setup.create_vectorstore(str(db_dir))
+    return docs_dir, db_dir, run
+
+def test_removing_the_original_promotes_the_revision(setup):
+    docs_dir, db_dir, run = setup
+    write_docx(docs_dir / "manual.docx", PARAGRAPHS)
+    stored = run().get(include=['metadatas'])
+    assert stored['ids']
+    
+    # The revision only adds a paragraph: its shared chunks are references, not new rows
+    write_docx(docs_dir / "manual_rev2.docx", PARAGRAPHS + ["Appendix: torque values for the housing bolts."])
+    vectorstore = run()
+    shared = vectorstore.get(ids=stored['ids'], include=['metadatas'])
+    assert all({f for f, _ in chunk_references(m)} == {"manual.docx", "manual_rev2.docx"} for m in shared['metadatas'])
+    
+    os.remove(docs_dir / "manual.docx")
+    vectorstore = run()
+    survivors = vectorstore.get(ids=stored['ids'], include=['metadatas'])
+    assert sorted(survivors['ids']) == sorted(stored['ids'])
+    assert all(m['source_file'] == "manual_rev2.docx" and not m.get('references') for m in survivors['metadatas'])
+    assert vectorstore.get(where={"source_file": "manual.docx"})['ids'] == []
+    
+    # The indexes follow the promotion
+    metadata_index = MetadataIndex(str(db_dir)).load()
+    assert set(stored['ids']) <= set(metadata_index.candidates({"source_file": {"manual_rev2.docx"}}))
+    assert metadata_index.candidates({"source_file": {"manual.docx"}}) == []
+    keyword_index = KeywordIndex(str(db_dir)).load()
+    assert set(stored['ids']) <= {chunk_id for chunk_id, _ in keyword_index.search("inlet seal", k=100)}
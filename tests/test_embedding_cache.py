@@ -0,0 +1,41 @@
+import os
+from embedding_cache import EmbeddingCache
+
+def test_reload(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model")
+    cache.put(["a", "b"], [[1, 2, 3], [4, 5, 6]])
+    
+    cache = EmbeddingCache(str(tmp_path), "model")
+    assert cache.get(["b", "a", "x"]) == [[4, 5, 6], [1, 2, 3], None]
+
+def test_torn_vector_append(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model")
+    cache.put(["a", "b"], [[1, 2, 3], [7, 8, 9]])
+    
+    # Crash half way through appending a vector, before its key
+    with open(cache.vectors_path, 'ab') as f:
+        f.write(b"\0" * 6)
+    
+    cache = EmbeddingCache(str(tmp_path), "model")
+    assert os.path.getsize(cache.vectors_path) == 2 * 3 * 4
+    cache.put(["c"], [[9, 9, 9]])
+    
+    cache = EmbeddingCache(str(tmp_path), "model")
+    assert cache.get(["a", "b", "c"]) == [[1, 2, 3], [7, 8, 9], [9, 9, 9]]
+
+def test_torn_key_append(tmp_path):
+    cache = EmbeddingCache(str(tmp_path), "model")
+    cache.put(["a"], [[1, 2, 3]])
+    
+    # Crash after the vector was written but half way through its key
+    with open(cache.vectors_path, 'ab') as f:
+        f.write(b"\0" * 12)
+    with open(cache.keys_path, 'a', encoding='ascii') as f:
+        f.write("half")
+    
+    cache = EmbeddingCache(str(tmp_path), "model")
+    assert cache.get(["a", "half"]) == [[1, 2, 3], None]
+    cache.put(["c"], [[9, 9, 9]])
+    
+    cache = EmbeddingCache(str(tmp_path), "model")
+    assert cache.get(["a", "c"]) == [[1, 2, 3], [9, 9, 9]]
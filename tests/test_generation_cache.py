@@ -0,0 +1,74 @@
+from typing import Any, List, Optional
+import pytest
+from pydantic import Field
+from langchain_core.documents import Document
+import sim_search
+from fake_ollama import FakeEmbeddings, FakeLLM
+from numpy_store import NumpyVectorStore
+from generation_cache import GenerationCache
+from sim_search import setup_similarity_qa_chain, generate_answer, stream_answer, warm_up_llm
+
+DOCS = [Document(page_content="Replace part AB-1234 when the pump leaks",
+                 metadata={"source_file": "manual.pdf", "page": 0})]
+
+class RecordingLLM(FakeLLM):
+    """FakeLLM that records the prompts that reached it (shared with its model_copy)"""
+    
+    prompts: List[str] = Field(default_factory=list)
+    
+    def _stream(self, prompt: str, stop: Optional[List[str]] = None, run_manager: Any = None, **kwargs: Any):
+        self.prompts.append(prompt)
+        yield from super()._stream(prompt, stop, run_manager, **kwargs)
+
+@pytest.fixture
+def make_chain(tmp_path, monkeypatch):
+    """Builds a QA chain for an LLM, with the generation cache file in tmp_path"""
+    class LocalCache(GenerationCache):
+        def __init__(self, settings):
+            super().__init__(settings, db_dir=str(tmp_path))
+    monkeypatch.setattr(sim_search, "GenerationCache", LocalCache)
+    store = NumpyVectorStore("test", FakeEmbeddings(dim=16), str(tmp_path))
+    return lambda llm: setup_similarity_qa_chain(store, threshold=0.0, llm=llm, db_dir=str(tmp_path))
+
+def chain_llm(chain):
+    return chain.combine_documents_chain.llm_chain.llm
+
+def test_sampled_llm_is_not_cached(make_chain, tmp_path):
+    chain = make_chain(RecordingLLM(temperature=0.7, output_tokens=3))
+    llm = chain_llm(chain)
+    assert llm.cache is None
+    
+    generate_answer(chain, DOCS, "pump leaks")
+    generate_answer(chain, DOCS, "pump leaks")
+    "".join(stream_answer(chain, DOCS, "pump leaks"))
+    assert len(llm.prompts) == 3
+    assert not (tmp_path / "generation_cache.sqlite3").exists()
+
+@pytest.mark.parametrize("settings", [{"temperature": 0}, {"temperature": 0.7, "seed": 42}])
+def test_deterministic_llm_is_cached(make_chain, settings):
+    chain = make_chain(RecordingLLM(output_tokens=3, **settings))
+    llm = chain_llm(chain)
+    assert isinstance(llm.cache, GenerationCache)
+    
+    answer = generate_answer(chain, DOCS, "pump leaks")
+    assert generate_answer(chain, DOCS, "pump leaks") == answer
+    assert "".join(stream_answer(chain, DOCS, "pump leaks")) == answer
+    assert len(llm.prompts) == 1
+    assert llm.cache.stats()["hits"] == 2
+
+def test_cache_false_is_kept(make_chain):
+    chain = make_chain(RecordingLLM(temperature=0, cache=False))
+    assert chain_llm(chain).cache is False
+
+def test_warm_up_bypasses_cache(make_chain):
+    chain = make_chain(RecordingLLM(temperature=0, output_tokens=1))
+    llm = chain_llm(chain)
+    llm.cache.put("Hello", "cached")
+    
+    # Both warm-ups reach the LLM, neither reads nor writes the cache
+    warm_up_llm(chain)
+    warm_up_llm(chain)
+    assert llm.prompts == ["Hello", "Hello"]
+    assert llm.cache.stats()["entries"] == 1
+    assert llm.cache.stats()["hits"] == llm.cache.stats()["misses"] == 0
+    assert llm.cache.get("Hello") == "cached"
@@ -0,0 +1,40 @@
+import pytest
+from fake_ollama import FakeEmbeddings
+from numpy_store import NumpyVectorStore
+from keyword_index import KeywordIndex
+from sim_search import SimilarityRetriever
+
+TEXTS = [
+    "Replace part AB-1234 when the pump leaks",
+    "What is the warranty period for the product",
+    "The cafeteria menu is posted on the board",
+]
+
+@pytest.fixture
+def store(tmp_path):
+    store = NumpyVectorStore("test", FakeEmbeddings(dim=64), str(tmp_path))
+    metadatas = [{"source_file": f"doc{i}.pdf", "page": 1} for i in range(len(TEXTS))]
+    ids = [f"c{i}" for i in range(len(TEXTS))]
+    store.add_texts(TEXTS, metadatas, ids=ids)
+    
+    keyword_index = KeywordIndex(str(tmp_path))
+    keyword_index.add(ids, TEXTS, metadatas)
+    return store, keyword_index
+
+def retriever(store, **settings):
+    vectorstore, keyword_index = store
+    return SimilarityRetriever(vectorstore=vectorstore, keyword_index=keyword_index, mode="hybrid",
+                               pack_context=False, reranker=None, metadata_index=None, **settings)
+
+def test_identifier_match_bypasses_threshold(store):
+    docs = retriever(store, threshold=0.99, adaptive=False).invoke("What is the AB-1234?")
+    assert [doc.id for doc in docs] == ["c0"]
+
+def test_common_words_do_not_bypass_threshold(store):
+    docs = retriever(store, threshold=0.6, adaptive=False).invoke("what is the product warranty")
+    assert [doc.id for doc in docs] == ["c1"]
+
+def test_relevance_floor_spares_identifier_matches(store):
+    floor = retriever(store, adaptive=True, relevance_floor=0.99)
+    assert floor.invoke("what is the product warranty") == []
+    assert [doc.id for doc in floor.invoke("What is the AB-1234?")] == ["c0"]
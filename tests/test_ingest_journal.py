@@ -0,0 +1,67 @@
+import os
+import pytest
+from langchain_core.documents import Document
+from ingest_journal import IngestJournal, JOURNAL_FILE
+from db_setup import uncommitted_chunks
+
+ENTRY = {"hash": "abc", "mtime": 1.0, "size": 10}
+
+def chunks(filename="a.docx", count=5):
+    return [Document(page_content=f"chunk {i}", metadata={"source_file": filename}) for i in range(count)]
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = IngestJournal(str(tmp_path))
+    journal.add_file("a.docx", ENTRY)
+    return journal
+
+def crash(journal):
+    """Drop the journal without finish(), like a killed db_setup.py run"""
+    journal.handle.close()
+    return IngestJournal(os.path.dirname(journal.path)).load()
+
+def test_resume_skips_committed_chunks(journal):
+    first = list(uncommitted_chunks(journal, chunks(), 500, 50))
+    journal.commit({"a.docx": [chunk.id for chunk in first[:3]]})
+    
+    resumed = crash(journal)
+    remaining = list(uncommitted_chunks(resumed, chunks(), 500, 50))
+    
+    # The same chunk of the same file version gets the same id, so only the uncommitted ones come back
+    assert [chunk.id for chunk in remaining] == [chunk.id for chunk in first[3:]]
+    assert resumed.entry("a.docx") == ENTRY
+    assert resumed.unfinished_files() == ["a.docx"]
+    
+    resumed.commit({"a.docx": [chunk.id for chunk in remaining]})
+    resumed.parsed("a.docx", 5)
+    assert resumed.done_files() == {"a.docx": ENTRY}
+
+def test_other_file_version_gets_new_ids(journal, tmp_path):
+    ids = [chunk.id for chunk in uncommitted_chunks(journal, chunks(), 500, 50)]
+    
+    os.makedirs(tmp_path / "other")
+    other = IngestJournal(str(tmp_path / "other"))
+    other.add_file("a.docx", {**ENTRY, "hash": "def"})
+    assert not set(ids) & {chunk.id for chunk in uncommitted_chunks(other, chunks(), 500, 50)}
+
+def test_torn_line_is_ignored(journal):
+    journal.commit({"a.docx": ["c0", "c1"]})
+    journal.handle.write('{"event": "batch", "files": {"a.docx": ["c2"')
+    journal.handle.flush()
+    
+    resumed = crash(journal)
+    assert resumed.committed("a.docx") == {"c0", "c1"}
+    
+    # The torn tail is cut off, so records appended after it replay
+    resumed.commit({"a.docx": ["c3"]})
+    resumed.handle.close()
+    assert IngestJournal(os.path.dirname(journal.path)).load().committed("a.docx") == {"c0", "c1", "c3"}
+
+def test_finish_clears_state(journal):
+    journal.commit({"a.docx": ["c0"]}, updated=["s0"])
+    journal.finish()
+    
+    assert not journal.exists()
+    assert not os.path.exists(os.path.join(os.path.dirname(journal.path), JOURNAL_FILE))
+    assert journal.files == {} and journal.uncheckpointed == [] and journal.updated == []
+    assert IngestJournal(os.path.dirname(journal.path)).load().files == {}
@@ -0,0 +1,17 @@
+from keyword_index import KeywordIndex
+
+def test_re_adding_replaces_chunk(tmp_path):
+    index = KeywordIndex(str(tmp_path))
+    index.add(["a", "b"], ["pump seal leak", "valve"], [{"source_file": "x.pdf"}, {"source_file": "y.pdf"}])
+    
+    # A resumed ingestion replays chunks that are already in the saved index
+    index.add(["a"], ["pump gasket"], [{"source_file": "x.pdf"}])
+    
+    assert index.total_len == 3
+    assert index.doc_len == {"a": 2, "b": 1}
+    assert "seal" not in index.postings
+    assert [cid for cid, _ in index.search("gasket")] == ["a"]
+    
+    index.remove_file("x.pdf")
+    assert index.total_len == 1
+    assert "pump" not in index.postings
@@ -0,0 +1,72 @@
+import os
+import pytest
+import manifest as manifest_module
+from manifest import (file_entry, file_hash, failed_entry, indexed_files, load_manifest, save_manifest,
+                      scan_changes)
+
+@pytest.fixture
+def docs(tmp_path):
+    """A docs folder with a manifest entry for each of its files"""
+    for name in ("a.pdf", "b.pdf", "c.pdf", "d.pdf"):
+        (tmp_path / name).write_text(f"contents of {name}")
+    manifest = {name: file_entry(str(tmp_path / name)) for name in os.listdir(tmp_path)}
+    return tmp_path, manifest
+
+def touch(path, seconds=10):
+    stat = os.stat(path)
+    os.utime(path, (stat.st_atime, stat.st_mtime + seconds))
+
+def scan(docs_dir, manifest):
+    return scan_changes(str(docs_dir), sorted(os.listdir(docs_dir)), manifest)
+
+def test_unchanged_files_are_not_read(docs, monkeypatch):
+    docs_dir, manifest = docs
+    hashed = []
+    monkeypatch.setattr(manifest_module, "file_hash", lambda path: hashed.append(path) or file_hash(path))
+    
+    assert scan(docs_dir, manifest) == ([], [], [], {})
+    assert hashed == []
+
+def test_new_modified_touched_and_removed(docs):
+    docs_dir, manifest = docs
+    (docs_dir / "e.pdf").write_text("a new file")
+    (docs_dir / "b.pdf").write_text("b, second edition")
+    touch(docs_dir / "c.pdf")
+    os.remove(docs_dir / "d.pdf")
+    before = dict(manifest)
+    
+    new, modified, removed, hashes = scan(docs_dir, manifest)
+    assert (new, modified, removed) == (["e.pdf"], ["b.pdf"], ["d.pdf"])
+    assert hashes == {"e.pdf": file_hash(str(docs_dir / "e.pdf")), "b.pdf": file_hash(str(docs_dir / "b.pdf"))}
+    
+    # Only the touched file's entry changes, to the new mtime, so the next scan skips it unread
+    assert manifest["c.pdf"] == {**before["c.pdf"], "mtime": os.stat(docs_dir / "c.pdf").st_mtime}
+    assert {name: manifest[name] for name in ("a.pdf", "b.pdf", "d.pdf")} == \
+           {name: before[name] for name in ("a.pdf", "b.pdf", "d.pdf")}
+    assert "e.pdf" not in manifest
+
+def test_failed_file_is_retried_once_its_hash_changes(docs):
+    docs_dir, manifest = docs
+    manifest["a.pdf"] = failed_entry(manifest["a.pdf"])
+    assert sorted(indexed_files(manifest)) == ["b.pdf", "c.pdf", "d.pdf"]
+    
+    # Touched but the same contents: still skipped, still failed
+    touch(docs_dir / "a.pdf")
+    assert scan(docs_dir, manifest) == ([], [], [], {})
+    assert manifest["a.pdf"]["failed"]
+    assert manifest["a.pdf"]["mtime"] == os.stat(docs_dir / "a.pdf").st_mtime
+    
+    (docs_dir / "a.pdf").write_text("a, fixed")
+    new, modified, removed, hashes = scan(docs_dir, manifest)
+    assert (new, modified, removed) == ([], ["a.pdf"], [])
+    assert hashes == {"a.pdf": file_hash(str(docs_dir / "a.pdf"))}
+
+def test_save_and_load(docs, tmp_path):
+    _, manifest = docs
+    db_dir = tmp_path / "db"
+    db_dir.mkdir()
+    assert load_manifest(str(db_dir)) is None
+    
+    save_manifest(manifest, str(db_dir))
+    assert load_manifest(str(db_dir)) == manifest
+    assert os.listdir(db_dir) == ["manifest.json"]
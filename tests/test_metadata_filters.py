@@ -0,0 +1,98 @@
+import os
+from datetime import datetime
+import pytest
+from metadata_index import MetadataIndex, parse_filters, filters_to_where
+
+def test_parse_filters():
+    assert parse_filters(None) is None
+    assert parse_filters({}) is None
+    assert parse_filters({"source_file": None}) is None
+    assert parse_filters({
+        "source_file": "a.pdf",
+        "file_type": ["pdf", "docx"],
+        "page_min": "3",
+        "page_max": 10,
+        "ingested_after": "2025-01-31",
+        "ingested_before": 1738300000
+    }) == {
+        "source_file": {"a.pdf"},
+        "file_type": {"pdf", "docx"},
+        "page_min": 3,
+        "page_max": 10,
+        "ingested_after": datetime(2025, 1, 31).timestamp(),
+        "ingested_before": 1738300000.0
+    }
+
+@pytest.mark.parametrize("raw, message", [
+    ("a.pdf", "filters must be an object"),
+    ({"colour": "red"}, "Unknown filters: colour"),
+    ({"page_min": "three"}, "Invalid filter value"),
+    ({"page_max": [1, 2]}, "Invalid filter value"),
+    ({"ingested_after": "last week"}, "Invalid filter value"),
+])
+def test_parse_filters_rejects(raw, message):
+    with pytest.raises(ValueError, match=message):
+        parse_filters(raw)
+
+def test_filters_to_where():
+    assert filters_to_where({}) is None
+    assert filters_to_where({"source_file": {"b.pdf", "a.pdf"}}) == {"source_file": {"$in": ["a.pdf", "b.pdf"]}}
+    assert filters_to_where({"file_type": {"pdf"}, "page_min": 2, "page_max": 4, "ingested_after": 5.0}) == {"$and": [
+        {"file_type": {"$in": ["pdf"]}},
+        {"page": {"$gte": 2}},
+        {"page": {"$lte": 4}},
+        {"ingested_at": {"$gte": 5.0}}
+    ]}
+
+@pytest.fixture
+def index(tmp_path):
+    index = MetadataIndex(str(tmp_path))
+    index.add(["a0", "a1", "a2"], [""] * 3, [{"source_file": "a.pdf", "page": p, "file_type": "pdf", "ingested_at": 100}
+                                           for p in (0, 1, None)])
+    index.add(["b0"], [""], [{"source_file": "b.docx", "page": 0, "file_type": "docx", "ingested_at": 200}])
+    index.add(["old"], [""], [{"source_file": "old.pdf", "page": 0, "file_type": "pdf"}])
+    
+    # Stored once, deduplicated from a.pdf page 5 and c.pdf page 2
+    index.add(["dup"], [""], [{"source_file": "a.pdf", "page": 5, "file_type": "pdf", "ingested_at": 100,
+                               "references": '[["a.pdf", 5, "pdf"], ["c.pdf", 2, "pdf"]]'}])
+    return index
+
+def candidates(index, filters):
+    return sorted(index.candidates(filters))
+
+def test_candidates(index):
+    assert candidates(index, {"source_file": {"b.docx", "missing.pdf"}}) == ["b0"]
+    assert candidates(index, {"file_type": {"pdf"}}) == ["a0", "a1", "a2", "dup", "old"]
+    assert candidates(index, {"source_file": {"a.pdf"}, "page_min": 1}) == ["a1", "dup"]
+    assert candidates(index, {"source_file": {"a.pdf"}, "page_max": 0}) == ["a0"]
+    
+    # Chunks without an ingestion date never match a date filter
+    assert candidates(index, {"ingested_after": 150}) == ["b0"]
+    assert candidates(index, {"ingested_before": 150}) == ["a0", "a1", "a2", "dup"]
+    
+    # A deduplicated chunk is found under every file it came from, once
+    assert candidates(index, {"source_file": {"c.pdf"}}) == ["dup"]
+    assert index.candidates({"source_file": {"a.pdf", "c.pdf"}, "page_min": 2}) == ["dup"]
+
+def test_candidates_after_reload_and_remove(index):
+    index.save()
+    reloaded = MetadataIndex(os.path.dirname(index.path)).load()
+    assert candidates(reloaded, {"source_file": {"a.pdf"}}) == ["a0", "a1", "a2", "dup"]
+    
+    reloaded.remove_file("a.pdf")
+    assert candidates(reloaded, {"source_file": {"a.pdf"}}) == []
+    assert candidates(reloaded, {"source_file": {"c.pdf"}}) == ["dup"]
+
+@pytest.mark.parametrize("endpoint", ["/api/search", "/api/search/stream", "/api/search/batch"])
+@pytest.mark.parametrize("filters", ["a.pdf", {"colour": "red"}, {"page_min": "three"}])
+def test_invalid_filters_are_400(served, endpoint, filters):
+    client, _ = served
+    response = client.post(endpoint, json={"question": "pump", "questions": ["pump"], "filters": filters})
+    assert response.status_code == 400
+    assert response.get_json()["error"]
+
+def test_filtered_search(served):
+    client, _ = served
+    response = client.post("/api/search", json={"question": "pump", "filters": {"page_min": 2}})
+    assert response.status_code == 200
+    assert response.get_json()["sources"] == ["manual.pdf (p.2)"]
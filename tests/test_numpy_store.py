@@ -0,0 +1,46 @@
+import numpy as np
+from fake_ollama import FakeEmbeddings
+from numpy_store import NumpyVectorStore
+
+def open_store(path):
+    return NumpyVectorStore("test", FakeEmbeddings(dim=4), str(path))
+
+def add(store, chunk_id, vector):
+    store.add_embeddings([chunk_id], [vector], [chunk_id], [{"source_file": "doc.pdf"}])
+
+def vector_of(store, chunk_id):
+    return store.get(ids=[chunk_id], include=['embeddings'])['embeddings'][0]
+
+def test_torn_vector_append(tmp_path):
+    store = open_store(tmp_path)
+    add(store, "a", [1, 0, 0, 0])
+    
+    # Crash half way through appending a vector, before its row
+    with open(store.vectors_path, 'ab') as f:
+        f.write(b"\0" * 6)
+    
+    store = open_store(tmp_path)
+    add(store, "g", [0.697, 0.4245, -0.163, 0.554])
+    
+    store = open_store(tmp_path)
+    assert store.count() == 2
+    np.testing.assert_allclose(vector_of(store, "a"), [1, 0, 0, 0])
+    np.testing.assert_allclose(vector_of(store, "g"), [0.697, 0.4245, -0.163, 0.554], atol=1e-3)
+
+def test_torn_row_append(tmp_path):
+    store = open_store(tmp_path)
+    add(store, "a", [1, 0, 0, 0])
+    
+    # Crash after the vector was written but half way through its row line
+    with open(store.vectors_path, 'ab') as f:
+        f.write(np.array([0, 1, 0, 0], dtype=np.float32).tobytes())
+    with open(store.rows_path, 'ab') as f:
+        f.write(b'{"id": "b", "docu')
+    
+    store = open_store(tmp_path)
+    assert store.get()['ids'] == ["a"]
+    add(store, "c", [0, 0, 1, 0])
+    
+    store = open_store(tmp_path)
+    assert store.get()['ids'] == ["a", "c"]
+    np.testing.assert_allclose(vector_of(store, "c"), [0, 0, 1, 0])
@@ -0,0 +1,97 @@
+import time
+import socket
+import httpx
+import pytest
+from concurrent.futures import ThreadPoolExecutor
+from ollama import ResponseError
+from stub_ollama import serve
+import ollama_pool
+from ollama_pool import BackendPool, PooledOllamaLLM, PooledEmbeddings
+
+@pytest.fixture
+def stubs():
+    servers = [serve(0, dim=16, output_tokens=5) for _ in range(2)]
+    yield servers
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+def url(server):
+    return f"http://127.0.0.1:{server.server_address[1]}"
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def pooled_llm(pool):
+    llm = PooledOllamaLLM(model="stub")
+    llm._pool = pool
+    return llm
+
+def generations(server):
+    return server.state.stats()["requests"].get("/api/generate", 0)
+
+def test_failover_and_health_recovery(stubs):
+    broken, working = stubs
+    broken.state.fail_rate = 1.0
+    pool = BackendPool([{"url": url(broken)}, {"url": url(working)}], health_interval=0.2)
+    llm = pooled_llm(pool)
+    
+    assert llm.invoke("hello")
+    assert [b.healthy for b in pool.backends] == [False, True]
+    
+    # Down backends get no traffic until they are probed again
+    llm.invoke("hello")
+    assert generations(broken) == 1
+    
+    broken.state.fail_rate = 0.0
+    time.sleep(0.3)
+    llm.invoke("hello")
+    assert [b.healthy for b in pool.backends] == [True, True]
+    assert generations(broken) == 2
+
+def test_unreachable_backend_fails_over(stubs):
+    pool = BackendPool([{"url": f"http://127.0.0.1:{free_port()}"}, {"url": url(stubs[0])}], health_interval=60)
+    embeddings = PooledEmbeddings("stub", pool)
+    
+    assert len(embeddings.embed_query("hello")) == 16
+    assert [b.healthy for b in pool.backends] == [False, True]
+
+def test_read_timeout_keeps_backend_up(stubs):
+    slow, other = stubs
+    slow.state.token_latency = 1.0
+    pool = BackendPool([{"url": url(slow)}, {"url": url(other)}], generation_timeout=0.2)
+    
+    with pytest.raises(httpx.ReadTimeout):
+        pooled_llm(pool).invoke("hello")
+    assert [b.healthy for b in pool.backends] == [True, True]
+    assert generations(other) == 0
+
+def test_client_error_keeps_backend_up(stubs):
+    pool = BackendPool([{"url": url(server)} for server in stubs])
+    
+    def missing_model(backend):
+        raise ResponseError("model 'stub' not found", 404)
+    
+    with pytest.raises(ResponseError):
+        pool.call(missing_model)
+    assert [b.healthy for b in pool.backends] == [True, True]
+    assert sum(b.requests for b in pool.backends) == 1
+
+@pytest.mark.parametrize("pooled", [pooled_llm, lambda pool: PooledEmbeddings("stub", pool)])
+def test_concurrent_first_requests_share_one_client(monkeypatch, pooled):
+    created = []
+    def slow_client(**kwargs):
+        time.sleep(0.05)    # Holds the race window open
+        created.append(kwargs["base_url"])
+        return object()
+    monkeypatch.setattr(ollama_pool, "OllamaLLM", slow_client)
+    monkeypatch.setattr(ollama_pool, "OllamaEmbeddings", slow_client)
+    
+    pool = BackendPool([{"url": "http://127.0.0.1:1"}])
+    model = pooled(pool)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        clients = list(executor.map(lambda _: model.client(pool.backends[0]), range(8)))
+    assert created == ["http://127.0.0.1:1"]
+    assert all(client is clients[0] for client in clients)
@@ -0,0 +1,52 @@
+import json
+from admission import AdmissionGate
+
+def slow_llm(server, seconds_per_token):
+    server.qa_chain.combine_documents_chain.llm_chain.llm.output_token_latency = seconds_per_token
+
+def test_batch_caches_each_items_own_latency(served, monkeypatch):
+    client, server = served
+    slow_llm(server, 0.02)      # 5 tokens, ~0.1s per answer
+    monkeypatch.setattr(server, "BATCH_LLM_CONCURRENCY", 4)
+    monkeypatch.setattr(server, "llm_gate", AdmissionGate(max_concurrent=1, max_queued=8))
+    
+    questions = ["pump part", "inlet seal", "warranty", "pump leaks"]
+    response = client.post("/api/search/batch", json={"questions": questions})
+    lines = [json.loads(line) for line in response.get_data(as_text=True).splitlines()]
+    assert all("answer" in line for line in lines)
+    
+    # The answers ran one at a time; the ones that waited don't count the wait
+    latencies = [entry['latency'] for entry in server.answer_cache.entries.values()]
+    assert len(latencies) == len(questions)
+    assert all(0.08 < latency < 0.2 for latency in latencies)
+
+def test_full_queue_is_429_with_retry_after(served, monkeypatch):
+    client, server = served
+    monkeypatch.setattr(server, "llm_gate", AdmissionGate(max_concurrent=1, max_queued=0))
+    started = server.llm_gate.acquire()
+    
+    for endpoint in ("/api/search", "/api/search/stream"):
+        response = client.post(endpoint, json={"question": "pump part"})
+        assert response.status_code == 429
+        assert int(response.headers["Retry-After"]) >= 1
+        assert response.get_json()["retry_after"] == int(response.headers["Retry-After"])
+    
+    server.llm_gate.release(started)
+    assert client.post("/api/search", json={"question": "pump part"}).status_code == 200
+    assert server.llm_gate.stats()["rejected"] == 2
+
+def test_disconnect_mid_stream_releases_the_slot(served, monkeypatch):
+    client, server = served
+    slow_llm(server, 0.05)
+    monkeypatch.setattr(server, "llm_gate", AdmissionGate(max_concurrent=1, max_queued=0))
+    
+    response = client.post("/api/search/stream", json={"question": "pump part"}, buffered=False)
+    events = iter(response.response)
+    assert next(events).startswith(b"event: sources")
+    assert next(events).startswith(b"event: token")
+    assert server.llm_gate.stats()["active"] == 1
+    
+    # The client goes away before the answer is done
+    response.close()
+    assert server.llm_gate.stats()["active"] == 0
+    assert client.post("/api/search", json={"question": "inlet seal"}).status_code == 200
@@ -0,0 +1,74 @@
+import os
+import numpy as np
+import pytest
+import database
+from fake_ollama import FakeEmbeddings
+from numpy_store import NumpyVectorStore
+from snapshot import export_snapshot, import_snapshot, SnapshotReader, TRAILER
+
+TEXTS = [f"Chunk {i} about pump part AB-{i:04d}" for i in range(25)]
+METADATAS = [{"source_file": f"doc{i % 3}.pdf", "page": i, "file_type": "pdf"} for i in range(25)]
+
+@pytest.fixture
+def snapshot(tmp_path):
+    store = NumpyVectorStore("source", FakeEmbeddings(dim=32), str(tmp_path / "source"))
+    store.add_texts(TEXTS, METADATAS, ids=[f"c{i}" for i in range(len(TEXTS))])
+    path = str(tmp_path / "all.snap")
+    export_snapshot(store, path, str(tmp_path / "source"), embedding_model="fake", page_size=10)
+    return store, path
+
+def contents(store):
+    stored = store.get(include=['embeddings', 'documents', 'metadatas'])
+    order = np.argsort(stored['ids'])
+    return ([stored['ids'][i] for i in order], np.asarray(stored['embeddings'])[order],
+            [stored['documents'][i] for i in order], [stored['metadatas'][i] for i in order])
+
+@pytest.mark.parametrize("backend", ["chroma", "numpy"])
+def test_round_trip(snapshot, tmp_path, monkeypatch, backend):
+    monkeypatch.setattr(database, "VECTOR_BACKEND", backend)
+    source, path = snapshot
+    assert import_snapshot(path, str(tmp_path / "copy"), "copy", embedding_model="fake") == len(TEXTS)
+    
+    copy = database.create_vectorstore(str(tmp_path / "copy"), "copy", "fake", embedder=FakeEmbeddings(dim=32))
+    ids, vectors, texts, metadatas = contents(copy)
+    source_ids, source_vectors, source_texts, source_metadatas = contents(source)
+    assert ids == source_ids
+    np.testing.assert_allclose(vectors, source_vectors, rtol=1e-6)
+    assert texts == source_texts
+    assert metadatas == source_metadatas
+
+def corrupt(path, offset):
+    with open(path, 'r+b') as f:
+        f.seek(offset)
+        byte = f.read(1)
+        f.seek(offset)
+        f.write(bytes([byte[0] ^ 0xFF]))
+
+def test_corrupt_block_fails_before_loading(snapshot, tmp_path, monkeypatch):
+    monkeypatch.setattr(database, "VECTOR_BACKEND", "numpy")
+    _, path = snapshot
+    last_page = SnapshotReader(path).footer["pages"][-1]
+    corrupt(path, last_page["texts"][0] + 3)
+    
+    with pytest.raises(ValueError, match="Checksum mismatch in texts"):
+        import_snapshot(path, str(tmp_path / "copy"), "copy", embedding_model="fake")
+    
+    # The earlier, intact blocks weren't loaded either
+    copy = database.create_vectorstore(str(tmp_path / "copy"), "copy", "fake", embedder=FakeEmbeddings(dim=32))
+    assert database.collection_count(copy) == 0
+
+def test_corrupt_footer_fails(snapshot, tmp_path):
+    _, path = snapshot
+    corrupt(path, os.path.getsize(path) - TRAILER.size - 5)
+    
+    with pytest.raises(ValueError, match="footer"):
+        import_snapshot(path, str(tmp_path / "copy"), "copy", embedding_model="fake")
+    assert not os.path.exists(tmp_path / "copy")
+
+def test_truncated_snapshot_fails(snapshot, tmp_path):
+    _, path = snapshot
+    with open(path, 'r+b') as f:
+        f.truncate(os.path.getsize(path) // 2)
+    
+    with pytest.raises(ValueError, match="truncated"):
+        SnapshotReader(path)